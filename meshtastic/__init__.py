@@ -3,6 +3,8 @@
 
 Primary interfaces: SerialInterface, TCPInterface, BLEInterface
 
+asyncio interfaces: AsyncSerialInterface, AsyncTCPInterface (see `meshtastic.asyncio_interface`)
+
 Install with pip: "[pip3 install meshtastic](https://pypi.org/project/meshtastic/)"
 
 Source code on [github](https://github.com/meshtastic/python)
@@ -12,6 +14,8 @@ notable properties of interface classes:
 - `nodes` - The database of received nodes.  Includes always up-to-date location and username information for each
 node in the mesh.  This is a read-only datastructure.
 - `nodesByNum` - like "nodes" but keyed by nodeNum instead of nodeId. As such, includes "unknown" nodes which haven't seen a User packet yet
+- `lastReceivedRetention` - how much of the last packet from each node to keep in its "lastReceived": "full" (the default), "summary" or "none".
+On a big mesh "full" costs a packet's worth of memory per node, memory-constrained clients can keep just the header and portnum with "summary"
 - `myInfo` & `metadata` - Contain read-only information about the local radio device (software version, hardware version, etc)
 - `localNode` - Pointer to a node object for the local node
 
@@ -33,8 +37,16 @@ type of packet, you should subscribe to the full topic name.  If you want to see
 - `meshtastic.receive.position(packet)`
 - `meshtastic.receive.user(packet)`
 - `meshtastic.receive.data.portnum(packet)` (where portnum is an integer or well known PortNum enum)
+- `meshtastic.raw.receive.text(packet, decoded)` (and `.position`, `.data.portnum`, etc) - only published if the
+interface's `publishRaw` is set.  `packet` is the received `MeshPacket` protobuf and `decoded` the parsed payload
+protobuf (or None if there is none, such as for text).  No dictionaries are built for these, so if these are all you
+subscribe to, also clear `publishDicts` to skip the `meshtastic.receive` topics entirely.
 - `meshtastic.node.updated(node = NodeInfo)` - published when a node in the DB changes (appears, location changed, username changed, etc...)
+- `meshtastic.node.changed(node, changes, seq)` - published for every change to the node DB, with just the keys that changed
+(`changes` is None if the node was removed), see `meshtastic.node_journal`
 - `meshtastic.log.line(line)` - a raw unparsed log line from the radio
+- `meshtastic.transfer.received(data, fromId, transferId, interface)` - a payload another node sent us with `sendLargeData`,
+once all of its fragments have arrived (see `meshtastic.transfer`)
 - `meshtastic.clientNotification(notification, interface) - a ClientNotification sent from the radio
 
 We receive position, user, or data packets from the mesh.  You probably only care about `meshtastic.receive.data`.  The first argument for
@@ -86,6 +98,9 @@ from pubsub import pub # type: ignore[import-untyped]
 from tabulate import tabulate
 
 from meshtastic.node import Node
+from meshtastic.node_record import RETAIN_FULL, retainPacket
+from meshtastic.topology import UNKNOWN_SNR
+from meshtastic.transfer import TRANSFER_PORTNUM
 from meshtastic.util import DeferredExecution, Timeout, catchAndIgnore, fixme, stripnl
 
 from .protobuf import (
@@ -139,7 +154,13 @@ class ResponseHandler(NamedTuple):
     callback: Callable
     #: Whether ACKs and NAKs should be passed to this handler
     ackPermitted: bool = False
-    # FIXME, add timestamp and age out old requests
+    #: time.monotonic() when the request was sent
+    created: float = 0.0
+    #: time.monotonic() after which we give up waiting, or None to wait forever
+    deadline: Optional[float] = None
+    #: called instead of callback when the deadline passes, if set; otherwise
+    #: callback gets a routing packet with errorReason TIMEOUT, like a NAK
+    onExpired: Optional[Callable[[], Any]] = None
 
 
 class KnownProtocol(NamedTuple):
@@ -161,7 +182,7 @@ def _onTextReceive(iface, asDict):
     #
     # Usually btw this problem is caused by apps sending binary data but setting the payload type to
     # text.
-    logger.debug(f"in _onTextReceive() asDict:{asDict}")
+    logger.debug("in _onTextReceive() asDict:%s", asDict)
     try:
         asBytes = asDict["decoded"]["payload"]
         asDict["decoded"]["text"] = asBytes.decode("utf-8")
@@ -172,13 +193,13 @@ def _onTextReceive(iface, asDict):
 
 def _onPositionReceive(iface, asDict):
     """Special auto parsing for received messages"""
-    logger.debug(f"in _onPositionReceive() asDict:{asDict}")
+    logger.debug("in _onPositionReceive() asDict:%s", asDict)
     if "decoded" in asDict:
         if "position" in asDict["decoded"] and "from" in asDict:
             p = asDict["decoded"]["position"]
-            logger.debug(f"p:{p}")
+            logger.debug("p:%s", p)
             p = iface._fixupPosition(p)
-            logger.debug(f"after fixup p:{p}")
+            logger.debug("after fixup p:%s", p)
             # For the local node, only accept position updates with equal
             # or better precision. The local GPS is authoritative, and
             # low-precision echoes from the mesh (e.g., map reports relayed
@@ -195,33 +216,34 @@ def _onPositionReceive(iface, asDict):
                 existing_precision = existing.get("precisionBits", 0) or 0
                 new_precision = p.get("precisionBits", 0) or 0
                 if existing_precision == 0 or new_precision >= existing_precision:
-                    node["position"] = p
+                    iface._updateNode(node, {"position": p})
                 else:
                     logger.debug(
                         f"Ignoring low-precision position echo for local node "
                         f"({new_precision} < {existing_precision})"
                     )
             else:
-                node["position"] = p
+                iface._updateNode(node, {"position": p})
 
 
 def _onNodeInfoReceive(iface, asDict):
     """Special auto parsing for received messages"""
-    logger.debug(f"in _onNodeInfoReceive() asDict:{asDict}")
+    logger.debug("in _onNodeInfoReceive() asDict:%s", asDict)
     if "decoded" in asDict:
         if "user" in asDict["decoded"] and "from" in asDict:
             p = asDict["decoded"]["user"]
             # decode user protobufs and update nodedb, provide decoded version as "position" in the published msg
             # update node DB as needed
             n = iface._getOrCreateByNum(asDict["from"])
-            n["user"] = p
+            iface._updateNode(n, {"user": p})
             # We now have a node ID, make sure it is up-to-date in that table
             iface.nodes[p["id"]] = n
+            iface.nodeIndex.update(n)
             _receiveInfoUpdate(iface, asDict)
 
 def _onTelemetryReceive(iface, asDict):
     """Automatically update device metrics on received packets"""
-    logger.debug(f"in _onTelemetryReceive() asDict:{asDict}")
+    logger.debug("in _onTelemetryReceive() asDict:%s", asDict)
     if "from" not in asDict:
         return
 
@@ -243,21 +265,70 @@ def _onTelemetryReceive(iface, asDict):
         return
 
     updateObj = telemetry.get(toUpdate)
-    newMetrics = node.get(toUpdate, {})
+    newMetrics = dict(node.get(toUpdate, {}))
     newMetrics.update(updateObj)
     logger.debug(f"updating {toUpdate} metrics for {asDict['from']} to {newMetrics}")
-    node[toUpdate] = newMetrics
+    iface._updateNode(node, {toUpdate: newMetrics})
+    history = getattr(iface, "telemetryHistory", None)
+    if history is not None:
+        history.record(asDict["from"], toUpdate, updateObj, telemetry.get("time") or asDict.get("rxTime"))
+
+def _onNeighborInfoReceive(iface, asDict):
+    """Add the links a node reports hearing to the mesh graph"""
+    graph = getattr(iface, "meshGraph", None)
+    neighborInfo = asDict.get("decoded", {}).get("neighborinfo")
+    if graph is None or neighborInfo is None:
+        return
+    info = neighborInfo["raw"]
+    reporter = info.node_id or asDict.get("from")
+    for neighbor in info.neighbors:
+        graph.addLink(neighbor.node_id, reporter, neighbor.snr)
+
+def _onTraceRouteReceive(iface, asDict):
+    """Add the links along a traced route to the mesh graph"""
+    graph = getattr(iface, "meshGraph", None)
+    traceroute = asDict.get("decoded", {}).get("traceroute")
+    if graph is None or traceroute is None or "raw" not in asDict:
+        return
+    meshPacket = asDict["raw"]
+    discovery = traceroute["raw"]
+    sender, receiver = getattr(meshPacket, "from"), meshPacket.to
+    if receiver == BROADCAST_NUM:
+        return
+
+    def snrs(values):
+        return [None if v == UNKNOWN_SNR else v / 4 for v in values]
+
+    if meshPacket.decoded.request_id:
+        # A response: the route went from whoever asked (receiver) to sender, and back
+        towards = [receiver, *discovery.route, sender]
+        graph.addRoute(towards, snrs(discovery.snr_towards) if len(discovery.snr_towards) == len(towards) - 1 else None)
+        if meshPacket.hop_start and len(discovery.snr_back) == len(discovery.route_back) + 1:
+            graph.addRoute([sender, *discovery.route_back, receiver], snrs(discovery.snr_back))
+    else:
+        # A request on its way to us, we know the SNR of the last hop ourselves
+        towards = [sender, *discovery.route, receiver]
+        graph.addRoute(towards, [*snrs(discovery.snr_towards)[: len(towards) - 2], meshPacket.rx_snr])
+
+def _onTransferReceive(iface, asDict):
+    """Hand fragments and acknowledgements of large payloads to the interface's transfers"""
+    transfers = getattr(iface, "transfers", None)
+    if transfers is not None and "raw" in asDict:
+        transfers.onPacket(asDict["raw"])
 
 def _receiveInfoUpdate(iface, asDict):
     if "from" in asDict:
-        iface._getOrCreateByNum(asDict["from"])["lastReceived"] = asDict
-        iface._getOrCreateByNum(asDict["from"])["lastHeard"] = asDict.get("rxTime")
-        iface._getOrCreateByNum(asDict["from"])["snr"] = asDict.get("rxSnr")
-        iface._getOrCreateByNum(asDict["from"])["hopLimit"] = asDict.get("hopLimit")
+        node = iface._getOrCreateByNum(asDict["from"])
+        lastReceived = retainPacket(asDict, getattr(iface, "lastReceivedRetention", RETAIN_FULL))
+        if lastReceived is not None:
+            node["lastReceived"] = lastReceived
+        iface._updateNode(
+            node, {"lastHeard": asDict.get("rxTime"), "snr": asDict.get("rxSnr"), "hopLimit": asDict.get("hopLimit")}
+        )
 
 def _onAdminReceive(iface, asDict):
     """Special auto parsing for received messages"""
-    logger.debug(f"in _onAdminReceive() asDict:{asDict}")
+    logger.debug("in _onAdminReceive() asDict:%s", asDict)
     if "decoded" in asDict and "from" in asDict and "admin" in asDict["decoded"]:
         adminMessage = asDict["decoded"]["admin"]["raw"]
         iface._getOrCreateByNum(asDict["from"])["adminSessionPassKey"] = adminMessage.session_passkey
@@ -292,7 +363,7 @@ protocols = {
     ),
     portnums_pb2.PortNum.SIMULATOR_APP: KnownProtocol("simulator", mesh_pb2.Compressed),
     portnums_pb2.PortNum.TRACEROUTE_APP: KnownProtocol(
-        "traceroute", mesh_pb2.RouteDiscovery
+        "traceroute", mesh_pb2.RouteDiscovery, _onTraceRouteReceive
     ),
     portnums_pb2.PortNum.POWERSTRESS_APP: KnownProtocol(
         "powerstress", powermon_pb2.PowerStressMessage
@@ -300,6 +371,9 @@ protocols = {
     portnums_pb2.PortNum.WAYPOINT_APP: KnownProtocol("waypoint", mesh_pb2.Waypoint),
     portnums_pb2.PortNum.PAXCOUNTER_APP: KnownProtocol("paxcounter", paxcount_pb2.Paxcount),
     portnums_pb2.PortNum.STORE_FORWARD_APP: KnownProtocol("storeforward", storeforward_pb2.StoreAndForward),
-    portnums_pb2.PortNum.NEIGHBORINFO_APP: KnownProtocol("neighborinfo", mesh_pb2.NeighborInfo),
+    portnums_pb2.PortNum.NEIGHBORINFO_APP: KnownProtocol(
+        "neighborinfo", mesh_pb2.NeighborInfo, _onNeighborInfoReceive
+    ),
     portnums_pb2.PortNum.MAP_REPORT_APP: KnownProtocol("mapreport", mqtt_pb2.MapReport),
+    TRANSFER_PORTNUM: KnownProtocol("transfer", None, _onTransferReceive),
 }
@@ -47,6 +47,7 @@ import meshtastic.tcp_interface
 from meshtastic import BROADCAST_ADDR, mt_config, remote_hardware
 from meshtastic.ble_interface import BLEInterface
 from meshtastic.mesh_interface import MeshInterface
+from meshtastic.node_table import FORMATS as NODES_FORMATS
 try:
     from meshtastic.powermon import (
         PowerMeter,
@@ -1107,12 +1108,16 @@ def onConnected(interface):
             if args.dest != BROADCAST_ADDR:
                 print("Showing node list of a remote node is not supported.")
                 return
-            interface.showNodes(True, args.show_fields)
+            interface.showNodes(True, args.show_fields, args.nodes_format, args.nodes_page_size)
 
         if args.show_fields and not args.nodes:
             print("--show-fields can only be used with --nodes")
             return
 
+        if (args.nodes_format != "table" or args.nodes_page_size) and not args.nodes:
+            print("--nodes-format and --nodes-page-size can only be used with --nodes")
+            return
+
         if args.qr or args.qr_all:
             closeNow = True
             url = interface.getNode(args.dest, True, **getNode_kwargs).getURL(includeAll=args.qr_all)
@@ -2193,6 +2198,16 @@ def addPositionConfigArgs(parser: argparse.ArgumentParser) -> argparse.ArgumentP
     )
     return parser
 
+def _positiveInt(value: str) -> int:
+    """argparse type for a count that must be at least 1"""
+    try:
+        result = int(value)
+    except ValueError:
+        result = 0
+    if result < 1:
+        raise argparse.ArgumentTypeError(f"must be a whole number of at least 1, not {value}")
+    return result
+
 def addLocalActionArgs(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     """Add arguments concerning local-only information & actions"""
     group = parser.add_argument_group(
@@ -2219,6 +2234,20 @@ def addLocalActionArgs(parser: argparse.ArgumentParser) -> argparse.ArgumentPars
         default=None
     )
 
+    group.add_argument(
+        "--nodes-format",
+        help="Output format for --nodes: a table (the default), a plain table without borders, csv or json",
+        choices=NODES_FORMATS,
+        default="table",
+    )
+
+    group.add_argument(
+        "--nodes-page-size",
+        help="With --nodes, print tables this many rows at a time, so the first rows of a big mesh show sooner",
+        type=_positiveInt,
+        default=None,
+    )
+
     return parser
 
 def addRemoteActionArgs(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
@@ -0,0 +1,227 @@
+"""Estimate LoRa time on air, and keep our transmissions within a duty cycle budget
+
+An AirtimeLimiter is a token bucket whose tokens are seconds of airtime. It
+refills at the duty cycle we are allowed (the region's legal limit, reduced
+when the radio reports the channel is busy), and each packet costs its time on
+air, worked out from the radio's LoRa settings. Give one to an interface and
+its TX scheduler holds packets back until the budget allows them::
+
+    iface.airtimeLimiter = AirtimeLimiter(iface)
+    ...
+    delay = iface.airtimeLimiter.timeUntilSend()
+"""
+import logging
+import math
+import threading
+import time
+from typing import Callable, Dict, NamedTuple, Optional
+
+from meshtastic.protobuf import config_pb2, mesh_pb2
+
+logger = logging.getLogger(__name__)
+
+_LoRaConfig = config_pb2.Config.LoRaConfig
+
+
+class LoRaParams(NamedTuple):
+    """The modulation settings that decide how long a packet takes to send"""
+
+    bandwidth: float  # kHz
+    spreadingFactor: int
+    codingRate: int  # denominator of the 4/x coding rate, 5 to 8
+
+
+# Matches modemPresetToParams() in the firmware
+MODEM_PRESETS: Dict[int, LoRaParams] = {
+    _LoRaConfig.SHORT_TURBO: LoRaParams(500, 7, 5),
+    _LoRaConfig.SHORT_FAST: LoRaParams(250, 7, 5),
+    _LoRaConfig.SHORT_SLOW: LoRaParams(250, 8, 5),
+    _LoRaConfig.MEDIUM_FAST: LoRaParams(250, 9, 5),
+    _LoRaConfig.MEDIUM_SLOW: LoRaParams(250, 10, 5),
+    _LoRaConfig.LONG_TURBO: LoRaParams(500, 11, 8),
+    _LoRaConfig.LONG_FAST: LoRaParams(250, 11, 5),
+    _LoRaConfig.LONG_MODERATE: LoRaParams(125, 11, 8),
+    _LoRaConfig.LONG_SLOW: LoRaParams(125, 12, 8),
+    _LoRaConfig.VERY_LONG_SLOW: LoRaParams(62.5, 12, 8),
+}
+DEFAULT_LORA_PARAMS = MODEM_PRESETS[_LoRaConfig.LONG_FAST]
+
+# The firmware stores some fractional bandwidths rounded down to a whole kHz
+_BANDWIDTHS = {31: 31.25, 62: 62.5, 200: 203.125, 400: 406.25, 800: 812.5, 1600: 1625.0}
+
+# Percent of the time a region lets us transmit, anything not listed is unrestricted
+REGION_DUTY_CYCLES: Dict[int, float] = {
+    _LoRaConfig.EU_433: 10.0,
+    _LoRaConfig.EU_868: 10.0,
+    _LoRaConfig.UA_433: 10.0,
+    _LoRaConfig.UA_868: 1.0,
+}
+
+PREAMBLE_LENGTH = 16  # symbols, what Meshtastic radios use
+HEADER_LENGTH = 16  # bytes of Meshtastic packet header ahead of the payload
+PKI_OVERHEAD = 12  # bytes the authentication tag and nonce add to a PKI encrypted payload
+
+# Above this channel utilization (percent) we back off, like the firmware does for its own sends
+DEFAULT_MAX_CHANNEL_UTIL = 25.0
+# The bucket holds at most this many seconds' worth of our budget, which bounds a burst
+DEFAULT_WINDOW = 60.0
+# However busy the channel, we are always allowed this much (percent), so sending slows down rather than stops
+MIN_DUTY_CYCLE = 1.0
+
+
+def timeOnAir(payloadLength: int, params: LoRaParams = DEFAULT_LORA_PARAMS, preambleLength: int = PREAMBLE_LENGTH) -> float:
+    """Seconds it takes to transmit a LoRa frame of payloadLength bytes
+
+    Uses the formula from the Semtech SX127x datasheet, with an explicit header
+    and CRC as Meshtastic sends them. Low data rate optimization is on whenever
+    a symbol is longer than 16 ms, which is when the radio turns it on.
+    """
+    sf = params.spreadingFactor
+    symbolTime = (2 ** sf) / (params.bandwidth * 1000)
+    lowDataRate = 1 if symbolTime > 0.016 else 0
+    bits = 8 * payloadLength - 4 * sf + 28 + 16
+    payloadSymbols = 8 + max(math.ceil(bits / (4 * (sf - 2 * lowDataRate))) * params.codingRate, 0)
+    return (preambleLength + 4.25 + payloadSymbols) * symbolTime
+
+
+def loraParams(lora: _LoRaConfig) -> LoRaParams:
+    """The modulation a LoRaConfig selects, either through its preset or its own settings"""
+    if lora.use_preset:
+        params = MODEM_PRESETS.get(lora.modem_preset)
+        if params is None:
+            logger.debug(f"No airtime parameters for modem preset {lora.modem_preset}, assuming LONG_FAST")
+            return DEFAULT_LORA_PARAMS
+        return params
+    if not (lora.bandwidth and lora.spread_factor and lora.coding_rate):
+        return DEFAULT_LORA_PARAMS
+    return LoRaParams(_BANDWIDTHS.get(lora.bandwidth, float(lora.bandwidth)), lora.spread_factor, lora.coding_rate)
+
+
+def packetLength(meshPacket: mesh_pb2.MeshPacket) -> int:
+    """Bytes a MeshPacket takes up on the air, header included"""
+    if meshPacket.HasField("decoded"):
+        length = meshPacket.decoded.ByteSize()
+    else:
+        length = len(meshPacket.encrypted)
+    if meshPacket.pki_encrypted:
+        length += PKI_OVERHEAD
+    return HEADER_LENGTH + length
+
+
+class AirtimeLimiter:
+    """Token bucket of airtime, refilled at the duty cycle we are allowed
+
+    The duty cycle is the region's limit (or dutyCycle if given) but never more
+    than the headroom the channel has left: with channel utilization reported
+    at 20% and maxChannelUtil at 25%, we keep to 5%. The same goes if our own
+    airUtilTx is already over the region's limit. Both come from the local
+    node's deviceMetrics telemetry, and the LoRa settings from
+    iface.localNode.localConfig.lora, read as they change.
+
+    A packet may go once the bucket holds its time on air, or once the bucket
+    is full, so a packet longer than the whole burst still goes out eventually.
+    """
+
+    def __init__(
+        self,
+        iface=None,
+        dutyCycle: Optional[float] = None,
+        window: float = DEFAULT_WINDOW,
+        maxChannelUtil: float = DEFAULT_MAX_CHANNEL_UTIL,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Constructor
+
+        Keyword Arguments:
+            iface -- Interface to take the LoRa config and telemetry from (default: none, use LONG_FAST)
+            dutyCycle -- Percent of the time we may transmit (default: the region's limit)
+            window -- Seconds of budget the bucket can save up for a burst
+            maxChannelUtil -- Channel utilization (percent) above which we stop adding to it
+        """
+        self.iface = iface
+        self.dutyCycle = dutyCycle
+        self.window = window
+        self.maxChannelUtil = maxChannelUtil
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._updated = clock()
+        self._tokens = self._capacity(self.allowedDutyCycle())
+        self.sent = 0.0  # seconds of airtime spent so far
+
+    def _loraConfig(self) -> Optional[_LoRaConfig]:
+        if self.iface is None:
+            return None
+        return self.iface.localNode.localConfig.lora
+
+    def _deviceMetrics(self) -> Dict:
+        if self.iface is None:
+            return {}
+        info = self.iface.getMyNodeInfo()
+        return (info or {}).get("deviceMetrics", {})
+
+    def params(self) -> LoRaParams:
+        """The modulation the radio is using"""
+        lora = self._loraConfig()
+        return DEFAULT_LORA_PARAMS if lora is None else loraParams(lora)
+
+    def regionDutyCycle(self) -> float:
+        """Percent of the time we may transmit before considering how busy the channel is"""
+        if self.dutyCycle is not None:
+            return self.dutyCycle
+        lora = self._loraConfig()
+        region = _LoRaConfig.UNSET if lora is None else lora.region
+        return REGION_DUTY_CYCLES.get(region, 100.0)
+
+    def allowedDutyCycle(self) -> float:
+        """Percent of the time we may transmit right now"""
+        allowed = self.regionDutyCycle()
+        metrics = self._deviceMetrics()
+        channelUtil = metrics.get("channelUtilization")
+        if channelUtil is not None:
+            allowed = min(allowed, self.maxChannelUtil - channelUtil)
+        airUtilTx = metrics.get("airUtilTx")
+        if airUtilTx is not None and airUtilTx >= self.regionDutyCycle():
+            allowed = MIN_DUTY_CYCLE
+        return max(allowed, MIN_DUTY_CYCLE)
+
+    def _capacity(self, dutyCycle: float) -> float:
+        return self.window * dutyCycle / 100
+
+    def timeOnAir(self, meshPacket: mesh_pb2.MeshPacket) -> float:
+        """Seconds meshPacket will take to transmit"""
+        return timeOnAir(packetLength(meshPacket), self.params())
+
+    def _refillLocked(self) -> float:
+        """Top up the bucket for the time since we last did, returns its capacity"""
+        dutyCycle = self.allowedDutyCycle()
+        capacity = self._capacity(dutyCycle)
+        now = self._clock()
+        self._tokens = min(capacity, self._tokens + (now - self._updated) * dutyCycle / 100)
+        self._updated = now
+        return capacity
+
+    def _waitLocked(self, cost: float) -> float:
+        capacity = self._refillLocked()
+        needed = min(cost, capacity) - self._tokens
+        if needed <= 0:
+            return 0.0
+        return needed * 100 / self.allowedDutyCycle()
+
+    def timeUntilSend(self, meshPacket: Optional[mesh_pb2.MeshPacket] = None) -> float:
+        """Seconds until meshPacket (or the largest packet, if None) fits in the budget, 0 if it does now"""
+        cost = self.timeOnAir(meshPacket) if meshPacket is not None else timeOnAir(255, self.params())
+        with self._lock:
+            return self._waitLocked(cost)
+
+    def consume(self, meshPacket: mesh_pb2.MeshPacket) -> float:
+        """Charge the budget for sending meshPacket, returns its time on air
+
+        The bucket may go negative if the packet was sent before it fitted,
+        which just pushes back the packets that follow.
+        """
+        cost = self.timeOnAir(meshPacket)
+        with self._lock:
+            self._refillLocked()
+            self._tokens -= cost
+            self.sent += cost
+        return cost
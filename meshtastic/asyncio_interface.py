@@ -0,0 +1,613 @@
+"""asyncio native interfaces (AsyncTCPInterface, AsyncSerialInterface)
+
+These run a whole radio connection - reads, writes, the TX queue, the
+heartbeat and timers such as response expiry - as tasks and callbacks on an
+asyncio event loop instead of per connection threads, so one service can hold many links. Packet decoding, the node DB and
+the pubsub events are shared with MeshInterface.
+
+```
+async with AsyncTCPInterface("meshtastic.local") as iface:
+    ack = await iface.sendText("hello mesh", "!12345678", wantAck=True)
+    route = await iface.sendTraceRoute("!12345678", hopLimit=3)
+```
+"""
+# pylint: disable=R0917
+import asyncio
+import contextlib
+import logging
+import sys
+import time
+from typing import Any, Callable, Optional, Tuple, Union
+
+import serial  # type: ignore[import-untyped]
+
+import meshtastic.util
+from meshtastic import BROADCAST_ADDR, LOCAL_ADDR
+from meshtastic.dispatcher import Dispatcher
+from meshtastic.mesh_interface import CLOSE_FLUSH_TIMEOUT, Cancellable, MeshInterface
+from meshtastic.node import Node
+from meshtastic.node_cache import NodeCache
+from meshtastic.outbox import Outbox
+from meshtastic.protobuf import mesh_pb2, portnums_pb2
+from meshtastic.serial_interface import SerialInterface
+from meshtastic.stream_interface import READ_CHUNK_SIZE, START2, StreamInterface
+from meshtastic.tcp_interface import DEFAULT_TCP_PORT
+from meshtastic.tx_scheduler import TxScheduler
+
+HEARTBEAT_INTERVAL = 300
+
+logger = logging.getLogger(__name__)
+
+
+class PacketFuture(asyncio.Future):
+    """Future returned by the async send methods
+
+    `packet` is the MeshPacket that was sent. The future resolves to the
+    response packet dictionary (or the ACK/NAK if only an ack was asked for).
+    """
+
+    packet: Optional[mesh_pb2.MeshPacket] = None
+
+
+class LoopTimer:
+    """A call_later on an event loop that can be set up, and cancelled, from any thread"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, delay: float, callback: Callable[[], None]) -> None:
+        self._loop = loop
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._cancelled = False
+        loop.call_soon_threadsafe(self._schedule, delay, callback)
+
+    def _schedule(self, delay: float, callback: Callable[[], None]) -> None:
+        if not self._cancelled:
+            self._handle = self._loop.call_later(delay, callback)
+
+    def _cancelOnLoop(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+
+    def cancel(self) -> None:
+        """Don't run the callback (if it has not run yet)"""
+        self._cancelled = True
+        with contextlib.suppress(RuntimeError):  # the loop is already closed
+            self._loop.call_soon_threadsafe(self._cancelOnLoop)
+
+
+class AsyncTxScheduler(TxScheduler):
+    """A TxScheduler driven by a task on the event loop rather than a thread"""
+
+    def __init__(self, iface, name: str = "async tx scheduler") -> None:
+        super().__init__(iface, name)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Start feeding the radio from a task on loop"""
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._task = loop.create_task(self._runAsync())
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued packet has been written. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                if (not self._pending and not self._writing) or self._closed:
+                    return True
+            if self._idle is None:
+                return False  # never started, nothing will drain the queue
+            self._idle.clear()
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._idle.wait(), remaining)
+
+    async def aclose(self) -> None:
+        """Stop the scheduler task and fail anything that was never written"""
+        self.close()
+        if self._task is not None:
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+
+    def _startLocked(self) -> None:
+        pass  # started explicitly by the interface once its loop is running
+
+    def _notifyLocked(self) -> None:
+        super()._notifyLocked()
+        if self._loop is not None and not self._loop.is_closed():
+            idle = not self._pending and not self._writing
+            self._loop.call_soon_threadsafe(self._signal, idle)
+
+    def _signal(self, idle: bool) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._idle is not None and idle:
+            self._idle.set()
+
+    async def _runAsync(self) -> None:
+        while True:
+            self._wakeup.clear()  # type: ignore[union-attr]
+            with self._cond:
+                if self._closed:
+                    return
+                batch = self._takeBatchLocked() if self._ready() else []
+                delay = self._airtimeWait()
+            if not batch:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    # if the airtime budget is holding packets back, look again once it has refilled
+                    await asyncio.wait_for(self._wakeup.wait(), delay if delay > 0 else None)  # type: ignore[union-attr]
+                continue
+            self._attempting(batch)
+            try:
+                self.iface._sendManyToRadioImpl([toRadio for _, toRadio, _ in batch])
+                await self.iface._drain()
+            except Exception as ex:
+                logger.error(f"Error while sending {len(batch)} packets: {ex}")
+                self._finishBatch(batch, ex)
+            else:
+                self._finishBatch(batch)
+
+
+class AsyncStreamInterface(StreamInterface):
+    """Base class for asyncio interfaces over a stream link
+
+    Subclasses provide _openTransport(). Call `await connect()` (or use
+    `async with`) to open the link and wait for the config download, and
+    `await close()` when done.
+    """
+
+    def __init__(
+        self,
+        debugOut=None,
+        noProto: bool = False,
+        noNodes: bool = False,
+        timeout: int = 300,
+        *,
+        dispatcher: Optional[Dispatcher] = None,
+        outbox: Optional[Outbox] = None,
+        nodeCache: Optional[NodeCache] = None,
+    ) -> None:
+        """Constructor, does not connect - await connect() for that
+
+        Keyword Arguments:
+            debugOut {stream} -- If a stream is provided, any debug output from the
+                                 device will be emitted to that stream. (default: {None})
+            timeout -- How long to wait for replies (default: 300 seconds)
+            dispatcher -- Delivers our pubsub messages, see meshtastic.dispatcher (default: {None})
+            outbox -- Keeps queued packets on disk across restarts, see meshtastic.outbox (default: {None})
+            nodeCache -- Keeps the node DB on disk between connections, see meshtastic.node_cache (default: {None})
+        """
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._readTask: Optional[asyncio.Task] = None
+        self._heartbeatTask: Optional[asyncio.Task] = None
+        self._configured: Optional[asyncio.Event] = None
+        StreamInterface.__init__(
+            self, debugOut=debugOut, noProto=noProto, connectNow=False, noNodes=noNodes, timeout=timeout,
+            dispatcher=dispatcher, outbox=outbox, nodeCache=nodeCache,
+        )
+        self.txScheduler: AsyncTxScheduler = AsyncTxScheduler(self)
+
+    def __enter__(self):
+        raise TypeError(f"{type(self).__name__} must be used with 'async with'")
+
+    async def __aenter__(self):
+        if self._writer is None:
+            await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, trace):
+        if exc_type is not None and exc_value is not None:
+            logger.error(
+                f"An exception of type {exc_type} with value {exc_value} has occurred"
+            )
+        await self.close()
+
+    async def _openTransport(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Open the underlying link, subclasses must provide this"""
+        raise NotImplementedError
+
+    async def connect(self) -> None:  # type: ignore[override] # pylint: disable=W0236
+        """Open the link and, unless noProto, wait for the config download"""
+        self._loop = asyncio.get_running_loop()
+        self._reader, self._writer = await self._openTransport()
+        self._wantExit = False
+        self.failure = None
+        self._configured = asyncio.Event()
+
+        # Wake a sleeping device and force its framer to resync, see StreamInterface.connect
+        self._writeBytes(bytes([START2] * 32))
+        await asyncio.sleep(0.1)  # wait 100ms to give device time to start running
+
+        self._readTask = self._loop.create_task(self._readLoop())
+        self.txScheduler.start(self._loop)
+        self._startConfig()
+
+        if not self.noProto:
+            await self.waitForConfig()
+
+    async def waitForConfig(self) -> None:  # pylint: disable=W0236
+        """Wait for the config download started by connect() to complete"""
+        if self._configured is None:
+            raise MeshInterface.MeshInterfaceError("Not connected, await connect() first")
+        try:
+            await asyncio.wait_for(self._configured.wait(), self._timeout.expireTimeout)
+        except asyncio.TimeoutError as ex:
+            raise MeshInterface.MeshInterfaceError(
+                "Timed out waiting for interface config"
+            ) from ex
+        if self.failure:
+            raise self.failure
+
+    async def close(self) -> None:  # type: ignore[override] # pylint: disable=W0236
+        """Close the connection to the device"""
+        logger.debug("Closing async stream")
+        if self._heartbeatTask is not None:
+            self._heartbeatTask.cancel()
+            self._heartbeatTask = None
+        self._stopBackgroundWork()
+
+        # give packets queued by the send methods a chance to reach the radio
+        if not await self.txScheduler.drain(timeout=CLOSE_FLUSH_TIMEOUT):
+            logger.warning(f"Closing with {len(self.txScheduler)} packets still queued")
+        await self.txScheduler.aclose()
+        self._sendDisconnect()
+
+        self._wantExit = True
+        writer = self._writer
+        if writer is not None:
+            with contextlib.suppress(Exception):
+                await writer.drain()
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+        if self._readTask is not None:
+            self._readTask.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._readTask
+            self._readTask = None
+
+    async def _readLoop(self) -> None:
+        """The reader task, feeds whatever arrives to the framer"""
+        logger.debug("in _readLoop()")
+        try:
+            while not self._wantExit and self._reader is not None:
+                data = await self._reader.read(READ_CHUNK_SIZE)
+                if not data:
+                    logger.debug("Connection closed by the device")
+                    break
+                self._framer.feed(data)
+        except (ConnectionError, OSError) as ex:
+            if not self._wantExit:
+                logger.warning(f"Meshtastic connection lost, disconnecting... {ex}")
+        finally:
+            logger.debug("reader is exiting")
+            self._disconnected()
+
+    def _disconnected(self) -> None:
+        """Tell clients we disconnected, and fail a config download in progress"""
+        MeshInterface._disconnected(self)
+        if self._configured is not None and not self._configured.is_set():
+            self.failure = MeshInterface.MeshInterfaceError(  # type: ignore[assignment]
+                "Connection lost during config download"
+            )
+            self._configured.set()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _connected(self) -> None:
+        super()._connected()
+        if self._loop is not None and self._configured is not None:
+            self._loop.call_soon_threadsafe(self._configured.set)
+
+    def _callLater(self, delay: float, callback: Callable[[], None]) -> Cancellable:
+        """Run timers (response expiry, transfer sweeps, node cache saves) on the loop rather than in threads"""
+        if self._loop is None or self._loop.is_closed():
+            return StreamInterface._callLater(self, delay, callback)
+        return LoopTimer(self._loop, delay, callback)
+
+    def _onLoop(self, callback: Callable[..., None], *args) -> None:
+        """Run callback on our loop: right away if we are on it, soon if called from another thread"""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            callback(*args)
+        elif self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    def _startHeartbeat(self) -> None:
+        """Send heartbeats from a task on the loop rather than a timer thread"""
+        if self._heartbeatTask is None and self._loop is not None:
+            self._heartbeatTask = self._loop.create_task(self._heartbeatLoop())
+
+    async def _heartbeatLoop(self) -> None:
+        while True:
+            logger.debug(f"Sending heartbeat, interval {HEARTBEAT_INTERVAL} seconds")
+            self.sendHeartbeat()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    def _waitConnected(self, timeout=30.0) -> None:
+        """Never block the event loop: sending before the config download is done is an error"""
+        if not self.noProto and not self.isConnected.is_set():
+            raise MeshInterface.MeshInterfaceError(
+                "Not connected yet, await connect() first"
+            )
+        if self.failure:
+            raise self.failure
+
+    def _writeBytes(self, b: bytes) -> None:
+        """Write an array of bytes to the transport, it buffers so this never blocks"""
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(b)
+
+    async def _drain(self) -> None:
+        """Wait for the transport's write buffer to drain"""
+        if self._writer is not None:
+            await self._writer.drain()
+
+    def _sendToRadio(self, toRadio: mesh_pb2.ToRadio, wait: bool = True) -> None:
+        """Queue a ToRadio protobuf for the device, never blocks"""
+        if self.noProto:
+            logger.warning(
+                "Not sending packet because protocol use is disabled by noProto"
+            )
+        elif not toRadio.HasField("packet"):
+            self._sendToRadioImpl(toRadio)
+        else:
+            self.txScheduler.enqueue(toRadio)
+
+    def sendData(  # type: ignore[override] # pylint: disable=W0221
+        self,
+        data,
+        destinationId: Union[int, str] = BROADCAST_ADDR,
+        portNum: portnums_pb2.PortNum.ValueType = portnums_pb2.PortNum.PRIVATE_APP,
+        wantAck: bool = False,
+        wantResponse: bool = False,
+        onResponse: Optional[Callable[[dict], Any]] = None,
+        onResponseAckPermitted: bool = False,
+        **kwargs,
+    ) -> PacketFuture:
+        """Send a data packet without blocking, see MeshInterface.sendData
+
+        Returns a PacketFuture. It resolves to the response packet if
+        wantResponse is set, otherwise to the ACK/NAK if wantAck is set, and
+        to None as soon as the packet is queued if neither is. If no reply
+        arrives within responseTimeout seconds (default: self.responseTimeout)
+        it fails with TimeoutError.
+        """
+        if self._loop is None:
+            # the future would belong to whatever loop is current, not the one our reader runs on
+            raise MeshInterface.MeshInterfaceError("Not connected yet, await connect() first")
+        future = PacketFuture(loop=self._loop)
+        expectReply = wantAck or wantResponse or onResponse is not None
+        onResponseExpired = kwargs.pop("onResponseExpired", None)
+
+        def setResult(p):
+            if not future.done():
+                future.set_result(p)
+
+        def setTimeout():
+            if not future.done():
+                future.set_exception(TimeoutError("No response to our request"))
+
+        def onReply(p):
+            if onResponse is not None:
+                onResponse(p)
+            self._onLoop(setResult, p)
+
+        def onExpired():
+            if onResponseExpired is not None:
+                onResponseExpired()
+            self._onLoop(setTimeout)
+
+        packet = MeshInterface.sendData(
+            self,
+            data,
+            destinationId,
+            portNum=portNum,
+            wantAck=wantAck,
+            wantResponse=wantResponse,
+            onResponse=onReply if expectReply else None,
+            onResponseExpired=onExpired if expectReply else None,
+            onResponseAckPermitted=(
+                onResponseAckPermitted
+                or not wantResponse
+                or getattr(onResponse, "__name__", None) == "onAckNak"
+            ),
+            wait=False,
+            **kwargs,
+        )
+        future.packet = packet
+        if expectReply:
+            # if the caller gives up (cancel, wait_for timeout) forget the handler
+            future.add_done_callback(lambda _: self.responseHandlers.pop(packet.id, None))
+        else:
+            future.set_result(None)
+        return future
+
+    def sendTraceRoute(  # pylint: disable=W0221
+        self, dest: Union[int, str], hopLimit: int, channelIndex: int = 0
+    ) -> PacketFuture:
+        """Send a trace route request
+
+        The future resolves to the response packet, its decoded["traceroute"]
+        holds the route and per hop SNR.
+        """
+        return self.sendData(
+            mesh_pb2.RouteDiscovery(),
+            destinationId=dest,
+            portNum=portnums_pb2.PortNum.TRACEROUTE_APP,
+            wantResponse=True,
+            channelIndex=channelIndex,
+            hopLimit=hopLimit,
+        )
+
+    async def getNode(  # type: ignore[override] # pylint: disable=W0236
+        self, nodeId: str, requestChannels: bool = True, requestChannelAttempts: int = 3, timeout: int = 300
+    ) -> Node:
+        """Return a node object which contains device settings and channel info"""
+        if nodeId in (LOCAL_ADDR, BROADCAST_ADDR):
+            return self.localNode
+        # names are only known to us, the Node needs the number they stand for
+        nodeNum = self._resolveDestination(nodeId) if isinstance(nodeId, str) else nodeId
+        n = Node(self, nodeNum, timeout=timeout)
+        # Only request device settings and channel info when necessary
+        if requestChannels:
+            logger.debug("About to requestChannels")
+            n.requestChannels()
+            retries_left = requestChannelAttempts
+            last_index: int = 0
+            while not await self._waitForChannels(n):
+                new_index: int = len(n.partialChannels) if n.partialChannels else 0
+                # each time we get a new channel, reset the counter
+                if new_index != last_index:
+                    retries_left = requestChannelAttempts
+                retries_left -= 1
+                if retries_left <= 0:
+                    raise MeshInterface.MeshInterfaceError(
+                        "Timed out waiting for channels, giving up"
+                    )
+                logger.info("Timed out trying to retrieve channel info, retrying")
+                n.requestChannels(startingIndex=new_index)
+                last_index = new_index
+        return n
+
+    async def _waitForChannels(self, node: Node) -> bool:
+        """Wait until node has all its channels, or its timeout expires without progress"""
+        node._timeout.reset()
+        while not node.channels:
+            # each answer asks for the next channel, so await whichever request is outstanding
+            request = node._channelRequest
+            remaining = node._timeout.expireTime - time.time()
+            if request is None or remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(request, remaining)
+            except (asyncio.TimeoutError, TimeoutError):
+                break
+            if node._channelRequest is request:
+                break  # answered with an error rather than a channel
+        return bool(node.channels)
+
+
+class AsyncTCPInterface(AsyncStreamInterface):
+    """asyncio interface for meshtastic devices over a TCP link"""
+
+    def __init__(
+        self,
+        hostname: str,
+        debugOut=None,
+        noProto: bool = False,
+        portNumber: int = DEFAULT_TCP_PORT,
+        noNodes: bool = False,
+        timeout: int = 300,
+        *,
+        dispatcher: Optional[Dispatcher] = None,
+        outbox: Optional[Outbox] = None,
+        nodeCache: Optional[NodeCache] = None,
+    ) -> None:
+        """Constructor, await connect() to open the connection
+
+        Keyword Arguments:
+            hostname {string} -- Hostname/IP address of the device to connect to
+            timeout -- How long to wait for replies (default: 300 seconds)
+            dispatcher -- Delivers our pubsub messages, see meshtastic.dispatcher (default: {None})
+            outbox -- Keeps queued packets on disk across restarts, see meshtastic.outbox (default: {None})
+            nodeCache -- Keeps the node DB on disk between connections, see meshtastic.node_cache (default: {None})
+        """
+        self.hostname: str = hostname
+        self.portNumber: int = portNumber
+        super().__init__(
+            debugOut=debugOut, noProto=noProto, noNodes=noNodes, timeout=timeout,
+            dispatcher=dispatcher, outbox=outbox, nodeCache=nodeCache,
+        )
+
+    def __repr__(self):
+        rep = f"AsyncTCPInterface({self.hostname!r}"
+        if self.noProto:
+            rep += ", noProto=True"
+        if self.portNumber != DEFAULT_TCP_PORT:
+            rep += f", portNumber={self.portNumber!r}"
+        if self.noNodes:
+            rep += ", noNodes=True"
+        rep += ")"
+        return rep
+
+    async def _openTransport(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        logger.debug(f"Connecting to {self.hostname}")
+        return await asyncio.open_connection(self.hostname, self.portNumber)
+
+
+class AsyncSerialInterface(AsyncStreamInterface):
+    """asyncio interface for meshtastic devices over a serial link (not available on Windows)"""
+
+    def __init__(
+        self,
+        devPath: Optional[str] = None,
+        debugOut=None,
+        noProto: bool = False,
+        noNodes: bool = False,
+        timeout: int = 300,
+        *,
+        dispatcher: Optional[Dispatcher] = None,
+        outbox: Optional[Outbox] = None,
+        nodeCache: Optional[NodeCache] = None,
+    ) -> None:
+        """Constructor, await connect() to open the port
+
+        Keyword Arguments:
+            devPath {string} -- A filepath to a device, i.e. /dev/ttyUSB0. If
+                                unspecified we probe for a single meshtastic device.
+            timeout -- How long to wait for replies (default: 300 seconds)
+            dispatcher -- Delivers our pubsub messages, see meshtastic.dispatcher (default: {None})
+            outbox -- Keeps queued packets on disk across restarts, see meshtastic.outbox (default: {None})
+            nodeCache -- Keeps the node DB on disk between connections, see meshtastic.node_cache (default: {None})
+        """
+        self.devPath: Optional[str] = devPath
+        super().__init__(
+            debugOut=debugOut, noProto=noProto, noNodes=noNodes, timeout=timeout,
+            dispatcher=dispatcher, outbox=outbox, nodeCache=nodeCache,
+        )
+
+    def __repr__(self):
+        rep = f"AsyncSerialInterface(devPath={self.devPath!r}"
+        if self.noProto:
+            rep += ", noProto=True"
+        if self.noNodes:
+            rep += ", noNodes=True"
+        rep += ")"
+        return rep
+
+    async def _openTransport(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        if sys.platform == "win32":
+            raise MeshInterface.MeshInterfaceError(
+                "AsyncSerialInterface is not supported on Windows, use SerialInterface"
+            )
+        if self.devPath is None:
+            ports = meshtastic.util.findPorts(True)
+            if len(ports) != 1:
+                raise MeshInterface.MeshInterfaceError(
+                    f"Expected exactly one Meshtastic serial port, found: {ports}"
+                )
+            self.devPath = ports[0]
+
+        logger.debug(f"Connecting to {self.devPath}")
+        with open(self.devPath, encoding="utf8") as f:
+            SerialInterface._set_hupcl_with_termios(self, f)  # type: ignore[arg-type]
+        port = serial.Serial(self.devPath, 115200, exclusive=True, timeout=0, write_timeout=0)
+
+        # A tty is a character device, so the loop's pipe transports can drive it directly
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), port)
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, port)
+        writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+        return reader, writer
@@ -14,6 +14,9 @@ import google.protobuf
 from bleak import BleakClient, BleakScanner, BLEDevice
 from bleak.exc import BleakDBusError, BleakError
 
+from meshtastic.dispatcher import Dispatcher
+from meshtastic.node_cache import NodeCache
+from meshtastic.outbox import Outbox
 from meshtastic.mesh_interface import MeshInterface
 
 from .protobuf import mesh_pb2
@@ -50,9 +53,14 @@ class BLEInterface(MeshInterface):
         debugOut: Optional[io.TextIOWrapper]=None,
         noNodes: bool = False,
         timeout: int = 300,
+        *,
+        dispatcher: Optional[Dispatcher] = None,
+        outbox: Optional[Outbox] = None,
+        nodeCache: Optional[NodeCache] = None,
     ) -> None:
         MeshInterface.__init__(
-            self, debugOut=debugOut, noProto=noProto, noNodes=noNodes, timeout=timeout
+            self, debugOut=debugOut, noProto=noProto, noNodes=noNodes, timeout=timeout, dispatcher=dispatcher,
+            outbox=outbox, nodeCache=nodeCache,
         )
 
         self.should_read = False
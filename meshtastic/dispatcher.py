@@ -0,0 +1,308 @@
+"""Dispatchers deliver pubsub messages to subscribers, on some thread
+
+By default every interface in the process publishes through the one
+meshtastic.publishingThread, so one slow subscriber delays events from every
+radio. An interface can be given its own dispatcher instead::
+
+    iface = TCPInterface(host, dispatcher=ThreadDispatcher("radio 1 publishing"))
+
+- InlineDispatcher calls subscribers immediately, on the thread that received
+  the packet. Lowest latency, but a slow subscriber holds up that radio's reads.
+- ThreadDispatcher runs one queue on one thread (what publishingThread does).
+  Giving each interface its own keeps their latencies independent.
+- PoolDispatcher spreads work over several ThreadDispatchers, while keeping
+  everything with the same ordering key (interface, sending node or topic) in
+  order on the same worker.
+
+Queues are unbounded unless given a maxDepth, with an overflow policy for when
+they fill up, and stats() reports how far behind subscribers are. For the
+shared default, e.g.::
+
+    meshtastic.publishingThread.maxDepth = 1000
+    meshtastic.publishingThread.overflow = OVERFLOW_DROP_PRIORITY
+
+The dispatcher belongs to whoever created it: interfaces never close it, as it
+may be shared.
+"""
+import abc
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+import zlib
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ORDER_BY_INTERFACE = "interface"
+ORDER_BY_SENDER = "sender"
+ORDER_BY_TOPIC = "topic"
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_DROP_PRIORITY = "drop-priority"
+
+DEFAULT_PRIORITY = 1
+# Topic prefix -> priority, for OVERFLOW_DROP_PRIORITY. Periodic broadcasts are
+# superseded by the next one, so they are the first to go.
+DEFAULT_TOPIC_PRIORITIES: Dict[str, int] = {
+    "meshtastic.connection": 2,
+    "meshtastic.clientNotification": 2,
+    "meshtastic.receive.position": 0,
+    "meshtastic.receive.telemetry": 0,
+    "meshtastic.receive.neighborinfo": 0,
+    "meshtastic.raw.receive.position": 0,
+    "meshtastic.raw.receive.telemetry": 0,
+    "meshtastic.raw.receive.neighborinfo": 0,
+}
+
+
+class DispatchStats(NamedTuple):
+    """Counters describing how well subscribers keep up"""
+
+    enqueued: int  # work accepted
+    delivered: int  # work run
+    dropped: int  # work discarded because the queue was full, or closed
+    depth: int  # work waiting right now
+    age: float  # seconds the oldest waiting work has waited
+    maxAge: float  # longest any work has waited before running
+
+
+def topicPriority(topic: Optional[str], priorities: Dict[str, int]) -> int:
+    """The priority of the longest prefix of topic found in priorities, or DEFAULT_PRIORITY"""
+    while topic:
+        priority = priorities.get(topic)
+        if priority is not None:
+            return priority
+        topic = topic.rpartition(".")[0]
+    return DEFAULT_PRIORITY
+
+
+class Dispatcher(abc.ABC):
+    """Runs pubsub deliveries, subclasses decide where and when"""
+
+    @abc.abstractmethod
+    def queueWork(
+        self,
+        runnable: Callable[[], None],
+        topic: Optional[str] = None,
+        interface=None,
+        sender=None,
+    ) -> None:
+        """Run runnable, which publishes topic for interface (about node number sender, if known)"""
+
+    def flush(self, timeout: Optional[float] = None) -> bool:  # pylint: disable=W0613
+        """Block until everything queued so far has run. Returns False on timeout."""
+        return True
+
+    def stats(self) -> DispatchStats:
+        """How well subscribers are keeping up"""
+        return DispatchStats(0, 0, 0, 0, 0.0, 0.0)
+
+    def close(self) -> None:
+        """Stop accepting work, after running what is already queued"""
+
+    @staticmethod
+    def _runSafely(runnable: Callable[[], None]) -> None:
+        try:
+            runnable()
+        except:
+            logger.error(f"Unexpected error in deferred execution {sys.exc_info()[0]}")
+            print(traceback.format_exc())
+
+
+class InlineDispatcher(Dispatcher):
+    """Delivers on the calling thread, before queueWork returns"""
+
+    def __init__(self) -> None:
+        self._delivered = 0
+
+    def queueWork(self, runnable, topic=None, interface=None, sender=None) -> None:
+        self._runSafely(runnable)
+        self._delivered += 1
+
+    def stats(self) -> DispatchStats:
+        return DispatchStats(self._delivered, self._delivered, 0, 0, 0.0, 0.0)
+
+
+class ThreadDispatcher(Dispatcher):
+    """A thread that accepts closures to run, and runs them in the order they are received
+
+    If maxDepth is set, at most that much work is queued, and overflow says what
+    happens to more: OVERFLOW_BLOCK makes queueWork wait for room (which slows the
+    radio reader down to the subscribers' pace), OVERFLOW_DROP_OLDEST discards the
+    oldest queued work and OVERFLOW_DROP_PRIORITY the oldest work with the lowest
+    topic priority (see DEFAULT_TOPIC_PRIORITIES), which may be the new work itself.
+    stats() reports how far behind delivery is.
+    """
+
+    def __init__(
+        self,
+        name: str = "publishing",
+        maxDepth: int = 0,
+        overflow: str = OVERFLOW_BLOCK,
+        priorities: Optional[Dict[str, int]] = None,
+    ) -> None:
+        if overflow not in (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_PRIORITY):
+            raise ValueError(f"Unknown overflow policy {overflow!r}")
+        self.maxDepth = maxDepth
+        self.overflow = overflow
+        self.priorities: Dict[str, int] = DEFAULT_TOPIC_PRIORITIES if priorities is None else priorities
+        self.queue: Deque[Tuple[float, Optional[str], Callable[[], None]]] = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._enqueued = 0
+        self._delivered = 0
+        self._dropped = 0
+        self._finished = 0  # delivered, or dropped after being queued
+        self._maxAge = 0.0
+        # this thread must be marked as daemon, otherwise it will prevent clients from exiting
+        self.thread = threading.Thread(target=self._run, args=(), name=name, daemon=True)
+        self.thread.start()
+
+    def __len__(self) -> int:
+        """Work waiting to run"""
+        with self._cond:
+            return len(self.queue)
+
+    def queueWork(self, runnable, topic=None, interface=None, sender=None) -> None:
+        with self._cond:
+            if 0 < self.maxDepth <= len(self.queue):
+                if not self._makeRoomLocked(topic):
+                    self._dropped += 1
+                    logger.debug(f"Publish queue full, dropping {topic}")
+                    return
+            if self._closed:
+                # our thread has exited (or will once the queue is empty), nothing would run it
+                self._dropped += 1
+                logger.debug(f"Dispatcher closed, dropping {topic}")
+                return
+            self._putLocked(runnable, topic)
+            self._enqueued += 1
+
+    def stats(self) -> DispatchStats:
+        """Current counters"""
+        with self._cond:
+            age = time.monotonic() - self.queue[0][0] if self.queue else 0.0
+            return DispatchStats(
+                self._enqueued, self._delivered, self._dropped, len(self.queue), age, max(age, self._maxAge)
+            )
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        if threading.current_thread() is self.thread:
+            return True  # called by a subscriber, we would wait for ourselves
+        with self._cond:
+            target = self._enqueued
+            return self._cond.wait_for(lambda: self._finished >= target or self._closed, timeout)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+
+    def _putLocked(self, runnable, topic) -> None:
+        self.queue.append((time.monotonic(), topic, runnable))
+        self._cond.notify_all()
+
+    def _makeRoomLocked(self, topic: Optional[str]) -> bool:
+        """Apply the overflow policy to a full queue. Returns False if the new work should be dropped."""
+        if self.overflow == OVERFLOW_BLOCK:
+            if threading.current_thread() is self.thread:
+                return True  # a subscriber publishing, waiting would deadlock so let it overfill
+            self._cond.wait_for(lambda: len(self.queue) < self.maxDepth or self._closed)
+            return True
+        if self.overflow == OVERFLOW_DROP_OLDEST:
+            victim = 0
+        else:
+            lowest = topicPriority(topic, self.priorities)
+            victim = -1
+            for i, (_, queuedTopic, _) in enumerate(self.queue):
+                priority = topicPriority(queuedTopic, self.priorities)
+                if priority <= lowest and (victim < 0 or priority < lowest):
+                    lowest, victim = priority, i
+            if victim < 0:
+                return False
+        _, droppedTopic, _ = self.queue[victim]
+        del self.queue[victim]
+        self._dropped += 1
+        self._finished += 1
+        logger.debug(f"Publish queue full, dropping {droppedTopic}")
+        return True
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self.queue or self._closed)
+                if not self.queue:
+                    return
+                queuedAt, _, o = self.queue.popleft()
+                self._maxAge = max(self._maxAge, time.monotonic() - queuedAt)
+                self._cond.notify_all()  # there is room now
+            self._runSafely(o)
+            with self._cond:
+                self._delivered += 1
+                self._finished += 1
+                self._cond.notify_all()
+
+
+class PoolDispatcher(Dispatcher):
+    """Several worker threads, with work that shares an ordering key always run by the same worker
+
+    orderBy is ORDER_BY_INTERFACE (each radio's events stay in order), ORDER_BY_SENDER
+    (each mesh node's packets stay in order, falling back to the interface for events
+    not about a node) or ORDER_BY_TOPIC. maxDepth, overflow and priorities apply to each
+    worker's queue, as for ThreadDispatcher.
+    """
+
+    def __init__(  # pylint: disable=R0917
+        self,
+        workers: int = 4,
+        orderBy: str = ORDER_BY_INTERFACE,
+        name: str = "publishing",
+        maxDepth: int = 0,
+        overflow: str = OVERFLOW_BLOCK,
+        priorities: Optional[Dict[str, int]] = None,
+    ) -> None:
+        if workers < 1:
+            raise ValueError("A PoolDispatcher needs at least one worker")
+        if orderBy not in (ORDER_BY_INTERFACE, ORDER_BY_SENDER, ORDER_BY_TOPIC):
+            raise ValueError(f"Unknown orderBy {orderBy!r}")
+        self.orderBy = orderBy
+        self.workers: List[ThreadDispatcher] = [
+            ThreadDispatcher(f"{name} {i}", maxDepth, overflow, priorities) for i in range(workers)
+        ]
+
+    def queueWork(self, runnable, topic=None, interface=None, sender=None) -> None:
+        self._workerFor(topic, interface, sender).queueWork(runnable, topic=topic)
+
+    def stats(self) -> DispatchStats:
+        """Counters summed over the workers (ages are the worst worker's)"""
+        stats = [worker.stats() for worker in self.workers]
+        return DispatchStats(
+            sum(s.enqueued for s in stats),
+            sum(s.delivered for s in stats),
+            sum(s.dropped for s in stats),
+            sum(s.depth for s in stats),
+            max(s.age for s in stats),
+            max(s.maxAge for s in stats),
+        )
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        return all(worker.flush(timeout) for worker in self.workers)
+
+    def close(self) -> None:
+        for worker in self.workers:
+            worker.close()
+
+    def _workerFor(self, topic, interface, sender) -> ThreadDispatcher:
+        if self.orderBy == ORDER_BY_TOPIC:
+            key = zlib.crc32((topic or "").encode("utf-8"))
+        elif self.orderBy == ORDER_BY_SENDER and sender is not None:
+            key = hash(sender)
+        else:
+            key = id(interface) >> 4  # objects are 16 byte aligned
+        return self.workers[key % len(self.workers)]
@@ -0,0 +1,188 @@
+"""Dictionaries that convert protobuf fields on demand
+"""
+import base64
+import math
+import threading
+from typing import Any, Dict, Iterator
+
+from google.protobuf import descriptor, json_format
+from google.protobuf.internal import type_checkers
+from google.protobuf.message import Message
+
+_FieldDescriptor = descriptor.FieldDescriptor
+_INT64_TYPES = (_FieldDescriptor.CPPTYPE_INT64, _FieldDescriptor.CPPTYPE_UINT64)
+_FLOAT_TYPES = (_FieldDescriptor.CPPTYPE_FLOAT, _FieldDescriptor.CPPTYPE_DOUBLE)
+
+# field descriptor -> the key MessageToDict uses for it
+_keys: Dict[descriptor.FieldDescriptor, str] = {}
+
+# Held while storing a converted field, see LazyMessageDict._convert
+_storeLock = threading.Lock()
+_MISSING = object()
+
+
+class _Unconverted:
+    """Placeholder for a field we have not converted yet"""
+
+    __slots__ = ("field", "value")
+
+    def __init__(self, field: descriptor.FieldDescriptor, value: Any) -> None:
+        self.field = field
+        self.value = value
+
+
+class LazyMessageDict(dict):
+    """The MessageToDict() form of a protobuf message, converted one field at a time
+
+    Converting a whole MeshPacket (and its decoded payload) with MessageToDict
+    for every received packet is where most of our receive CPU went, even though
+    subscribers typically look at a handful of fields. This dict has the same
+    keys, values and ordering MessageToDict would give, but a field is only
+    converted the first time it is read, and nested messages are themselves
+    LazyMessageDicts. Keys can be added, replaced and removed as with any dict.
+
+    Anything that walks the whole dict (items(), values(), repr, ==, json.dumps,
+    dict(), copy) converts everything first, and copying or pickling gives a
+    plain dict.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, message: Message) -> None:
+        super().__init__()
+        for field, value in message.ListFields():
+            name = _keys.get(field)
+            if name is None:
+                name = _keys[field] = f"[{field.full_name}]" if field.is_extension else field.json_name
+            dict.__setitem__(self, name, _Unconverted(field, value))
+
+    def _convert(self, key, value):
+        if type(value) is _Unconverted:  # pylint: disable=C0123
+            converted = _convertField(value.field, value.value)
+            # Several threads (subscribers on different dispatcher threads, say) may have
+            # converted the same field at once: only the first one's result is kept, and
+            # everyone gets that one, so changes made to it are never lost
+            with _storeLock:
+                current = dict.get(self, key, _MISSING)
+                if current is value:
+                    dict.__setitem__(self, key, converted)
+                elif current is not _MISSING:
+                    converted = current
+            return converted
+        return value
+
+    def _convertAll(self) -> None:
+        for key, value in list(dict.items(self)):  # a snapshot, other threads may be adding keys
+            if type(value) is _Unconverted:  # pylint: disable=C0123
+                self._convert(key, value)
+
+    def __getitem__(self, key):
+        return self._convert(key, dict.__getitem__(self, key))
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __iter__(self) -> Iterator:
+        # Overriding this makes dict(), {**d} and dict.update() read us through
+        # keys() and __getitem__ rather than copying our placeholders
+        return dict.__iter__(self)
+
+    def items(self):  # type: ignore[override]
+        self._convertAll()
+        return dict.items(self)
+
+    def values(self):  # type: ignore[override]
+        self._convertAll()
+        return dict.values(self)
+
+    def pop(self, key, *args):
+        if key in self:
+            self[key]  # pylint: disable=W0104
+        return dict.pop(self, key, *args)
+
+    def popitem(self):
+        self._convertAll()
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        dict.__setitem__(self, key, default)
+        return default
+
+    def copy(self) -> dict:  # type: ignore[override]
+        """A plain (fully converted) dict"""
+        return dict(self.items())
+
+    def __eq__(self, other) -> bool:
+        self._convertAll()
+        if isinstance(other, LazyMessageDict):
+            other._convertAll()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other) -> bool:
+        return not self == other
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        self._convertAll()
+        return dict.__repr__(self)
+
+    def __reduce_ex__(self, protocol):
+        return (dict, (self.copy(),))
+
+
+def _convertField(field: descriptor.FieldDescriptor, value: Any) -> Any:
+    """Convert a field the way MessageToDict does"""
+    if field.message_type is not None and field.message_type.GetOptions().map_entry:
+        valueField = field.message_type.fields_by_name["value"]
+        return {
+            _mapKey(k): _convertValue(valueField, v) for k, v in value.items()
+        }
+    if _isRepeated(field):
+        return [_convertValue(field, v) for v in value]
+    return _convertValue(field, value)
+
+
+def _isRepeated(field: descriptor.FieldDescriptor) -> bool:
+    isRepeated = getattr(field, "is_repeated", None)  # protobuf >= 5.29 replaces label
+    if isRepeated is None:
+        return getattr(field, "label") == _FieldDescriptor.LABEL_REPEATED
+    return isRepeated
+
+
+def _mapKey(key) -> str:
+    if isinstance(key, bool):
+        return "true" if key else "false"
+    return str(key)
+
+
+def _convertValue(field: descriptor.FieldDescriptor, value: Any) -> Any:  # pylint: disable=R0911
+    """Convert a single value, following the ProtoJSON mapping json_format uses"""
+    cppType = field.cpp_type
+    if cppType == _FieldDescriptor.CPPTYPE_MESSAGE:
+        if field.message_type is not None and field.message_type.full_name.startswith("google.protobuf."):
+            return json_format.MessageToDict(value)  # well known types have special JSON forms
+        return LazyMessageDict(value)
+    if cppType == _FieldDescriptor.CPPTYPE_ENUM:
+        enumValue = field.enum_type.values_by_number.get(value, None) if field.enum_type is not None else None
+        return enumValue.name if enumValue is not None else value
+    if cppType == _FieldDescriptor.CPPTYPE_STRING:
+        if field.type == _FieldDescriptor.TYPE_BYTES:
+            return base64.b64encode(value).decode("utf-8")
+        return str(value)
+    if cppType == _FieldDescriptor.CPPTYPE_BOOL:
+        return bool(value)
+    if cppType in _INT64_TYPES:
+        return str(value)
+    if cppType in _FLOAT_TYPES:
+        if math.isinf(value):
+            return "-Infinity" if value < 0.0 else "Infinity"
+        if math.isnan(value):
+            return "NaN"
+        if cppType == _FieldDescriptor.CPPTYPE_FLOAT:
+            return type_checkers.ToShortestFloat(value)
+    return value
@@ -2,7 +2,6 @@
 """
 # pylint: disable=R0917,C0302
 
-import collections
 import json
 import logging
 import math
@@ -12,9 +11,9 @@ import sys
 import threading
 import time
 import traceback
-from datetime import datetime
+from concurrent.futures import Future
 from decimal import Decimal
-from typing import Any, Callable, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Protocol, Set, Tuple, Union
 
 import google.protobuf.json_format
 
@@ -24,7 +23,6 @@ except ImportError as e:
     print_color = None
 
 from pubsub import pub  # type: ignore[import-untyped]
-from tabulate import tabulate
 
 import meshtastic.node
 from meshtastic import (
@@ -36,40 +34,88 @@ from meshtastic import (
     protocols,
     publishingThread,
 )
-from meshtastic.protobuf import mesh_pb2, portnums_pb2, telemetry_pb2
+from meshtastic.airtime import AirtimeLimiter
+from meshtastic.compression import COMPRESSED_PORTNUM, CompressionError, PayloadCodec, decompress
+from meshtastic.dispatcher import Dispatcher
+from meshtastic.lazy_dict import LazyMessageDict
+from meshtastic.node_cache import NodeCache
+from meshtastic.node_index import NodeIndex
+from meshtastic.node_journal import UNJOURNALED, NodeJournal
+from meshtastic.node_record import RETAIN_FULL, NodeRecord, deepSizeOf
+# _timeago lived here before node_table, keep importing it for those who use it from here
+from meshtastic.node_table import _timeago, renderNodes  # pylint: disable=W0611
+from meshtastic.outbox import Outbox
+from meshtastic.protobuf import localonly_pb2, mesh_pb2, portnums_pb2, telemetry_pb2
+from meshtastic.spatial_index import SpatialIndex, bearing, distance
+from meshtastic.telemetry_history import TelemetryHistory
+from meshtastic.topology import MeshGraph
+from meshtastic.timer_wheel import TimerWheel
+from meshtastic.transfer import Transfers
+from meshtastic.tx_scheduler import TxScheduler
 from meshtastic.util import (
     Acknowledgment,
     Timeout,
     convert_mac_addr,
     message_to_json,
     our_exit,
+    parse_node_id,
     remove_keys_from_dict,
     stripnl,
 )
 
 logger = logging.getLogger(__name__)
 
-def _timeago(delta_secs: int) -> str:
-    """Convert a number of seconds in the past into a short, friendly string
-    e.g. "now", "30 sec ago",  "1 hour ago"
-    Zero or negative intervals simply return "now"
+# How long close() waits for queued packets to be written to the radio
+CLOSE_FLUSH_TIMEOUT = 5.0
+
+# How long a response handler waits before being given a TIMEOUT, by default.
+# Generous, so that it never cuts short a wait the caller is doing itself.
+DEFAULT_RESPONSE_TIMEOUT = 3600.0
+# How often pending response handlers are checked for expiry
+RESPONSE_SWEEP_INTERVAL = 1.0
+
+
+def _configSections() -> Dict[str, Dict[str, str]]:
+    """FromRadio field (config or moduleConfig) -> section name -> the Node attribute holding that section
+
+    Built from the protobuf descriptors, so sections added by newer firmware are
+    stored without any code change here. Sections the Local* messages have no
+    slot for (e.g. sessionkey) are left out and ignored.
     """
-    intervals = (
-        ("year", 60 * 60 * 24 * 365),
-        ("month", 60 * 60 * 24 * 30),
-        ("day", 60 * 60 * 24),
-        ("hour", 60 * 60),
-        ("min", 60),
-        ("sec", 1),
-    )
-    for name, interval_duration in intervals:
-        if delta_secs < interval_duration:
+    sections: Dict[str, Dict[str, str]] = {}
+    for fromRadioField, localAttr, localMessage in (
+        ("config", "localConfig", localonly_pb2.LocalConfig),
+        ("moduleConfig", "moduleConfig", localonly_pb2.LocalModuleConfig),
+    ):
+        container = mesh_pb2.FromRadio.DESCRIPTOR.fields_by_name[fromRadioField].message_type
+        if container is None:
             continue
-        x = delta_secs // interval_duration
-        plur = "s" if x > 1 else ""
-        return f"{x} {name}{plur} ago"
+        stored = localMessage.DESCRIPTOR.fields_by_name
+        sections[fromRadioField] = {
+            field.name: localAttr
+            for field in container.oneofs_by_name["payload_variant"].fields
+            if field.name in stored
+        }
+    return sections
+
+
+CONFIG_SECTIONS = _configSections()
+
+
+class Cancellable(Protocol):  # pylint: disable=R0903
+    """What _callLater returns: a scheduled callback that can be called off"""
+
+    def cancel(self) -> None:
+        """Don't run the callback (if it has not run yet)"""
+
 
-    return "now"
+class ResponseFuture(Future):
+    """The reply to a packet we sent, see MeshInterface.sendDataFuture"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        #: the packet that was sent
+        self.packet: Optional[mesh_pb2.MeshPacket] = None
 
 
 class MeshInterface:  # pylint: disable=R0902
@@ -90,7 +136,15 @@ class MeshInterface:  # pylint: disable=R0902
             super().__init__(self.message)
 
     def __init__(
-        self, debugOut=None, noProto: bool = False, noNodes: bool = False, timeout: int = 300
+        self,
+        debugOut=None,
+        noProto: bool = False,
+        noNodes: bool = False,
+        timeout: int = 300,
+        *,
+        dispatcher: Optional[Dispatcher] = None,
+        outbox: Optional[Outbox] = None,
+        nodeCache: Optional[NodeCache] = None,
     ) -> None:
         """Constructor
 
@@ -100,8 +154,21 @@ class MeshInterface:  # pylint: disable=R0902
             noNodes -- If True, instruct the node to not send its nodedb
                        on startup, just other configuration information.
             timeout -- How long to wait for replies (default: 300 seconds)
+            dispatcher -- Delivers our pubsub messages, see meshtastic.dispatcher
+                          (default: the process wide meshtastic.publishingThread)
+            outbox -- Keeps queued packets on disk until the radio accepts them, and resends
+                      them on the next connection, see meshtastic.outbox (default: {None})
+            nodeCache -- Keeps the node DB on disk, so nodes are known before the radio
+                         has sent them, see meshtastic.node_cache (default: {None})
         """
         self.debugOut = debugOut
+        self.dispatcher: Dispatcher = dispatcher if dispatcher is not None else publishingThread
+        self.outbox: Optional[Outbox] = outbox
+        self.nodeCache: Optional[NodeCache] = nodeCache
+        self._nodeCacheNum: Optional[int] = None  # the radio whose cached nodes we loaded
+        self._nodeCacheUnconfirmed: Set[int] = set()  # cached nodes the radio hasn't sent (yet)
+        self._nodeCacheSkipped: bool = False  # didn't ask for the node DB because the cache was fresh
+        self._nodeCacheTimer: Optional[Cancellable] = None
         self.nodes: Optional[Dict[str, Dict]] = None  # FIXME
         self.isConnected: threading.Event = threading.Event()
         self.noProto: bool = noProto
@@ -117,21 +184,53 @@ class MeshInterface:  # pylint: disable=R0902
         self.responseHandlers: Dict[
             int, ResponseHandler
         ] = {}  # A map from request ID to the handler
+        # seconds a response handler waits before it is expired, None to wait forever
+        self.responseTimeout: Optional[float] = DEFAULT_RESPONSE_TIMEOUT
+        self._responseDeadlines: TimerWheel = TimerWheel(tick=RESPONSE_SWEEP_INTERVAL)
+        self._responseSweepLock = threading.Lock()
+        self._responseSweepTimer: Optional[Cancellable] = None
         self.failure = (
             None  # If we've encountered a fatal exception it will be kept here
         )
         self._timeout: Timeout = Timeout(maxSecs=timeout)
         self._acknowledgment: Acknowledgment = Acknowledgment()
-        self.heartbeatTimer: Optional[threading.Timer] = None
+        self.heartbeatTimer: Optional[Cancellable] = None
         random.seed()  # FIXME, we should not clobber the random seedval here, instead tell user they must call it
         self.currentPacketId: int = random.randint(0, 0xFFFFFFFF)
         self.nodesByNum: Optional[Dict[int, Dict]] = None
+        # Finds node numbers by id, public key or name, kept up to date with nodesByNum
+        self.nodeIndex: NodeIndex = NodeIndex()
+        # Changes to nodesByNum, for clients that want to follow them, see meshtastic.node_journal
+        self.nodeJournal: NodeJournal = NodeJournal()
+        # The nodes with a known position, by where they are, see meshtastic.spatial_index
+        self.spatialIndex: SpatialIndex = SpatialIndex()
+        # Set to a TelemetryHistory to keep recent telemetry samples of every node, see meshtastic.telemetry_history
+        self.telemetryHistory: Optional[TelemetryHistory] = None
+        # Links between nodes, learned from NeighborInfo and traceroutes, see meshtastic.topology
+        self.meshGraph: MeshGraph = MeshGraph()
+        # Set to send packets with just the hop_limit the best path in meshGraph needs
+        self.autoHopLimit: bool = False
         self.noNodes: bool = noNodes
         self.configId: Optional[int] = NODELESS_WANT_CONFIG_ID if noNodes else None
         self.gotResponse: bool = False  # used in gpio read
         self.mask: Optional[int] = None  # used in gpio read and gpio watch
         self.queueStatus: Optional[mesh_pb2.QueueStatus] = None
-        self.queue: collections.OrderedDict = collections.OrderedDict()
+        # Set publishRaw to also publish received packets as protobufs on meshtastic.raw.receive.*,
+        # and clear publishDicts if nobody reads the meshtastic.receive.* dictionaries
+        self.publishRaw: bool = False
+        self.publishDicts: bool = True
+        # Set to a PayloadCodec to compress what sendData sends, see meshtastic.compression
+        self.compression: Optional[PayloadCodec] = None
+        # How much of the last packet from each node to keep as its "lastReceived",
+        # one of meshtastic.node_record.RETENTION_MODES. RETAIN_FULL keeps every node's
+        # last payload and protobuf alive, so memory-constrained clients on a big mesh
+        # that don't read lastReceived["decoded"] should set RETAIN_SUMMARY
+        self.lastReceivedRetention: str = RETAIN_FULL
+        # Set to an AirtimeLimiter to keep what we send within a duty cycle budget
+        self.airtimeLimiter: Optional[AirtimeLimiter] = None
+        self.txScheduler: TxScheduler = TxScheduler(self)
+        # Sends and reassembles payloads too big for one packet, see sendLargeData
+        self.transfers: Transfers = Transfers(self)
         self._localChannels = None
 
         # We could have just not passed in debugOut to MeshInterface, and instead told consumers to subscribe to
@@ -142,10 +241,26 @@ class MeshInterface:  # pylint: disable=R0902
 
     def close(self):
         """Shutdown this interface"""
+        self._stopBackgroundWork()
+
+        # give packets queued without waiting a chance to reach the radio
+        if not self.txScheduler.flush(timeout=CLOSE_FLUSH_TIMEOUT):
+            logger.warning(f"Closing with {len(self.txScheduler)} packets still queued")
+        self.txScheduler.close()
+        self._sendDisconnect()
+
+    def _stopBackgroundWork(self) -> None:
+        """The part of closing every interface shares: stop our timers and transfers, save the node cache"""
         if self.heartbeatTimer:
             self.heartbeatTimer.cancel()
+            self.heartbeatTimer = None
+        with self._responseSweepLock:
+            if self._responseSweepTimer:
+                self._responseSweepTimer.cancel()
+                self._responseSweepTimer = None
 
-        self._sendDisconnect()
+        self.transfers.close()
+        self._saveNodeCache()
 
     def __enter__(self):
         return self
@@ -225,159 +340,30 @@ class MeshInterface:  # pylint: disable=R0902
         return infos
 
     def showNodes(
-        self, includeSelf: bool = True, showFields: Optional[List[str]] = None
-    ) -> str:  # pylint: disable=W0613
+        self,
+        includeSelf: bool = True,
+        showFields: Optional[List[str]] = None,
+        outputFormat: str = "table",
+        pageSize: Optional[int] = None,
+    ) -> str:
         """Show table summary of nodes in mesh
 
            Args:
                 includeSelf (bool): Include ourself in the output?
                 showFields (List[str]): List of fields to show in output
+                outputFormat (str): "table", "plain", "csv" or "json"
+                pageSize (int): Print tables this many rows at a time, so a big mesh's first rows show sooner
         """
+        nodes = list(self.nodesByNum.values()) if self.nodesByNum else []
+        if not includeSelf:
+            localNum = self.localNode.nodeNum
+            nodes = [node for node in nodes if node["num"] != localNum]
 
-        def get_human_readable(name):
-            name_map = {
-                "user.longName": "User",
-                "user.id": "ID",
-                "user.shortName": "AKA",
-                "user.hwModel": "Hardware",
-                "user.publicKey": "Pubkey",
-                "user.role": "Role",
-                "position.latitude": "Latitude",
-                "position.longitude": "Longitude",
-                "position.altitude": "Altitude",
-                "deviceMetrics.batteryLevel": "Battery",
-                "deviceMetrics.channelUtilization": "Channel util.",
-                "deviceMetrics.airUtilTx": "Tx air util.",
-                "snr": "SNR",
-                "hopsAway": "Hops",
-                "channel": "Channel",
-                "lastHeard": "LastHeard",
-                "since": "Since",
-                "isFavorite": "Fav",
-
-            }
-
-            if name in name_map:
-                return name_map.get(name)  # Default to a formatted guess
-            else:
-                return name
-
-
-        def formatFloat(value, precision=2, unit="") -> Optional[str]:
-            """Format a float value with precision."""
-            return f"{value:.{precision}f}{unit}" if value else None
-
-        def getLH(ts) -> Optional[str]:
-            """Format last heard"""
-            return (
-                datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") if ts else None
-            )
-
-        def getTimeAgo(ts) -> Optional[str]:
-            """Format how long ago have we heard from this node (aka timeago)."""
-            if ts is None:
-                return None
-            delta = datetime.now() - datetime.fromtimestamp(ts)
-            delta_secs = int(delta.total_seconds())
-            if delta_secs < 0:
-                return None  # not handling a timestamp from the future
-            return _timeago(delta_secs)
-
-        def getNestedValue(node_dict: Dict[str, Any], key_path: str) -> Any:
-            if key_path.index(".") < 0:
-                logger.debug("getNestedValue was called without a nested path.")
-                return None
-            keys = key_path.split(".")
-            value: Optional[Union[str, dict]] = node_dict
-            for key in keys:
-                if isinstance(value, dict):
-                    value = value.get(key)
-                else:
-                    return None
-            return value
-
-        if showFields is None or len(showFields) == 0:
-          # The default set of fields to show (e.g., the status quo)
-            showFields = ["N", "user.longName", "user.id", "user.shortName", "user.hwModel", "user.publicKey",
-                          "user.role", "position.latitude", "position.longitude", "position.altitude",
-                          "deviceMetrics.batteryLevel", "deviceMetrics.channelUtilization",
-                          "deviceMetrics.airUtilTx", "snr", "hopsAway", "channel", "isFavorite", "lastHeard", "since"]
-        else:
-            # Always at least include the row number.
-            showFields.insert(0, "N")
-
-        rows: List[Dict[str, Any]] = []
-        if self.nodesByNum:
-            logger.debug(f"self.nodes:{self.nodes}")
-            for node in self.nodesByNum.values():
-                if not includeSelf and node["num"] == self.localNode.nodeNum:
-                    continue
-
-                presumptive_id = f"!{node['num']:08x}"
-
-                # This allows the user to specify fields that wouldn't otherwise be included.
-                fields = {}
-                for field in showFields:
-                    if "." in field:
-                        raw_value = getNestedValue(node, field)
-                    else:
-                        # The "since" column is synthesized, it's not retrieved from the device. Get the
-                        # lastHeard value here, and then we'll format it properly below.
-                        if field == "since":
-                            raw_value = node.get("lastHeard")
-                        else:
-                            raw_value = node.get(field)
-
-                    formatted_value: Optional[str] = ""
-
-                    # Some of these need special formatting or processing.
-                    if field == "channel":
-                        if raw_value is None:
-                            formatted_value = "0"
-                    elif field == "deviceMetrics.channelUtilization":
-                        formatted_value = formatFloat(raw_value, 2, "%")
-                    elif field == "deviceMetrics.airUtilTx":
-                        formatted_value = formatFloat(raw_value, 2, "%")
-                    elif field == "deviceMetrics.batteryLevel":
-                        if raw_value in (0, 101):
-                            formatted_value = "Powered"
-                        else:
-                            formatted_value = formatFloat(raw_value, 0, "%")
-                    elif field == "isFavorite":
-                        formatted_value = "*" if raw_value else ""
-                    elif field == "lastHeard":
-                        formatted_value = getLH(raw_value)
-                    elif field == "position.latitude":
-                        formatted_value = formatFloat(raw_value, 4, "°")
-                    elif field == "position.longitude":
-                        formatted_value = formatFloat(raw_value, 4, "°")
-                    elif field == "position.altitude":
-                        formatted_value = formatFloat(raw_value, 0, "m")
-                    elif field == "since":
-                        formatted_value = getTimeAgo(raw_value) or "N/A"
-                    elif field == "snr":
-                        formatted_value = formatFloat(raw_value, 0, " dB")
-                    elif field == "user.shortName":
-                        formatted_value = raw_value if raw_value is not None else f'Meshtastic {presumptive_id[-4:]}'
-                    elif field == "user.id":
-                        formatted_value = raw_value if raw_value is not None else presumptive_id
-                    else:
-                        formatted_value = raw_value  # No special formatting
-
-                    fields[field] = formatted_value
-
-                # Filter out any field in the data set that was not specified.
-                filteredData = {get_human_readable(k): v for k, v in fields.items() if k in showFields}
-                filteredData.update({get_human_readable(k): v for k, v in fields.items()})
-                rows.append(filteredData)
-
-        rows.sort(key=lambda r: r.get("LastHeard") or "0000", reverse=True)
-        for i, row in enumerate(rows):
-            row["N"] = i + 1
-
-        table = tabulate(rows, headers="keys", missingval="N/A", tablefmt="fancy_grid")
-        print(table)
-        return table
+        chunks = []
+        for chunk in renderNodes(nodes, showFields, outputFormat, pageSize):
+            print(chunk)
+            chunks.append(chunk)
+        return "\n".join(chunks)
 
     def getNode(
         self, nodeId: str, requestChannels: bool = True, requestChannelAttempts: int = 3, timeout: int = 300
@@ -386,7 +372,9 @@ class MeshInterface:  # pylint: disable=R0902
         if nodeId in (LOCAL_ADDR, BROADCAST_ADDR):
             return self.localNode
         else:
-            n = meshtastic.node.Node(self, nodeId, timeout=timeout)
+            # names are only known to us, the Node needs the number they stand for
+            nodeNum = self._resolveDestination(nodeId) if isinstance(nodeId, str) else nodeId
+            n = meshtastic.node.Node(self, nodeNum, timeout=timeout)
             # Only request device settings and channel info when necessary
             if requestChannels:
                 logger.debug("About to requestChannels")
@@ -519,6 +507,9 @@ class MeshInterface:  # pylint: disable=R0902
         publicKey: Optional[bytes]=None,
         priority: mesh_pb2.MeshPacket.Priority.ValueType=mesh_pb2.MeshPacket.Priority.RELIABLE,
         replyId: Optional[int]=None,
+        wait: bool=True,
+        responseTimeout: Optional[float]=None,
+        onResponseExpired: Optional[Callable[[], Any]]=None,
     ): # pylint: disable=R0913
         """Send a data packet to some other node
 
@@ -544,6 +535,15 @@ class MeshInterface:  # pylint: disable=R0902
             channelIndex -- channel number to use
             hopLimit -- hop limit to use
             replyId -- the ID of the message that this packet is a response to
+            wait -- if False just queue the packet for the TX scheduler, rather
+                    than blocking until it has been written to the radio
+            responseTimeout -- seconds to wait for a response before giving up
+                    on it (default: self.responseTimeout)
+            onResponseExpired -- called if no response arrives in time. If not
+                    given, onResponse is called with a TIMEOUT NAK instead.
+
+        If self.compression is set and covers portNum, the payload is sent
+        compressed when that makes it shorter.
 
         Returns the sent packet. The id field will be populated in this packet
         and can be used to track future message acks/naks.
@@ -553,6 +553,12 @@ class MeshInterface:  # pylint: disable=R0902
             logger.debug(f"Serializing protobuf as data: {stripnl(data)}")
             data = data.SerializeToString()
 
+        if self.compression is not None:
+            compressed = self.compression.compress(portNum, data)
+            if compressed is not None:
+                logger.debug(f"Compressed {len(data)} bytes to {len(compressed)}")
+                portNum, data = COMPRESSED_PORTNUM, compressed
+
         logger.debug(f"len(data): {len(data)}")
         logger.debug(
             f"mesh_pb2.Constants.DATA_PAYLOAD_LEN: {mesh_pb2.Constants.DATA_PAYLOAD_LEN}"
@@ -578,10 +584,89 @@ class MeshInterface:  # pylint: disable=R0902
 
         if onResponse is not None:
             logger.debug(f"Setting a response handler for requestId {meshPacket.id}")
-            self._addResponseHandler(meshPacket.id, onResponse, ackPermitted=onResponseAckPermitted)
-        p = self._sendPacket(meshPacket, destinationId, wantAck=wantAck, hopLimit=hopLimit, pkiEncrypted=pkiEncrypted, publicKey=publicKey)
+            self._addResponseHandler(
+                meshPacket.id,
+                onResponse,
+                ackPermitted=onResponseAckPermitted,
+                timeout=responseTimeout,
+                onExpired=onResponseExpired,
+            )
+        p = self._sendPacket(meshPacket, destinationId, wantAck=wantAck, hopLimit=hopLimit, pkiEncrypted=pkiEncrypted, publicKey=publicKey, wait=wait)
         return p
 
+    def sendDataFuture(
+        self,
+        data,
+        destinationId: Union[int, str]=BROADCAST_ADDR,
+        portNum: portnums_pb2.PortNum.ValueType=portnums_pb2.PortNum.PRIVATE_APP,
+        wantAck: bool=False,
+        wantResponse: bool=False,
+        responseTimeout: Optional[float]=None,
+        **kwargs,
+    ) -> "ResponseFuture":
+        """Send a data packet, see sendData, and return a future for the reply instead of taking a callback
+
+        The future resolves to the response packet if wantResponse is set, otherwise
+        to the ACK/NAK if wantAck is set, and to None straight away if neither is.
+        If no reply arrives within responseTimeout seconds (default: self.responseTimeout)
+        it fails with TimeoutError. Cancelling it forgets the request.
+        """
+        future = ResponseFuture()
+        if not (wantAck or wantResponse):
+            future.packet = self.sendData(
+                data, destinationId, portNum=portNum, wantAck=wantAck, wantResponse=wantResponse, **kwargs
+            )
+            future.set_result(None)
+            return future
+
+        def onReply(p):
+            if future.set_running_or_notify_cancel():
+                future.set_result(p)
+
+        def onExpired():
+            if future.set_running_or_notify_cancel():
+                future.set_exception(TimeoutError("No response to our request"))
+
+        packet = self.sendData(
+            data,
+            destinationId,
+            portNum=portNum,
+            wantAck=wantAck,
+            wantResponse=wantResponse,
+            onResponse=onReply,
+            onResponseAckPermitted=not wantResponse,
+            responseTimeout=responseTimeout,
+            onResponseExpired=onExpired,
+            **kwargs,
+        )
+        future.packet = packet
+
+        def onDone(f):
+            if f.cancelled():
+                self.responseHandlers.pop(packet.id, None)
+                self._responseDeadlines.cancel(packet.id)
+
+        future.add_done_callback(onDone)
+        return future
+
+    def sendLargeData(
+        self,
+        data,
+        destinationId: Union[int, str],
+        channelIndex: int = 0,
+    ) -> Future:
+        """Send data too big for sendData to another node, split into fragments
+
+        The other node publishes it as meshtastic.transfer.received once it
+        has every fragment, see meshtastic.transfer. Returns a Future that
+        resolves once the other node has acknowledged all of it.
+        """
+        if getattr(data, "SerializeToString", None):
+            data = data.SerializeToString()
+        if destinationId in (BROADCAST_ADDR, BROADCAST_NUM):
+            raise MeshInterface.MeshInterfaceError("Large payloads can only be sent to a single node")
+        return self.transfers.send(data, destinationId, channelIndex=channelIndex)
+
     def sendPosition(
         self,
         latitude: float = 0.0,
@@ -952,10 +1037,57 @@ class MeshInterface:  # pylint: disable=R0902
         requestId: int,
         callback: Callable[[dict], Any],
         ackPermitted: bool = False,
+        timeout: Optional[float] = None,
+        onExpired: Optional[Callable[[], Any]] = None,
     ):
+        if timeout is None:
+            timeout = self.responseTimeout
+        now = time.monotonic()
+        deadline = now + timeout if timeout is not None else None
         self.responseHandlers[requestId] = ResponseHandler(
-            callback=callback, ackPermitted=ackPermitted
+            callback=callback, ackPermitted=ackPermitted, created=now, deadline=deadline, onExpired=onExpired
         )
+        if deadline is not None:
+            self._responseDeadlines.add(requestId, deadline)
+            self._scheduleResponseSweep()
+
+    def _scheduleResponseSweep(self) -> None:
+        """Make sure expired response handlers get swept, while there are any pending"""
+        with self._responseSweepLock:
+            if self._responseSweepTimer is None and len(self._responseDeadlines):
+                self._responseSweepTimer = self._callLater(RESPONSE_SWEEP_INTERVAL, self._sweepResponseHandlers)
+
+    def _sweepResponseHandlers(self) -> None:
+        """Give up on the response handlers whose deadline has passed"""
+        with self._responseSweepLock:
+            self._responseSweepTimer = None
+        try:
+            for requestId in self._responseDeadlines.expire():
+                handler = self.responseHandlers.pop(requestId, None)
+                if handler is None:
+                    continue
+                logger.debug(
+                    f"No response for requestId {requestId} after {time.monotonic() - handler.created:.0f} seconds"
+                )
+                if handler.onExpired is not None:
+                    handler.onExpired()
+                else:
+                    handler.callback(self._timeoutPacket(requestId))
+        finally:
+            self._scheduleResponseSweep()
+
+    def _timeoutPacket(self, requestId: int) -> dict:
+        """What a response handler is given when nothing arrived in time: a NAK from our own node"""
+        nodeNum = self.localNode.nodeNum
+        return {
+            "from": nodeNum,
+            "to": nodeNum,
+            "decoded": {
+                "portnum": portnums_pb2.PortNum.Name(portnums_pb2.PortNum.ROUTING_APP),
+                "requestId": requestId,
+                "routing": {"errorReason": mesh_pb2.Routing.Error.Name(mesh_pb2.Routing.Error.TIMEOUT)},
+            },
+        }
 
     def _sendPacket(
         self,
@@ -965,6 +1097,7 @@ class MeshInterface:  # pylint: disable=R0902
         hopLimit: Optional[int]=None,
         pkiEncrypted: Optional[bool]=False,
         publicKey: Optional[bytes]=None,
+        wait: bool=True,
     ):
         """Send a MeshPacket to the specified node (or if unspecified, broadcast).
         You probably don't want this - use sendData instead.
@@ -991,20 +1124,8 @@ class MeshInterface:  # pylint: disable=R0902
                 nodeNum = self.myInfo.my_node_num
             else:
                 our_exit("Warning: No myInfo found.")
-        # A simple hex style nodeid - we can parse this without needing the DB
-        elif isinstance(destinationId, str) and len(destinationId) >= 8:
-            # assuming some form of node id string such as !1234578 or 0x12345678
-            # always grab the last 8 items of the hexadecimal id str and parse to integer
-            nodeNum = int(destinationId[-8:], 16)
         else:
-            if self.nodes:
-                node = self.nodes.get(destinationId)
-                if node is None:
-                    our_exit(f"Warning: NodeId {destinationId} not found in DB")
-                else:
-                    nodeNum = node["num"]
-            else:
-                logger.warning("Warning: There were no self.nodes.")
+            nodeNum = self._resolveDestination(destinationId)
 
         meshPacket.to = nodeNum
         meshPacket.want_ack = wantAck
@@ -1014,6 +1135,10 @@ class MeshInterface:  # pylint: disable=R0902
         else:
             loraConfig = getattr(self.localNode.localConfig, "lora")
             meshPacket.hop_limit = getattr(loraConfig, "hop_limit")
+            if self.autoHopLimit and nodeNum != BROADCAST_NUM and self.myInfo is not None:
+                needed = self.meshGraph.hopLimitFor(self.myInfo.my_node_num, nodeNum)
+                if needed is not None and needed < meshPacket.hop_limit:
+                    meshPacket.hop_limit = needed
 
         if pkiEncrypted:
             meshPacket.pki_encrypted = True
@@ -1033,9 +1158,36 @@ class MeshInterface:  # pylint: disable=R0902
             )
         else:
             logger.debug(f"Sending packet: {stripnl(meshPacket)}")
-            self._sendToRadio(toRadio)
+            self._sendToRadio(toRadio, wait=wait)
         return meshPacket
 
+    def _lookupNodeNum(self, name: str) -> Optional[int]:
+        """The node number for a node id, public key, long or short name in the node index, None if there's none"""
+        matches = self.nodeIndex.lookup(name)
+        if len(matches) > 1:
+            ids = ", ".join(f"!{num:08x}" for num in matches)
+            our_exit(f"Warning: {name} could be any of {ids}, use the node ID instead")
+        return matches[0] if matches else None
+
+    def _resolveDestination(self, destinationId: str) -> int:
+        """The node number for a node id, public key, long or short name"""
+        nodeNum = self._lookupNodeNum(destinationId)
+        if nodeNum is not None:
+            return nodeNum
+        # A simple hex style nodeid (!12345678, 0x12345678 or 12345678) - we can parse this without needing the DB
+        nodeNum = parse_node_id(destinationId)
+        if nodeNum is not None:
+            return nodeNum
+        if self.nodes:
+            node = self.nodes.get(destinationId)
+            if node is None:
+                our_exit(f"Warning: NodeId {destinationId} not found in DB")
+            else:
+                return node["num"]
+        else:
+            logger.warning("Warning: There were no self.nodes.")
+        return 0
+
     def waitForConfig(self):
         """Block until radio config is received. Returns True if config has been received."""
         success = (
@@ -1079,6 +1231,31 @@ class MeshInterface:  # pylint: disable=R0902
         if not success:
             raise MeshInterface.MeshInterfaceError("Timed out waiting for waypoint")
 
+    def distanceAndBearing(self, destinationId: Union[int, str]) -> Optional[Tuple[float, float]]:
+        """(meters, degrees from north) from our node to another, None unless we know where both are
+
+        Arguments:
+            destinationId -- the node, as a node number, node ID or name
+        """
+        if isinstance(destinationId, int):
+            nodeNum = destinationId
+        else:
+            matches = self.nodeIndex.lookup(destinationId)
+            if len(matches) != 1:
+                return None
+            nodeNum = matches[0]
+        if self.myInfo is None:
+            return None
+        here = self.spatialIndex.position(self.myInfo.my_node_num)
+        there = self.spatialIndex.position(nodeNum)
+        if here is None or there is None:
+            return None
+        return distance(*here, *there), bearing(*here, *there)
+
+    def nodeDbMemory(self) -> int:
+        """Approximate bytes taken by the node DB (nodesByNum and everything in it)"""
+        return deepSizeOf(self.nodesByNum) if self.nodesByNum is not None else 0
+
     def getMyNodeInfo(self) -> Optional[Dict]:
         """Get info about my node."""
         if self.myInfo is None or self.nodesByNum is None:
@@ -1157,8 +1334,18 @@ class MeshInterface:  # pylint: disable=R0902
     def _disconnected(self):
         """Called by subclasses to tell clients this interface has disconnected"""
         self.isConnected.clear()
-        publishingThread.queueWork(
-            lambda: pub.sendMessage("meshtastic.connection.lost", interface=self)
+        self._publish("meshtastic.connection.lost")
+
+    def _publish(self, topic: str, sender: Optional[int] = None, **kwargs) -> None:
+        """Publish a pubsub message (with interface=self) through our dispatcher
+
+        sender is the number of the node the message is about, if any.
+        """
+        self.dispatcher.queueWork(
+            lambda: pub.sendMessage(topic, interface=self, **kwargs),
+            topic=topic,
+            interface=self,
+            sender=sender,
         )
 
     def sendHeartbeat(self):
@@ -1174,12 +1361,18 @@ class MeshInterface:  # pylint: disable=R0902
             self.heartbeatTimer = None
             interval = 300
             logger.debug(f"Sending heartbeat, interval {interval} seconds")
-            self.heartbeatTimer = threading.Timer(interval, callback)
-            self.heartbeatTimer.start()
+            self.heartbeatTimer = self._callLater(interval, callback)
             self.sendHeartbeat()
 
         callback()  # run our periodic callback now, it will make another timer if necessary
 
+    def _callLater(self, delay: float, callback: Callable[[], None]) -> Cancellable:
+        """Run callback after delay seconds, returns something we can cancel()"""
+        timer = threading.Timer(delay, callback)
+        timer.daemon = True  # a pending timer should not keep the program from exiting
+        timer.start()
+        return timer
+
     def _connected(self):
         """Called by this class to tell clients we are now fully connected to a node"""
         # (because I'm lazy) _connected might be called when remote Node
@@ -1188,23 +1381,39 @@ class MeshInterface:  # pylint: disable=R0902
         if not self.isConnected.is_set():
             self.isConnected.set()
             self._startHeartbeat()
-            publishingThread.queueWork(
-                lambda: pub.sendMessage(
-                    "meshtastic.connection.established", interface=self
-                )
-            )
+            self._publish("meshtastic.connection.established")
 
     def _startConfig(self):
         """Start device packets flowing"""
+        self._saveNodeCache()  # what we know now is newer than anything the cache has
         self.myInfo = None
         self.nodes = {}  # nodes keyed by ID
         self.nodesByNum = {}  # nodes keyed by nodenum
+        self.nodeIndex.clear()
+        self.nodeJournal.reset()
+        self.spatialIndex.clear()
+        skipNodes = self.noNodes
+        if self.nodeCache is not None:
+            localNum = self.localNode.nodeNum if self.localNode.nodeNum != -1 else self.nodeCache.lastLocalNum()
+            self._loadNodeCache(localNum)
+            self._nodeCacheSkipped = (
+                not skipNodes
+                and localNum is not None
+                and self.nodeCache.skipDownloadWhenFresh
+                and self.nodeCache.isFresh(localNum)
+            )
+            skipNodes = skipNodes or self._nodeCacheSkipped
         self._localChannels = (
             []
         )  # empty until we start getting channels pushed from the device (during config)
+        # the radio starts with an empty TX queue, so anything we had in flight must be sent again
+        self.queueStatus = None
+        self.txScheduler.reset()
 
         startConfig = mesh_pb2.ToRadio()
-        if self.configId is None or not self.noNodes:
+        if skipNodes:
+            self.configId = NODELESS_WANT_CONFIG_ID
+        else:
             self.configId = random.randint(0, 0xFFFFFFFF)
             if self.configId == NODELESS_WANT_CONFIG_ID:
                 self.configId = self.configId + 1
@@ -1228,67 +1437,122 @@ class MeshInterface:  # pylint: disable=R0902
             return
         self.queueStatus.free -= 1
 
-    def _sendToRadio(self, toRadio: mesh_pb2.ToRadio) -> None:
-        """Send a ToRadio protobuf to the device"""
+    def _queueRelease(self) -> None:
+        """Give back a slot taken by _queueClaim for a packet that never reached the radio"""
+        if self.queueStatus is None:
+            return
+        self.queueStatus.free += 1
+
+    def _sendToRadio(self, toRadio: mesh_pb2.ToRadio, wait: bool = True) -> None:
+        """Send a ToRadio protobuf to the device
+
+        MeshPackets go through the TX scheduler, which writes them as the radio
+        frees up queue slots. If wait is True we block until the packet has been
+        written, otherwise it is just queued. Other messages are written immediately.
+        """
         if self.noProto:
             logger.warning(
                 "Not sending packet because protocol use is disabled by noProto"
             )
+        elif not toRadio.HasField("packet"):
+            self.txScheduler.sendNow(toRadio)
         else:
-            # logger.debug(f"Sending toRadio: {stripnl(toRadio)}")
-
-            if not toRadio.HasField("packet"):
-                # not a meshpacket -- send immediately, give queue a chance,
-                # this makes heartbeat trigger queue
-                self._sendToRadioImpl(toRadio)
-            else:
-                # meshpacket -- queue
-                self.queue[toRadio.packet.id] = toRadio
-
-            resentQueue = collections.OrderedDict()
-
-            while self.queue:
-                # logger.warn("queue: " + " ".join(f'{k:08x}' for k in self.queue))
-                while not self._queueHasFreeSpace():
-                    logger.debug("Waiting for free space in TX Queue")
-                    time.sleep(0.5)
-                try:
-                    toResend = self.queue.popitem(last=False)
-                except KeyError:
-                    break
-                packetId, packet = toResend
-                # logger.warn(f"packet: {packetId:08x} {packet}")
-                resentQueue[packetId] = packet
-                if packet is False:
-                    continue
-                self._queueClaim()
-                if packet != toRadio:
-                    logger.debug(f"Resending packet ID {packetId:08x} {packet}")
-                self._sendToRadioImpl(packet)
-
-            # logger.warn("resentQueue: " + " ".join(f'{k:08x}' for k in resentQueue))
-            for packetId, packet in resentQueue.items():
-                if (
-                    self.queue.pop(packetId, False) is False
-                ):  # Packet got acked under us
-                    logger.debug(f"packet {packetId:08x} got acked under us")
-                    continue
-                if packet:
-                    self.queue[packetId] = packet
-            # logger.warn("queue + resentQueue: " + " ".join(f'{k:08x}' for k in self.queue))
+            future = self.txScheduler.enqueue(toRadio)
+            if wait and not self.txScheduler.inDriverThread():
+                future.result()
+
+    def timeUntilSend(self) -> float:
+        """Seconds until the airtime budget lets the next queued packet go (or, if none is queued,
+        a full size one), 0 if nothing is holding it back"""
+        if self.airtimeLimiter is None:
+            return 0.0
+        if len(self.txScheduler):
+            return self.txScheduler.timeUntilSend()
+        return self.airtimeLimiter.timeUntilSend()
 
     def _sendToRadioImpl(self, toRadio: mesh_pb2.ToRadio) -> None:
         """Send a ToRadio protobuf to the device"""
         logger.error(f"Subclass must provide toradio: {toRadio}")
 
+    def _sendManyToRadioImpl(self, toRadios: List[mesh_pb2.ToRadio]) -> None:
+        """Send several ToRadio protobufs to the device, transports that can batch writes override this"""
+        for toRadio in toRadios:
+            self._sendToRadioImpl(toRadio)
+
+    def _dropUnconfirmedNodes(self) -> None:
+        """Remove the cached nodes the radio hasn't sent us from the node DB"""
+        for num in self._nodeCacheUnconfirmed:
+            node = self.nodesByNum.pop(num, None) if self.nodesByNum is not None else None
+            if node is not None:
+                self.nodeIndex.remove(num)
+                self._nodeChanged(node, None)
+                nodeId = node.get("user", {}).get("id")
+                if self.nodes is not None and self.nodes.get(nodeId) is node:
+                    del self.nodes[nodeId]
+        self._nodeCacheUnconfirmed = set()
+
+    def _loadNodeCache(self, localNum: Optional[int]) -> None:
+        """Put the cached nodes of a radio in the node DB, in place of any other radio's"""
+        self._dropUnconfirmedNodes()
+        self._nodeCacheNum = localNum
+        if localNum is None or self.nodeCache is None:
+            return
+        for cached in self.nodeCache.load(localNum):
+            num = cached.get("num")
+            if num is None or num in self.nodesByNum:  # type: ignore[operator]
+                continue
+            node = NodeRecord(cached)
+            self.nodesByNum[num] = node  # type: ignore[index]
+            if "id" in node.get("user", {}):
+                self.nodes[node["user"]["id"]] = node  # type: ignore[index]
+            self.nodeIndex.update(node)
+            self._nodeCacheUnconfirmed.add(num)
+            self._nodeChanged(node, dict(node))
+        logger.debug(f"Loaded {len(self._nodeCacheUnconfirmed)} nodes from the node cache")
+
+    def _saveNodeCache(self, downloaded: bool = False) -> None:
+        """Save the node DB to the node cache, if we have one and know which radio it is for"""
+        if self._nodeCacheTimer is not None:
+            self._nodeCacheTimer.cancel()
+            self._nodeCacheTimer = None
+        if self.nodeCache is None or self.myInfo is None or not self.nodesByNum:
+            return
+        try:
+            self.nodeCache.save(self.myInfo.my_node_num, list(self.nodesByNum.values()), downloaded=downloaded)
+        except Exception as ex:
+            logger.warning(f"Could not save the node cache: {ex}")
+
+    def _saveNodeCacheLater(self) -> None:
+        if self.nodeCache is not None and self.nodeCache.saveInterval is not None:
+            self._nodeCacheTimer = self._callLater(self.nodeCache.saveInterval, self._onNodeCacheTimer)
+
+    def _onNodeCacheTimer(self) -> None:
+        self._nodeCacheTimer = None
+        self._saveNodeCache()
+        self._saveNodeCacheLater()
+
     def _handleConfigComplete(self) -> None:
         """
         Done with initial config messages, now send regular MeshPackets
         to ask for settings and channels
         """
+        if self.nodeCache is not None and self.myInfo is not None:
+            if self._nodeCacheSkipped and not self.nodeCache.isFresh(self.myInfo.my_node_num):
+                # the cache we trusted was for another radio
+                logger.info("Node cache is not for this radio, downloading its node DB")
+                self._nodeCacheSkipped = False
+                self._startConfig()
+                return
+            if not self.noNodes and not self._nodeCacheSkipped:
+                # what the radio didn't send, it no longer knows
+                self._dropUnconfirmedNodes()
+            self._saveNodeCache(downloaded=not self.noNodes and not self._nodeCacheSkipped)
+            self._saveNodeCacheLater()
         # This is no longer necessary because the current protocol statemachine has already proactively sent us the locally visible channels
         # self.localNode.requestChannels()
         self.localNode.setChannels(self._localChannels)
+        # only now do we know this is the radio (and the config) the outbox was meant for
+        self.txScheduler.restore()
 
         # the following should only be called after we have settings and channels
         self._connected()  # Tell everyone else we are ready to go
@@ -1298,19 +1562,7 @@ class MeshInterface:  # pylint: disable=R0902
         logger.debug(
             f"TX QUEUE free {queueStatus.free} of {queueStatus.maxlen}, res = {queueStatus.res}, id = {queueStatus.mesh_packet_id:08x} "
         )
-
-        if queueStatus.res:
-            return
-
-        # logger.warn("queue: " + " ".join(f'{k:08x}' for k in self.queue))
-        justQueued = self.queue.pop(queueStatus.mesh_packet_id, None)
-
-        if justQueued is None and queueStatus.mesh_packet_id != 0:
-            self.queue[queueStatus.mesh_packet_id] = False
-            logger.debug(
-                f"Reply for unexpected packet ID {queueStatus.mesh_packet_id:08x}"
-            )
-        # logger.warn("queue: " + " ".join(f'{k:08x}' for k in self.queue))
+        self.txScheduler.onQueueStatus(queueStatus)
 
     def _handleFromRadio(self, fromRadioBytes):
         """
@@ -1319,21 +1571,24 @@ class MeshInterface:  # pylint: disable=R0902
         Called by subclasses."""
         fromRadio = mesh_pb2.FromRadio()
         logger.debug(
-            f"in mesh_interface.py _handleFromRadio() fromRadioBytes: {fromRadioBytes}"
+            f"in mesh_interface.py _handleFromRadio() fromRadioBytes: {bytes(fromRadioBytes)!r}"
         )
         try:
             fromRadio.ParseFromString(fromRadioBytes)
         except Exception as ex:
             logger.error(
-                    f"Error while parsing FromRadio bytes:{fromRadioBytes} {ex}"
+                    f"Error while parsing FromRadio bytes:{bytes(fromRadioBytes)!r} {ex}"
             )
             traceback.print_exc()
             raise ex
-        asDict = google.protobuf.json_format.MessageToDict(fromRadio)
-        logger.debug(f"Received from radio: {fromRadio}")
+        # %s rather than an f-string, so the message is only formatted when debug logging is on
+        logger.debug("Received from radio: %s", fromRadio)
         if fromRadio.HasField("my_info"):
             self.myInfo = fromRadio.my_info
             self.localNode.nodeNum = self.myInfo.my_node_num
+            if self.nodeCache is not None and self.myInfo.my_node_num != self._nodeCacheNum:
+                self._loadNodeCache(self.myInfo.my_node_num)
+            self._timeout.wake()
             logger.debug(f"Received myinfo: {stripnl(fromRadio.my_info)}")
 
         elif fromRadio.HasField("metadata"):
@@ -1341,26 +1596,24 @@ class MeshInterface:  # pylint: disable=R0902
             logger.debug(f"Received device metadata: {stripnl(fromRadio.metadata)}")
 
         elif fromRadio.HasField("node_info"):
-            logger.debug(f"Received nodeinfo: {asDict['nodeInfo']}")
+            nodeInfo = google.protobuf.json_format.MessageToDict(fromRadio.node_info)
+            logger.debug(f"Received nodeinfo: {nodeInfo}")
 
-            node = self._getOrCreateByNum(asDict["nodeInfo"]["num"])
-            node.update(asDict["nodeInfo"])
-            try:
-                newpos = self._fixupPosition(node["position"])
-                node["position"] = newpos
-            except:
+            node = self._getOrCreateByNum(nodeInfo["num"])
+            self._nodeCacheUnconfirmed.discard(nodeInfo["num"])
+            if "position" in nodeInfo:
+                nodeInfo["position"] = self._fixupPosition(nodeInfo["position"])
+            else:
                 logger.debug("Node without position")
+            self._updateNode(node, nodeInfo)
 
             # no longer necessary since we're mutating directly in nodesByNum via _getOrCreateByNum
             # self.nodesByNum[node["num"]] = node
             if "user" in node:  # Some nodes might not have user/ids assigned yet
                 if "id" in node["user"]:
                     self.nodes[node["user"]["id"]] = node
-            publishingThread.queueWork(
-                lambda: pub.sendMessage(
-                    "meshtastic.node.updated", node=node, interface=self
-                )
-            )
+            self.nodeIndex.update(node)
+            self._publish("meshtastic.node.updated", sender=node.get("num"), node=node)
         elif fromRadio.config_complete_id == self.configId:
             # we ignore the config_complete_id, it is unneeded for our
             # stream API fromRadio.config_complete_id
@@ -1375,31 +1628,13 @@ class MeshInterface:  # pylint: disable=R0902
         elif fromRadio.HasField("queueStatus"):
             self._handleQueueStatusFromRadio(fromRadio.queueStatus)
         elif fromRadio.HasField("clientNotification"):
-            publishingThread.queueWork(
-                lambda: pub.sendMessage(
-                    "meshtastic.clientNotification",
-                    notification=fromRadio.clientNotification,
-                    interface=self,
-                )
-            )
+            self._publish("meshtastic.clientNotification", notification=fromRadio.clientNotification)
 
         elif fromRadio.HasField("mqttClientProxyMessage"):
-            publishingThread.queueWork(
-                lambda: pub.sendMessage(
-                    "meshtastic.mqttclientproxymessage",
-                    proxymessage=fromRadio.mqttClientProxyMessage,
-                    interface=self,
-                )
-            )
+            self._publish("meshtastic.mqttclientproxymessage", proxymessage=fromRadio.mqttClientProxyMessage)
 
         elif fromRadio.HasField("xmodemPacket"):
-            publishingThread.queueWork(
-                lambda: pub.sendMessage(
-                    "meshtastic.xmodempacket",
-                    packet=fromRadio.xmodemPacket,
-                    interface=self,
-                )
-            )
+            self._publish("meshtastic.xmodempacket", packet=fromRadio.xmodemPacket)
 
         elif fromRadio.HasField("rebooted") and fromRadio.rebooted:
             # Tell clients the device went away.  Careful not to call the overridden
@@ -1409,78 +1644,14 @@ class MeshInterface:  # pylint: disable=R0902
             self._startConfig()  # redownload the node db etc...
 
         elif fromRadio.HasField("config") or fromRadio.HasField("moduleConfig"):
-            if fromRadio.config.HasField("device"):
-                self.localNode.localConfig.device.CopyFrom(fromRadio.config.device)
-            elif fromRadio.config.HasField("position"):
-                self.localNode.localConfig.position.CopyFrom(fromRadio.config.position)
-            elif fromRadio.config.HasField("power"):
-                self.localNode.localConfig.power.CopyFrom(fromRadio.config.power)
-            elif fromRadio.config.HasField("network"):
-                self.localNode.localConfig.network.CopyFrom(fromRadio.config.network)
-            elif fromRadio.config.HasField("display"):
-                self.localNode.localConfig.display.CopyFrom(fromRadio.config.display)
-            elif fromRadio.config.HasField("lora"):
-                self.localNode.localConfig.lora.CopyFrom(fromRadio.config.lora)
-            elif fromRadio.config.HasField("bluetooth"):
-                self.localNode.localConfig.bluetooth.CopyFrom(
-                    fromRadio.config.bluetooth
-                )
-            elif fromRadio.config.HasField("security"):
-                self.localNode.localConfig.security.CopyFrom(
-                    fromRadio.config.security
-                )
-            elif fromRadio.moduleConfig.HasField("mqtt"):
-                self.localNode.moduleConfig.mqtt.CopyFrom(fromRadio.moduleConfig.mqtt)
-            elif fromRadio.moduleConfig.HasField("serial"):
-                self.localNode.moduleConfig.serial.CopyFrom(
-                    fromRadio.moduleConfig.serial
-                )
-            elif fromRadio.moduleConfig.HasField("external_notification"):
-                self.localNode.moduleConfig.external_notification.CopyFrom(
-                    fromRadio.moduleConfig.external_notification
-                )
-            elif fromRadio.moduleConfig.HasField("store_forward"):
-                self.localNode.moduleConfig.store_forward.CopyFrom(
-                    fromRadio.moduleConfig.store_forward
-                )
-            elif fromRadio.moduleConfig.HasField("range_test"):
-                self.localNode.moduleConfig.range_test.CopyFrom(
-                    fromRadio.moduleConfig.range_test
-                )
-            elif fromRadio.moduleConfig.HasField("telemetry"):
-                self.localNode.moduleConfig.telemetry.CopyFrom(
-                    fromRadio.moduleConfig.telemetry
-                )
-            elif fromRadio.moduleConfig.HasField("canned_message"):
-                self.localNode.moduleConfig.canned_message.CopyFrom(
-                    fromRadio.moduleConfig.canned_message
-                )
-            elif fromRadio.moduleConfig.HasField("audio"):
-                self.localNode.moduleConfig.audio.CopyFrom(fromRadio.moduleConfig.audio)
-            elif fromRadio.moduleConfig.HasField("remote_hardware"):
-                self.localNode.moduleConfig.remote_hardware.CopyFrom(
-                    fromRadio.moduleConfig.remote_hardware
-                )
-            elif fromRadio.moduleConfig.HasField("neighbor_info"):
-                self.localNode.moduleConfig.neighbor_info.CopyFrom(
-                    fromRadio.moduleConfig.neighbor_info
-                )
-            elif fromRadio.moduleConfig.HasField("detection_sensor"):
-                self.localNode.moduleConfig.detection_sensor.CopyFrom(
-                    fromRadio.moduleConfig.detection_sensor
-                )
-            elif fromRadio.moduleConfig.HasField("ambient_lighting"):
-                self.localNode.moduleConfig.ambient_lighting.CopyFrom(
-                    fromRadio.moduleConfig.ambient_lighting
-                )
-            elif fromRadio.moduleConfig.HasField("paxcounter"):
-                self.localNode.moduleConfig.paxcounter.CopyFrom(
-                    fromRadio.moduleConfig.paxcounter
-                )
-            elif fromRadio.moduleConfig.HasField("traffic_management"):
-                self.localNode.moduleConfig.traffic_management.CopyFrom(
-                    fromRadio.moduleConfig.traffic_management
-                )
+            kind = fromRadio.WhichOneof("payload_variant")
+            config = getattr(fromRadio, kind)
+            section = config.WhichOneof("payload_variant")
+            localAttr = CONFIG_SECTIONS[kind].get(section)
+            if localAttr is not None:
+                getattr(getattr(self.localNode, localAttr), section).CopyFrom(getattr(config, section))
+            else:
+                logger.debug(f"Ignoring {kind} section {section}")
 
         else:
             logger.debug("Unexpected FromRadio payload")
@@ -1531,18 +1702,45 @@ class MeshInterface:  # pylint: disable=R0902
             return self.nodesByNum[nodeNum]
         else:
             presumptive_id = f"!{nodeNum:08x}"
-            n = {
-                "num": nodeNum,
-                "user": {
+            n = NodeRecord(
+                num=nodeNum,
+                user={
                     "id": presumptive_id,
                     "longName": f"Meshtastic {presumptive_id[-4:]}",
                     "shortName": f"{presumptive_id[-4:]}",
                     "hwModel": "UNSET",
                 },
-            }  # Create a minimal node db entry
+            )  # Create a minimal node db entry
             self.nodesByNum[nodeNum] = n
+            self.nodeIndex.update(n)
+            self._nodeChanged(n, dict(n))
             return n
 
+    def _updateNode(self, node: Dict, fields: Dict[str, Any]) -> None:
+        """Set some keys of a node DB entry, journaling and publishing the ones that changed"""
+        changes = {}
+        for key, value in fields.items():
+            if key not in UNJOURNALED and (key not in node or node[key] != value):
+                changes[key] = value
+            node[key] = value
+        if changes:
+            self._nodeChanged(node, changes)
+
+    def _nodeChanged(self, node: Dict, changes: Optional[Dict[str, Any]]) -> None:
+        """Record a change to a node DB entry (changes None if it was removed) and publish it"""
+        if changes is None:
+            self.spatialIndex.remove(node["num"])
+            if self.telemetryHistory is not None:
+                self.telemetryHistory.remove(node["num"])
+        elif "position" in changes:
+            position = changes["position"] or {}
+            if "latitude" in position and "longitude" in position:
+                self.spatialIndex.update(node["num"], position["latitude"], position["longitude"])
+            else:
+                self.spatialIndex.remove(node["num"])
+        seq = self.nodeJournal.record(node["num"], changes)
+        self._publish("meshtastic.node.changed", sender=node["num"], node=node, changes=changes, seq=seq)
+
     def _handleChannel(self, channel):
         """During initial config the local node will proactively send all N (8) channels it knows"""
         self._localChannels.append(channel)
@@ -1562,24 +1760,56 @@ class MeshInterface:  # pylint: disable=R0902
         - meshtastic.receive.position(packet = MeshPacket dictionary)
         - meshtastic.receive.user(packet = MeshPacket dictionary)
         - meshtastic.receive.data(packet = MeshPacket dictionary)
-        """
-        asDict = google.protobuf.json_format.MessageToDict(meshPacket)
-
-        # We normally decompose the payload into a dictionary so that the client
-        # doesn't need to understand protobufs.  But advanced clients might
-        # want the raw protobuf, so we provide it in "raw"
-        asDict["raw"] = meshPacket
 
+        and, if publishRaw is set, the matching meshtastic.raw.receive.* event
+        with the MeshPacket and decoded payload protobufs.
+        """
         # from might be missing if the nodenum was zero.
-        if not hack and "from" not in asDict:
-            asDict["from"] = 0
+        if not hack and getattr(meshPacket, "from") == 0:
             logger.error(
-                f"Device returned a packet we sent, ignoring: {stripnl(asDict)}"
+                f"Device returned a packet we sent, ignoring: {stripnl(meshPacket)}"
             )
             print(
-                f"Error: Device returned a packet we sent, ignoring: {stripnl(asDict)}"
+                f"Error: Device returned a packet we sent, ignoring: {stripnl(meshPacket)}"
             )
             return
+
+        if meshPacket.HasField("decoded") and meshPacket.decoded.portnum == COMPRESSED_PORTNUM:
+            # so that handlers and subscribers only ever see the original
+            try:
+                portnum, payload = decompress(meshPacket.decoded.payload)
+            except CompressionError as ex:
+                logger.warning(f"Could not decompress packet from {getattr(meshPacket, 'from')}: {ex}")
+            else:
+                meshPacket.decoded.portnum = portnum  # type: ignore[assignment]
+                meshPacket.decoded.payload = payload
+
+        # Parse the payload once, for both the raw and the dictionary events
+        handler = None
+        pb = None
+        if meshPacket.HasField("decoded"):
+            handler = protocols.get(meshPacket.decoded.portnum)
+            if handler is not None and handler.protobufFactory is not None:
+                pb = handler.protobufFactory()
+                pb.ParseFromString(meshPacket.decoded.payload)
+
+        if self.publishRaw:
+            self._publishRawPacket(meshPacket, handler, pb)
+
+        if not self.publishDicts and (handler is None or handler.onReceive is None) and (
+            meshPacket.decoded.request_id not in self.responseHandlers
+        ):
+            return  # nobody needs the dictionary
+
+        # Fields are converted to their dictionary form when first looked at,
+        # so we only pay for what we (and the subscribers) actually read
+        asDict = LazyMessageDict(meshPacket)
+
+        # We normally decompose the payload into a dictionary so that the client
+        # doesn't need to understand protobufs.  But advanced clients might
+        # want the raw protobuf, so we provide it in "raw"
+        asDict["raw"] = meshPacket
+
         if "to" not in asDict:
             asDict["to"] = 0
 
@@ -1620,18 +1850,14 @@ class MeshInterface:  # pylint: disable=R0902
             # decode position protobufs and update nodedb, provide decoded version
             # as "position" in the published msg move the following into a 'decoders'
             # API that clients could register?
-            portNumInt = meshPacket.decoded.portnum  # we want portnum as an int
-            handler = protocols.get(portNumInt)
             # The decoded protobuf as a dictionary (if we understand this message)
             p = None
             if handler is not None:
                 topic = f"meshtastic.receive.{handler.name}"
 
                 # Convert to protobuf if possible
-                if handler.protobufFactory is not None:
-                    pb = handler.protobufFactory()
-                    pb.ParseFromString(meshPacket.decoded.payload)
-                    p = google.protobuf.json_format.MessageToDict(pb)
+                if pb is not None:
+                    p = LazyMessageDict(pb)
                     asDict["decoded"][handler.name] = p
                     # Also provide the protobuf raw
                     asDict["decoded"][handler.name]["raw"] = pb
@@ -1660,12 +1886,29 @@ class MeshInterface:  # pylint: disable=R0902
                         or handler.ackPermitted
                     ):
                         handler = self.responseHandlers.pop(requestId, None)
-                        logger.debug(
-                            f"Calling response handler for requestId {requestId}"
-                        )
-                        handler.callback(asDict)
-
-        logger.debug(f"Publishing {topic}: packet={stripnl(asDict)} ")
-        publishingThread.queueWork(
-            lambda: pub.sendMessage(topic, packet=asDict, interface=self)
-        )
+                        if handler is not None:  # unless it just expired
+                            self._responseDeadlines.cancel(requestId)
+                            logger.debug(
+                                f"Calling response handler for requestId {requestId}"
+                            )
+                            handler.callback(asDict)
+
+        if not self.publishDicts:
+            return
+        if logger.isEnabledFor(logging.DEBUG):  # printing the packet converts all of it
+            logger.debug(f"Publishing {topic}: packet={stripnl(asDict)} ")
+        self._publish(topic, sender=getattr(meshPacket, "from"), packet=asDict)
+
+    def _publishRawPacket(self, meshPacket: mesh_pb2.MeshPacket, handler, pb) -> None:
+        """Publish a received packet as protobufs, on the meshtastic.raw.receive topic that
+        mirrors its meshtastic.receive one. decoded is the parsed payload, or None if we have no
+        protobuf for this portnum (text, for instance, is just meshPacket.decoded.payload)."""
+        if handler is not None:
+            topic = f"meshtastic.raw.receive.{handler.name}"
+        elif meshPacket.HasField("decoded"):
+            portnum = meshPacket.decoded.portnum
+            value = portnums_pb2.PortNum.DESCRIPTOR.values_by_number.get(portnum)
+            topic = f"meshtastic.raw.receive.data.{value.name if value is not None else portnum}"
+        else:
+            topic = "meshtastic.raw.receive"
+        self._publish(topic, sender=getattr(meshPacket, "from"), packet=meshPacket, decoded=pb)
@@ -5,7 +5,7 @@ import base64
 import logging
 import time
 
-from typing import Optional, Union, List
+from typing import Any, Optional, Union, List
 
 from meshtastic.protobuf import admin_pb2, apponly_pb2, channel_pb2, config_pb2, localonly_pb2, mesh_pb2, portnums_pb2
 from meshtastic.util import (
@@ -38,6 +38,8 @@ class Node:
         self.channels = None
         self._timeout = Timeout(maxSecs=timeout)
         self.partialChannels: Optional[List] = None
+        # what sendData returned for the last channel request (a PacketFuture on asyncio interfaces)
+        self._channelRequest: Any = None
         self.noProto = noProto
         self.cannedPluginMessage = None
         self.cannedPluginMessageMessages = None
@@ -55,6 +57,17 @@ class Node:
         r += ")"
         return r
 
+    def _toNodeNum(self, nodeId: Union[int, str]) -> int:
+        """The node number for a node number, node id or name, names looked up in the interface's node DB"""
+        try:
+            return to_node_num(nodeId)
+        except ValueError:
+            pass
+        nodeNum = self.iface._lookupNodeNum(str(nodeId).strip())
+        if nodeNum is None:
+            our_exit(f"Warning: NodeId {nodeId} not found in DB")
+        return nodeNum
+
     @staticmethod
     def position_flags_list(position_flags: int) -> List[str]:
         "Return a list of position flags from the given flags integer"
@@ -109,6 +122,7 @@ class Node:
         """Set the channels for this node"""
         self.channels = channels
         self._fixupChannels()
+        self._timeout.wake()
 
     def requestChannels(self, startingIndex: int = 0):
         """Send regular MeshPackets to ask channels."""
@@ -392,7 +406,7 @@ class Node:
 
     def getContactURL(self, node_id: Union[int, str], should_ignore: bool = False, manually_verified: bool = False):
         """Generate a shareable contact URL for the specified node"""
-        nodeNum = to_node_num(node_id)
+        nodeNum = self._toNodeNum(node_id)
 
         node = self.iface.nodesByNum.get(nodeNum)
         if not node or not node.get("user"):
@@ -820,7 +834,7 @@ class Node:
     def removeNode(self, nodeId: Union[int, str]):
         """Tell the node to remove a specific node by ID"""
         self.ensureSessionKey()
-        nodeId = to_node_num(nodeId)
+        nodeId = self._toNodeNum(nodeId)
 
         p = admin_pb2.AdminMessage()
         p.remove_by_nodenum = nodeId
@@ -834,7 +848,7 @@ class Node:
     def setFavorite(self, nodeId: Union[int, str]):
         """Tell the node to set the specified node ID to be favorited on the NodeDB on the device"""
         self.ensureSessionKey()
-        nodeId = to_node_num(nodeId)
+        nodeId = self._toNodeNum(nodeId)
 
         p = admin_pb2.AdminMessage()
         p.set_favorite_node = nodeId
@@ -848,7 +862,7 @@ class Node:
     def removeFavorite(self, nodeId: Union[int, str]):
         """Tell the node to set the specified node ID to be un-favorited on the NodeDB on the device"""
         self.ensureSessionKey()
-        nodeId = to_node_num(nodeId)
+        nodeId = self._toNodeNum(nodeId)
 
         p = admin_pb2.AdminMessage()
         p.remove_favorite_node = nodeId
@@ -862,7 +876,7 @@ class Node:
     def setIgnored(self, nodeId: Union[int, str]):
         """Tell the node to set the specified node ID to be ignored on the NodeDB on the device"""
         self.ensureSessionKey()
-        nodeId = to_node_num(nodeId)
+        nodeId = self._toNodeNum(nodeId)
 
         p = admin_pb2.AdminMessage()
         p.set_ignored_node = nodeId
@@ -876,7 +890,7 @@ class Node:
     def removeIgnored(self, nodeId: Union[int, str]):
         """Tell the node to set the specified node ID to be un-ignored on the NodeDB on the device"""
         self.ensureSessionKey()
-        nodeId = to_node_num(nodeId)
+        nodeId = self._toNodeNum(nodeId)
 
         p = admin_pb2.AdminMessage()
         p.remove_ignored_node = nodeId
@@ -1050,6 +1064,7 @@ class Node:
 
             self.channels = self.partialChannels
             self._fixupChannels()
+            self._timeout.wake()
         else:
             self._requestChannel(index + 1)
 
@@ -1087,9 +1102,10 @@ class Node:
         else:
             logger.debug(f"Requesting channel {channelNum}")
 
-        return self._sendAdmin(
+        self._channelRequest = self._sendAdmin(
             p, wantResponse=True, onResponse=self.onResponseRequestChannel
         )
+        return self._channelRequest
 
     # pylint: disable=R1710
     def _sendAdmin(
@@ -1111,7 +1127,7 @@ class Node:
             ):  # unless a special channel index was used, we want to use the admin index
                 adminIndex = self.iface.localNode._getAdminChannelIndex()
             logger.debug(f"adminIndex:{adminIndex}")
-            nodeid = to_node_num(self.nodeNum)
+            nodeid = self._toNodeNum(self.nodeNum)
             if "adminSessionPassKey" in self.iface._getOrCreateByNum(nodeid):
                 p.session_passkey = self.iface._getOrCreateByNum(nodeid).get("adminSessionPassKey")
             return self.iface.sendData(
@@ -1132,7 +1148,7 @@ class Node:
                 f"Not ensuring session key, because protocol use is disabled by noProto"
             )
         else:
-            nodeid = to_node_num(self.nodeNum)
+            nodeid = self._toNodeNum(self.nodeNum)
             if self.iface._getOrCreateByNum(nodeid).get("adminSessionPassKey") is None:
                 self.requestConfig(admin_pb2.AdminMessage.SESSIONKEY_CONFIG)
 
@@ -0,0 +1,158 @@
+"""Keep the node DB on disk between connections
+
+Every time an interface connects (and whenever the radio reboots) the radio
+sends its whole node DB again, which on a big mesh takes tens of seconds over
+serial. Give an interface a NodeCache and the nodes it knew last time are in
+`nodes`/`nodesByNum` as soon as it starts connecting; what the radio then
+sends is merged into them node by node, and nodes the radio no longer knows
+are dropped once its download is complete::
+
+    iface = SerialInterface(nodeCache=NodeCache("/var/lib/gateway/nodes.db"))
+
+With skipDownloadWhenFresh, an interface whose cache holds a full download
+from the same radio younger than maxAge doesn't ask for the node DB at all
+(as with noNodes), it only gets our own node, and nodes heard from later.
+
+The cache is kept per local node number, so one file can serve several
+radios. It belongs to whoever created it, interfaces never close it.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds a full node DB download stays fresh enough to skip the next one
+DEFAULT_MAX_AGE = 6 * 60 * 60
+# Seconds between saves while connected
+SAVE_INTERVAL = 300.0
+
+# Node keys not worth keeping, or not JSON: the last packet and our admin session
+_UNCACHED = frozenset(("lastReceived", "adminSessionPassKey"))
+
+
+def _cacheable(value: Any) -> Any:
+    """value without the protobufs ("raw") that decoded packets leave in user, position, ..."""
+    if isinstance(value, Mapping):
+        return {k: _cacheable(v) for k, v in value.items() if k != "raw"}
+    if isinstance(value, (list, tuple)):
+        return [_cacheable(v) for v in value]
+    return value
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS radios (
+        local_num INTEGER PRIMARY KEY,
+        saved REAL NOT NULL,
+        downloaded REAL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS nodes (
+        local_num INTEGER NOT NULL,
+        num INTEGER NOT NULL,
+        node TEXT NOT NULL,
+        PRIMARY KEY (local_num, num)
+    )
+    """,
+)
+
+
+class NodeCache:
+    """Node DBs of the radios we have talked to, persisted in a SQLite database"""
+
+    def __init__(
+        self,
+        path: str,
+        maxAge: float = DEFAULT_MAX_AGE,
+        skipDownloadWhenFresh: bool = False,
+        saveInterval: Optional[float] = SAVE_INTERVAL,
+    ) -> None:
+        """Constructor
+
+        Arguments:
+            path -- the database file, created if need be (":memory:" for one that doesn't persist)
+
+        Keyword Arguments:
+            maxAge -- seconds after a full download before the cache is stale
+            skipDownloadWhenFresh -- don't ask the radio for its node DB while the cache is fresh
+            saveInterval -- seconds between saves while connected, None to only save on (re)connect and close
+        """
+        self.path = path
+        self.maxAge = maxAge
+        self.skipDownloadWhenFresh = skipDownloadWhenFresh
+        self.saveInterval = saveInterval
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._closed = False
+
+    def lastLocalNum(self) -> Optional[int]:
+        """The local node number we saved nodes for most recently, None if none"""
+        with self._lock:
+            if self._closed:
+                return None
+            row = self._db.execute("SELECT local_num FROM radios ORDER BY saved DESC LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def isFresh(self, localNum: int) -> bool:
+        """True if we have a full download of this radio's node DB younger than maxAge"""
+        with self._lock:
+            if self._closed:
+                return False
+            row = self._db.execute("SELECT downloaded FROM radios WHERE local_num = ?", (localNum,)).fetchone()
+        return row is not None and row[0] is not None and time.time() - row[0] < self.maxAge
+
+    def load(self, localNum: int) -> List[Dict[str, Any]]:
+        """The nodes saved for this radio"""
+        with self._lock:
+            if self._closed:
+                return []
+            rows = self._db.execute("SELECT node FROM nodes WHERE local_num = ?", (localNum,)).fetchall()
+        nodes = []
+        for (text,) in rows:
+            try:
+                nodes.append(json.loads(text))
+            except ValueError:
+                logger.warning("Ignoring a corrupt node in the node cache")
+        return nodes
+
+    def save(self, localNum: int, nodes: Iterable[Mapping[str, Any]], downloaded: bool = False) -> None:
+        """Replace what we have for this radio with nodes
+
+        Set downloaded if nodes include the radio's whole node DB, fresh from a
+        full download.
+        """
+        rows = []
+        for node in nodes:
+            try:
+                cached = {k: _cacheable(v) for k, v in node.items() if k not in _UNCACHED}
+                rows.append((localNum, node["num"], json.dumps(cached)))
+            except (KeyError, RuntimeError, TypeError, ValueError) as ex:
+                logger.debug(f"Not caching node {node.get('num')}: {ex}")
+        now = time.time()
+        with self._lock:
+            if self._closed:
+                return
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.execute("DELETE FROM nodes WHERE local_num = ?", (localNum,))
+                self._db.executemany("INSERT INTO nodes (local_num, num, node) VALUES (?, ?, ?)", rows)
+                self._db.execute(
+                    "INSERT INTO radios (local_num, saved, downloaded) VALUES (?, ?, ?) "
+                    "ON CONFLICT(local_num) DO UPDATE SET saved = excluded.saved, "
+                    "downloaded = COALESCE(excluded.downloaded, radios.downloaded)",
+                    (localNum, now, now if downloaded else None),
+                )
+
+    def close(self) -> None:
+        """Close the database"""
+        with self._lock:
+            self._closed = True
+            self._db.close()
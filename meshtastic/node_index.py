@@ -0,0 +1,97 @@
+"""Look nodes up by any of the names they go by
+"""
+import threading
+from typing import Any, Dict, List, Mapping, Set, Tuple
+
+# What a node can be called, in the order lookup() tries them
+KEY_KINDS = ("id", "publicKey", "longName", "shortName")
+
+
+def _normalize(kind: str, value: Any) -> Any:
+    """Names are matched ignoring case, ids and keys exactly"""
+    if kind in ("longName", "shortName"):
+        return str(value).strip().casefold()
+    return value
+
+
+class NodeIndex:
+    """Node numbers keyed by node id, public key, long name and short name
+
+    The interface keeps it up to date as nodes are added to nodesByNum and
+    their User info arrives, so finding a node by name is a dict lookup rather
+    than a scan of the node DB. Names need not be unique, so lookups return
+    every node that matches. Node numbers are also indexed by their low 16
+    bits, which the IP tunnel uses as addresses.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._byKey: Dict[str, Dict[Any, Set[int]]] = {kind: {} for kind in KEY_KINDS}
+        self._byLow16: Dict[int, Set[int]] = {}
+        self._keysOf: Dict[int, List[Tuple[str, Any]]] = {}  # node num -> the keys it is indexed under
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._keysOf)
+
+    def update(self, node: Mapping[str, Any]) -> None:
+        """(Re)index a node DB entry, after it was created or its user info changed"""
+        num = node.get("num")
+        if num is None:
+            return
+        user = node.get("user") or {}
+        keys = [("id", f"!{num:08x}")]
+        for kind in KEY_KINDS:
+            value = user.get(kind)
+            if value:
+                keys.append((kind, _normalize(kind, value)))
+        with self._lock:
+            self._removeLocked(num)
+            self._keysOf[num] = keys
+            for kind, value in keys:
+                self._byKey[kind].setdefault(value, set()).add(num)
+            self._byLow16.setdefault(num & 0xFFFF, set()).add(num)
+
+    def remove(self, num: int) -> None:
+        """Forget a node"""
+        with self._lock:
+            self._removeLocked(num)
+
+    def clear(self) -> None:
+        """Forget every node, as when the node DB is downloaded again"""
+        with self._lock:
+            for table in self._byKey.values():
+                table.clear()
+            self._byLow16.clear()
+            self._keysOf.clear()
+
+    def _removeLocked(self, num: int) -> None:
+        for kind, value in self._keysOf.pop(num, ()):
+            nums = self._byKey[kind].get(value)
+            if nums is not None:
+                nums.discard(num)
+                if not nums:
+                    del self._byKey[kind][value]
+        low = self._byLow16.get(num & 0xFFFF)
+        if low is not None:
+            low.discard(num)
+            if not low:
+                del self._byLow16[num & 0xFFFF]
+
+    def lookup(self, name: str) -> List[int]:
+        """The node numbers called name, trying node id, public key, long name and short name in turn
+
+        Returns the matches of the first kind that has any, so a node's id
+        always beats another node's name. Empty if no node is called that.
+        """
+        with self._lock:
+            for kind in KEY_KINDS:
+                nums = self._byKey[kind].get(_normalize(kind, name))
+                if nums:
+                    return sorted(nums)
+        return []
+
+    def byLow16(self, bits: int) -> List[int]:
+        """The node numbers whose low 16 bits are bits"""
+        with self._lock:
+            return sorted(self._byLow16.get(bits, ()))
@@ -0,0 +1,109 @@
+"""A journal of changes to the node DB
+
+Everything the interface changes in nodesByNum - nodes appearing, positions,
+telemetry, user info, when they were last heard - is recorded here as the
+top level keys that changed and their new values, under an increasing
+sequence number. The same changes are published on
+`meshtastic.node.changed(node, changes, seq)`.
+
+So a client (a web UI, say) can fetch the whole DB once, remember `seq`, and
+from then on only ask for what changed::
+
+    seq = iface.nodeJournal.seq
+    snapshot = dict(iface.nodesByNum)
+    ...
+    for num, changes in iface.nodeJournal.changesSince(seq).items():
+        ...  # changes is None if the node was removed
+    seq = iface.nodeJournal.seq
+
+The journal keeps the last maxEntries changes. Asking for changes older than
+that, or from before the node DB was last downloaded again, raises
+JournalError, and the client has to take a new snapshot.
+"""
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, NamedTuple, Optional
+
+DEFAULT_MAX_ENTRIES = 10000
+
+# Node keys that change with every packet and are too big to journal
+UNJOURNALED = frozenset(("lastReceived",))
+
+
+class NodeChange(NamedTuple):
+    """One change to the node DB"""
+
+    #: Sequence number, one more than the change before
+    seq: int
+    #: The node that changed
+    num: int
+    #: The top level keys of the node that changed, with their new values,
+    #: or None if the node was removed
+    changes: Optional[Dict[str, Any]]
+    #: time.time() when it changed
+    time: float
+
+
+class NodeJournal:
+    """Recent changes to one interface's node DB, see the module docstring"""
+
+    class JournalError(Exception):
+        """The changes asked for are no longer in the journal"""
+
+        def __init__(self, message):
+            self.message = message
+            super().__init__(self.message)
+
+    def __init__(self, maxEntries: int = DEFAULT_MAX_ENTRIES) -> None:
+        """Constructor
+
+        Keyword Arguments:
+            maxEntries -- how many changes to keep
+        """
+        self._lock = threading.Lock()
+        self._entries: Deque[NodeChange] = deque(maxlen=maxEntries)
+        self._seq = 0
+        self._floor = 0  # we have every change after this one
+
+    @property
+    def seq(self) -> int:
+        """Sequence number of the latest change"""
+        return self._seq
+
+    def record(self, num: int, changes: Optional[Dict[str, Any]]) -> int:
+        """Add a change to node num (changes None if it was removed), returns its sequence number"""
+        with self._lock:
+            if len(self._entries) == self._entries.maxlen:
+                self._floor = self._entries[0].seq
+            self._seq += 1
+            self._entries.append(NodeChange(self._seq, num, changes, time.time()))
+            return self._seq
+
+    def reset(self) -> None:
+        """Forget all changes, as when the node DB is thrown away to be downloaded again"""
+        with self._lock:
+            self._entries.clear()
+            self._floor = self._seq
+
+    def entriesSince(self, seq: int) -> List[NodeChange]:
+        """Every change after seq, oldest first"""
+        with self._lock:
+            if seq < self._floor or seq > self._seq:
+                raise NodeJournal.JournalError(
+                    f"Changes since {seq} are not in the journal (it has {self._floor + 1} to {self._seq})"
+                )
+            return list(itertools.islice(self._entries, seq - self._floor, None))
+
+    def changesSince(self, seq: int) -> Dict[int, Optional[Dict[str, Any]]]:
+        """The changes after seq, merged per node: node num -> changed keys and their
+        latest values, or None if the node has since been removed"""
+        merged: Dict[int, Optional[Dict[str, Any]]] = {}
+        for entry in self.entriesSince(seq):
+            if entry.changes is None:
+                merged[entry.num] = None
+            else:
+                previous = merged.get(entry.num)
+                merged[entry.num] = {**previous, **entry.changes} if previous else dict(entry.changes)
+        return merged
@@ -0,0 +1,208 @@
+"""Compact entries for the node DB
+"""
+import sys
+from collections.abc import ItemsView, KeysView, ValuesView
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+# The keys node DB entries normally have, other than "num": the NodeInfo
+# fields, and what we add as packets arrive
+FIELDS = (
+    "user",
+    "position",
+    "snr",
+    "lastHeard",
+    "deviceMetrics",
+    "channel",
+    "viaMqtt",
+    "hopsAway",
+    "isFavorite",
+    "isIgnored",
+    "isKeyManuallyVerified",
+    "environmentMetrics",
+    "airQualityMetrics",
+    "powerMetrics",
+    "localStats",
+    "hopLimit",
+    "lastReceived",
+    "adminSessionPassKey",
+)
+_FIELD_SET = frozenset(FIELDS)
+
+# How much of the last packet heard from a node to keep in its "lastReceived"
+RETAIN_FULL = "full"  # the whole packet dict, as subscribers got it (raw protobuf included)
+RETAIN_SUMMARY = "summary"  # the header fields and portnum, without payload or protobufs
+RETAIN_NONE = "none"  # nothing, don't set lastReceived
+RETENTION_MODES = (RETAIN_FULL, RETAIN_SUMMARY, RETAIN_NONE)
+
+_MISSING: Any = object()
+
+
+class NodeRecord(dict):
+    """One node DB entry, with its usual keys in slots instead of a hash table
+
+    A big mesh (MQTT bridged ones especially) can put thousands of nodes in
+    nodesByNum, and once a node has a dozen keys its dict alone takes over
+    600 bytes. NodeRecord is a dict, so node["user"]["id"], isinstance() and
+    json.dumps work as before, but the keys in FIELDS are kept in slots. "num"
+    and any other key live in the dict itself; every node has a num, which
+    also keeps the C JSON encoder from taking the dict for empty.
+
+    Like LazyMessageDict, copying or pickling gives a plain dict.
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, *args, **kwargs) -> None:  # pylint: disable=W0231
+        dict.__init__(self)
+        for name in FIELDS:
+            setattr(self, name, _MISSING)
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            if value is _MISSING:
+                raise KeyError(key)
+            return value
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value) -> None:
+        if key in _FIELD_SET:
+            setattr(self, key, value)
+        else:
+            dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key) -> None:
+        if key in _FIELD_SET:
+            if getattr(self, key) is _MISSING:
+                raise KeyError(key)
+            setattr(self, key, _MISSING)
+        else:
+            dict.__delitem__(self, key)
+
+    def __contains__(self, key) -> bool:
+        if key in _FIELD_SET:
+            return getattr(self, key) is not _MISSING
+        return dict.__contains__(self, key)
+
+    def __iter__(self) -> Iterator:
+        # Overriding this also makes dict(), {**d} and dict.update() read us
+        # through keys() and __getitem__ rather than just the dict storage
+        if dict.__contains__(self, "num"):
+            yield "num"
+        for name in FIELDS:
+            if getattr(self, name) is not _MISSING:
+                yield name
+        for key in dict.__iter__(self):
+            if key != "num":
+                yield key
+
+    def __len__(self) -> int:
+        return dict.__len__(self) + sum(1 for name in FIELDS if getattr(self, name) is not _MISSING)
+
+    def keys(self):  # type: ignore[override]
+        return KeysView(self)
+
+    def items(self):  # type: ignore[override]
+        return ItemsView(self)
+
+    def values(self):  # type: ignore[override]
+        return ValuesView(self)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def pop(self, key, default=_MISSING):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        if default is _MISSING:
+            raise KeyError(key)
+        return default
+
+    def popitem(self):
+        for key in reversed(list(self)):
+            return key, self.pop(key)
+        raise KeyError("popitem(): node record is empty")
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def update(self, *args, **kwargs) -> None:  # pylint: disable=W0221
+        for other in args + (kwargs,):
+            pairs = other.items() if isinstance(other, Mapping) else other
+            for key, value in pairs:
+                self[key] = value
+
+    def clear(self) -> None:
+        dict.clear(self)
+        for name in FIELDS:
+            setattr(self, name, _MISSING)
+
+    def copy(self) -> dict:  # type: ignore[override]
+        """A plain dict"""
+        return dict(self.items())
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other) -> bool:
+        return not self == other
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return repr(self.copy())
+
+    def __reduce_ex__(self, protocol):
+        return (dict, (self.copy(),))
+
+
+def retainPacket(asDict: Mapping[str, Any], retention: str) -> Optional[Dict[str, Any]]:
+    """What to keep of a received packet dict as a node's lastReceived, None for nothing"""
+    if retention == RETAIN_FULL:
+        return asDict  # type: ignore[return-value]
+    if retention == RETAIN_NONE:
+        return None
+    summary = {key: asDict[key] for key in asDict if key not in ("raw", "decoded")}
+    decoded = asDict.get("decoded")
+    if decoded is not None and "portnum" in decoded:
+        summary["decoded"] = {"portnum": decoded["portnum"]}
+    return summary
+
+
+def deepSizeOf(obj: Any) -> int:
+    """Approximate bytes used by obj and everything it (transitively) holds
+
+    Follows mappings, lists, tuples and sets, and counts each object once.
+    """
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, NodeRecord):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, dict):
+            # not o.values(), which would make a LazyMessageDict convert everything
+            stack.extend(dict.keys(o))
+            stack.extend(dict.values(o))
+        elif isinstance(o, Mapping):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+    return total
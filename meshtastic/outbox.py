@@ -0,0 +1,165 @@
+"""Keep queued packets on disk, so they survive a crash or restart
+
+Packets normally wait for the radio only in the TX scheduler's memory. Give an
+interface an Outbox and every packet it queues is also written to a SQLite
+database, until the radio has accepted it (confirmed with a QueueStatus, or
+simply written, for firmware that doesn't send those). Whatever is still there
+when the interface next connects - after a reconnect, or in a new process - is
+queued again::
+
+    iface = TCPInterface(host, outbox=Outbox("/var/lib/gateway/outbox.db"))
+
+Once the radio has a packet, delivering it (with retries, for wantAck packets)
+is up to the firmware. A packet that has been written maxAttempts times without
+being accepted is dropped rather than retried forever.
+
+The outbox belongs to whoever created it, interfaces never close it.
+
+Deleting rows leaves free pages behind, so while packets are flowing the
+outbox periodically checkpoints its write-ahead log and vacuums, on a
+background thread.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from meshtastic.protobuf import mesh_pb2
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 5
+# Seconds between compactions, while anything has been removed since the last one
+COMPACT_INTERVAL = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    packet_id INTEGER NOT NULL UNIQUE,
+    to_radio BLOB NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    last_attempt REAL
+)
+"""
+
+
+class Outbox:
+    """Packets waiting for the radio, persisted in a SQLite database"""
+
+    def __init__(
+        self,
+        path: str,
+        maxAttempts: int = DEFAULT_MAX_ATTEMPTS,
+        compactInterval: Optional[float] = COMPACT_INTERVAL,
+    ) -> None:
+        """Constructor
+
+        Arguments:
+            path -- the database file, created if need be (":memory:" for one that doesn't persist)
+
+        Keyword Arguments:
+            maxAttempts -- how many times a packet is written before we give up on it
+            compactInterval -- seconds between background compactions, None to only compact() when asked
+        """
+        self.path = path
+        self.maxAttempts = maxAttempts
+        self.compactInterval = compactInterval
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # incremental vacuum has to be chosen before the table exists
+        self._db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.execute(_SCHEMA)
+        self._removed = 0  # rows deleted since the last compaction
+        self._compactTimer: Optional[threading.Timer] = None
+        self._closed = False
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def add(self, toRadio: mesh_pb2.ToRadio) -> None:
+        """Remember a ToRadio carrying a MeshPacket until remove() is called for its id"""
+        with self._lock:
+            if self._closed:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO outbox (packet_id, to_radio, created) VALUES (?, ?, ?)",
+                (toRadio.packet.id, toRadio.SerializeToString(), time.time()),
+            )
+
+    def attempted(self, packetIds: List[int]) -> None:
+        """Record that these packets have been written to the radio (once more)"""
+        with self._lock:
+            if self._closed:
+                return
+            now = time.time()
+            self._db.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, last_attempt = ? WHERE packet_id = ?",
+                [(now, packetId) for packetId in packetIds],
+            )
+
+    def remove(self, packetIds: List[int]) -> None:
+        """Forget these packets, the radio has them"""
+        with self._lock:
+            if self._closed:
+                return
+            removed = self._db.executemany(
+                "DELETE FROM outbox WHERE packet_id = ?", [(packetId,) for packetId in packetIds]
+            ).rowcount
+            if removed > 0:
+                self._removed += removed
+                self._scheduleCompactLocked()
+
+    def pending(self) -> List[Tuple[int, mesh_pb2.ToRadio]]:
+        """(packet id, ToRadio) for everything still waiting, oldest first
+
+        Packets already written maxAttempts times are dropped instead.
+        """
+        with self._lock:
+            if self._closed:
+                return []
+            rows = self._db.execute("SELECT packet_id, to_radio, attempts FROM outbox ORDER BY seq").fetchall()
+            expired = [(packetId,) for packetId, _, attempts in rows if attempts >= self.maxAttempts]
+            if expired:
+                logger.warning(f"Dropping {len(expired)} packets the radio never accepted")
+                self._db.executemany("DELETE FROM outbox WHERE packet_id = ?", expired)
+                self._removed += len(expired)
+                self._scheduleCompactLocked()
+        result = []
+        for packetId, blob, attempts in rows:
+            if attempts < self.maxAttempts:
+                toRadio = mesh_pb2.ToRadio()
+                toRadio.ParseFromString(blob)
+                result.append((packetId, toRadio))
+        return result
+
+    def compact(self) -> None:
+        """Give the space of removed packets back to the file system"""
+        with self._lock:
+            self._compactTimer = None
+            if self._closed or not self._removed:
+                return
+            self._removed = 0
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._db.execute("PRAGMA incremental_vacuum").fetchall()
+
+    def close(self) -> None:
+        """Compact and close the database. Whatever is still in it is kept for next time."""
+        self.compact()
+        with self._lock:
+            if self._compactTimer is not None:
+                self._compactTimer.cancel()
+                self._compactTimer = None
+            self._closed = True
+            self._db.close()
+
+    def _scheduleCompactLocked(self) -> None:
+        if self.compactInterval is None or self._compactTimer is not None or self._closed:
+            return
+        self._compactTimer = threading.Timer(self.compactInterval, self.compact)
+        self._compactTimer.daemon = True
+        self._compactTimer.start()
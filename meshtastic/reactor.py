@@ -0,0 +1,284 @@
+"""Single threaded selector reactor, serving many stream interfaces from one I/O thread
+
+Each StreamInterface normally owns a reader thread, a TX scheduler thread and a
+heartbeat timer thread. That is fine for one radio, but a gateway talking to
+dozens of nodes ends up with hundreds of mostly idle threads. Passing a shared
+Reactor to TCPInterface (or SerialInterface, on POSIX) instead multiplexes all
+of them over one selector thread, which reads every connection and writes
+queued packets, plus one timer thread for heartbeats and other timers.
+Reconnects, which block while connecting, get a short lived thread of their
+own. The I/O thread never blocks on a write either: TCPInterface makes its
+socket non-blocking, buffers what the kernel won't take yet and finishes
+writing it when the reactor reports the socket writable, so a peer that
+stops reading only ever holds up its own connection::
+
+    reactor = Reactor()
+    ifaces = [TCPInterface(host, reactor=reactor) for host in hosts]
+    ...
+    for iface in ifaces:
+        iface.close()
+    reactor.close()
+
+The per interface MeshInterface API is unchanged, blocking calls such as
+waitForConfig() or sendData() still block the calling thread only.
+"""
+import contextlib
+import heapq
+import itertools
+import logging
+import selectors
+import socket
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from meshtastic.tx_scheduler import TxScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class TimerHandle:
+    """A callback scheduled with Reactor.callLater(), which can be cancelled"""
+
+    def __init__(self, when: float, callback: Callable[[], None]) -> None:
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        """Don't run the callback (if it has not run yet)"""
+        self.cancelled = True
+
+
+class ReactorTxScheduler(TxScheduler):
+    """A TxScheduler whose packets are written by the reactor's I/O thread, rather than a thread of its own"""
+
+    def __init__(self, iface, reactor: "Reactor") -> None:
+        super().__init__(iface)
+        self.reactor = reactor
+        self._retryTimer: Optional[TimerHandle] = None
+
+    def _startLocked(self) -> None:
+        pass
+
+    def pump(self) -> bool:
+        # the I/O thread must not sleep for the stream's pacing, so wait for it like for airtime
+        paceWait = self.iface._writeDelay()
+        wrote = super().pump() if paceWait <= 0 else False
+        with self._cond:
+            delay = max(paceWait, self._airtimeWait()) if self._pending else 0.0
+            if delay > 0 and self._retryTimer is None and not self._closed:
+                # nothing will notify us when the budget refills or the gap has passed, so come back then
+                self._retryTimer = self.reactor.callLater(delay, self._retry)
+        return wrote
+
+    def _retry(self) -> None:
+        with self._cond:
+            self._retryTimer = None
+        self.reactor._wantPump(self)
+
+    def _notifyLocked(self) -> None:
+        super()._notifyLocked()
+        if self._pending:
+            self.reactor._wantPump(self)
+
+    def inDriverThread(self) -> bool:
+        return self.reactor.inReactorThread()
+
+
+class Reactor:
+    """Runs the I/O of many stream interfaces on one selector thread and one timer thread"""
+
+    def __init__(self, name: str = "meshtastic reactor") -> None:
+        self.name = name
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._ops: List[Callable[[], None]] = []  # run on the I/O thread, between selects
+        self._pumps: Set[TxScheduler] = set()
+        self._registered: Dict[Any, Any] = {}  # interface -> the file object we select on
+        self._closed = False
+
+        # a socketpair lets other threads interrupt select()
+        self._wakeRecv, self._wakeSend = socket.socketpair()
+        self._wakeRecv.setblocking(False)
+        self._wakeSend.setblocking(False)
+        self._selector.register(self._wakeRecv, selectors.EVENT_READ, None)
+
+        self._timerCond = threading.Condition()
+        self._timers: List = []  # heap of (when, seq, TimerHandle)
+        self._timerSeq = itertools.count()
+
+        self._ioThread = threading.Thread(target=self._runIO, name=f"{name} io", daemon=True)
+        self._timerThread = threading.Thread(target=self._runTimers, name=f"{name} timers", daemon=True)
+        self._ioThread.start()
+        self._timerThread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, trace):
+        self.close()
+
+    def __len__(self) -> int:
+        """Number of interfaces currently being read"""
+        with self._lock:
+            return len(self._registered)
+
+    def inReactorThread(self) -> bool:
+        """True if called from the I/O thread, which must never block waiting on the radio"""
+        return threading.current_thread() is self._ioThread
+
+    def register(self, iface) -> None:
+        """Start reading iface, replacing its previous connection if it reconnected"""
+        fileobj = iface._selectable()
+        if fileobj is None:
+            return
+        if sys.platform == "win32" and not isinstance(fileobj, socket.socket):
+            raise iface.MeshInterfaceError("The reactor can only serve sockets on Windows")
+        self._call(lambda: self._registerNow(iface, fileobj), wait=False)
+
+    def watchWrites(self, iface, wanted: bool) -> None:
+        """Call iface._onWritable() from the I/O thread whenever its connection can take more bytes, or stop"""
+        self._call(lambda: self._watchWritesNow(iface, wanted), wait=False)
+
+    def unregister(self, iface) -> None:
+        """Stop reading iface. Unless called from the I/O thread, returns once it is no longer selected on."""
+        self._call(lambda: self._unregisterNow(iface), wait=True)
+
+    def callLater(self, delay: float, callback: Callable[[], None]) -> TimerHandle:
+        """Run callback on the timer thread after delay seconds"""
+        with self._timerCond:
+            handle = TimerHandle(time.monotonic() + delay, callback)
+            heapq.heappush(self._timers, (handle.when, next(self._timerSeq), handle))
+            self._timerCond.notify()
+        return handle
+
+    def close(self) -> None:
+        """Stop both threads. Interfaces should be closed first."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        with self._timerCond:
+            self._timerCond.notify()
+        self._wake()
+        for thread in (self._ioThread, self._timerThread):
+            if thread is not threading.current_thread():
+                thread.join()
+        self._selector.close()
+        self._wakeRecv.close()
+        self._wakeSend.close()
+
+    def _call(self, op: Callable[[], None], wait: bool) -> None:
+        """Run op on the I/O thread, since selectors may not be changed while another thread selects"""
+        if self.inReactorThread():
+            op()
+            return
+        done = threading.Event()
+
+        def run():
+            try:
+                op()
+            finally:
+                done.set()
+
+        with self._lock:
+            if self._closed:
+                return
+            self._ops.append(run)
+        self._wake()
+        if wait:
+            done.wait()
+
+    def _wantPump(self, scheduler: TxScheduler) -> None:
+        """Ask the I/O thread to write whatever scheduler has ready"""
+        with self._lock:
+            if scheduler in self._pumps:
+                return
+            self._pumps.add(scheduler)
+        if not self.inReactorThread():
+            self._wake()
+
+    def _wake(self) -> None:
+        try:
+            self._wakeSend.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # a wakeup is already pending, or we are closed
+
+    def _registerNow(self, iface, fileobj) -> None:
+        old = self._registered.get(iface)
+        if old is fileobj:
+            return
+        if old is not None:
+            self._unregisterNow(iface)
+        try:
+            self._selector.register(fileobj, selectors.EVENT_READ, iface)
+        except (KeyError, ValueError, OSError) as ex:
+            logger.error(f"Could not watch {iface}: {ex}")
+            return
+        with self._lock:
+            self._registered[iface] = fileobj
+
+    def _watchWritesNow(self, iface, wanted: bool) -> None:
+        fileobj = self._registered.get(iface)
+        if fileobj is None:
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if wanted else 0)
+        try:
+            self._selector.modify(fileobj, events, iface)
+        except (KeyError, ValueError, OSError) as ex:
+            logger.error(f"Could not watch {iface} for writes: {ex}")
+
+    def _unregisterNow(self, iface) -> None:
+        with self._lock:
+            fileobj = self._registered.pop(iface, None)
+        if fileobj is not None:
+            try:
+                self._selector.unregister(fileobj)
+            except (KeyError, ValueError):
+                pass
+
+    def _runIO(self) -> None:
+        while True:
+            with self._lock:
+                closed = self._closed
+                ops, self._ops = self._ops, []
+                pumps, self._pumps = self._pumps, set()
+            for op in ops:
+                op()
+            if closed:
+                return
+            for scheduler in pumps:
+                try:
+                    scheduler.pump()
+                except Exception as ex:
+                    logger.error(f"Unexpected exception while sending: {ex}")
+            with self._lock:
+                idle = not self._ops and not self._pumps
+            for key, events in self._selector.select(None if idle else 0):
+                if key.data is None:
+                    with contextlib.suppress(BlockingIOError, InterruptedError):
+                        while self._wakeRecv.recv(4096):
+                            pass
+                    continue
+                if events & selectors.EVENT_WRITE and key.data in self._registered:
+                    key.data._onWritable()
+                if events & selectors.EVENT_READ and key.data in self._registered:
+                    key.data._onReadable()
+
+    def _runTimers(self) -> None:
+        while True:
+            with self._timerCond:
+                while not self._closed:
+                    if self._timers and self._timers[0][0] <= time.monotonic():
+                        break
+                    self._timerCond.wait(self._timers[0][0] - time.monotonic() if self._timers else None)
+                if self._closed:
+                    return
+                _, _, handle = heapq.heappop(self._timers)
+            if not handle.cancelled:
+                try:
+                    handle.callback()
+                except Exception as ex:
+                    logger.error(f"Unexpected exception in timer callback: {ex}")
@@ -11,6 +11,10 @@ from typing import List, Optional
 import serial # type: ignore[import-untyped]
 
 import meshtastic.util
+from meshtastic.dispatcher import Dispatcher
+from meshtastic.node_cache import NodeCache
+from meshtastic.outbox import Outbox
+from meshtastic.reactor import Reactor
 from meshtastic.stream_interface import StreamInterface
 
 logger = logging.getLogger(__name__)
@@ -25,7 +29,12 @@ class SerialInterface(StreamInterface):
         noProto: bool = False,
         connectNow: bool = True,
         noNodes: bool = False,
-        timeout: int = 300
+        timeout: int = 300,
+        *,
+        reactor: Optional[Reactor] = None,
+        dispatcher: Optional[Dispatcher] = None,
+        outbox: Optional[Outbox] = None,
+        nodeCache: Optional[NodeCache] = None,
     ) -> None:
         """Constructor, opens a connection to a specified serial port, or if unspecified try to
         find one Meshtastic device by probing
@@ -34,6 +43,10 @@ class SerialInterface(StreamInterface):
             devPath {string} -- A filepath to a device, i.e. /dev/ttyUSB0 (default: {None})
             debugOut {stream} -- If a stream is provided, any debug serial output from the device will be emitted to that stream. (default: {None})
             timeout -- How long to wait for replies (default: 300 seconds)
+            reactor -- A Reactor to share with other interfaces, instead of our own threads (POSIX only) (default: {None})
+            dispatcher -- Delivers our pubsub messages, see meshtastic.dispatcher (default: {None})
+            outbox -- Keeps queued packets on disk across restarts, see meshtastic.outbox (default: {None})
+            nodeCache -- Keeps the node DB on disk between connections, see meshtastic.node_cache (default: {None})
         """
         self.devPath: Optional[str] = devPath
 
@@ -51,7 +64,8 @@ class SerialInterface(StreamInterface):
                 self.devPath = ports[0]
 
         StreamInterface.__init__(
-            self, debugOut=debugOut, noProto=noProto, connectNow=connectNow, noNodes=noNodes, timeout=timeout
+            self, debugOut=debugOut, noProto=noProto, connectNow=connectNow, noNodes=noNodes, timeout=timeout,
+            reactor=reactor, dispatcher=dispatcher, outbox=outbox, nodeCache=nodeCache,
         )
 
     def connect(self) -> None:
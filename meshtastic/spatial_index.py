@@ -0,0 +1,163 @@
+"""Find nodes by where they are
+
+The interface keeps a SpatialIndex of every node with a known position, as
+`iface.spatialIndex`, so map style queries - what's in this box, within this
+distance, the nearest k nodes - look at a few grid cells rather than the whole
+node DB::
+
+    for meters, num in iface.spatialIndex.nearest(lat, lon, k=5):
+        ...
+
+Nodes are bucketed in a grid of cellSize by cellSize degree cells; a query
+visits only the cells its area overlaps, then checks actual distances.
+Distances are great circle distances in meters on a spherical earth.
+"""
+import math
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+EARTH_RADIUS = 6371008.8  # mean radius, meters
+DEFAULT_CELL_SIZE = 0.5  # degrees
+
+
+def distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great circle distance in meters between two points given in degrees"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bearing(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Initial bearing in degrees (0 = north, 90 = east) from the first point to the second"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dlambda = math.radians(lon2 - lon1)
+    y = math.sin(dlambda) * math.cos(phi2)
+    x = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.cos(dlambda)
+    return math.degrees(math.atan2(y, x)) % 360.0
+
+
+class SpatialIndex:
+    """Node numbers by position, in a grid of lat/lon cells"""
+
+    def __init__(self, cellSize: float = DEFAULT_CELL_SIZE) -> None:
+        """Constructor
+
+        Keyword Arguments:
+            cellSize -- grid cell size in degrees, which should divide 360
+        """
+        self.cellSize = cellSize
+        self._lonCells = int(round(360.0 / cellSize))
+        self._lock = threading.Lock()
+        self._cells: Dict[Tuple[int, int], Set[int]] = {}
+        self._positions: Dict[int, Tuple[float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, num) -> bool:
+        return num in self._positions
+
+    def _cellOf(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cellSize)), int(math.floor((lon + 180.0) / self.cellSize)) % self._lonCells
+
+    def update(self, num: int, lat: float, lon: float) -> None:
+        """Put node num at (lat, lon), in degrees"""
+        with self._lock:
+            self._removeLocked(num)
+            self._positions[num] = (lat, lon)
+            self._cells.setdefault(self._cellOf(lat, lon), set()).add(num)
+
+    def remove(self, num: int) -> None:
+        """Forget where node num is"""
+        with self._lock:
+            self._removeLocked(num)
+
+    def clear(self) -> None:
+        """Forget every node"""
+        with self._lock:
+            self._cells.clear()
+            self._positions.clear()
+
+    def _removeLocked(self, num: int) -> None:
+        old = self._positions.pop(num, None)
+        if old is not None:
+            cell = self._cellOf(*old)
+            nums = self._cells[cell]
+            nums.discard(num)
+            if not nums:
+                del self._cells[cell]
+
+    def position(self, num: int) -> Optional[Tuple[float, float]]:
+        """(lat, lon) of node num, None if we don't know it"""
+        return self._positions.get(num)
+
+    def _candidatesLocked(self, south: float, west: float, north: float, east: float) -> Iterable[int]:
+        """The nodes in cells overlapping a box (west > east if it crosses the antimeridian)"""
+        rowLo, rowHi = int(math.floor(south / self.cellSize)), int(math.floor(north / self.cellSize))
+        colLo = int(math.floor((west + 180.0) / self.cellSize)) % self._lonCells
+        colHi = int(math.floor((east + 180.0) / self.cellSize)) % self._lonCells
+        if west <= east and east - west >= 360.0:
+            cols = self._lonCells
+        else:
+            cols = (colHi - colLo) % self._lonCells + 1
+        if (rowHi - rowLo + 1) * cols > len(self._cells):
+            # a big area, looking at every occupied cell is cheaper
+            for (row, col), nums in self._cells.items():
+                if rowLo <= row <= rowHi and (col - colLo) % self._lonCells < cols:
+                    yield from nums
+            return
+        for row in range(rowLo, rowHi + 1):
+            for i in range(cols):
+                cell = self._cells.get((row, (colLo + i) % self._lonCells))
+                if cell:
+                    yield from cell
+
+    def withinBox(self, south: float, west: float, north: float, east: float) -> List[int]:
+        """Nodes inside a lat/lon box, west > east for one that crosses the antimeridian"""
+        crosses = west > east
+        with self._lock:
+            result = []
+            for num in self._candidatesLocked(south, west, north, east):
+                lat, lon = self._positions[num]
+                if south <= lat <= north and ((west <= lon or lon <= east) if crosses else west <= lon <= east):
+                    result.append(num)
+        return result
+
+    def withinRadius(self, lat: float, lon: float, meters: float) -> List[Tuple[float, int]]:
+        """(distance, node num) of the nodes within meters of (lat, lon), nearest first"""
+        dlat = math.degrees(meters / EARTH_RADIUS)
+        south, north = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+        coslat = math.cos(math.radians(max(abs(south), abs(north))))
+        if north >= 90.0 or south <= -90.0 or coslat <= 0.0 or meters / (EARTH_RADIUS * coslat) >= math.pi:
+            west, east = -180.0, 180.0  # a pole is in range, so is every longitude
+        else:
+            dlon = math.degrees(meters / (EARTH_RADIUS * coslat))
+            west, east = lon - dlon, lon + dlon
+            # crossing the antimeridian gives west > east
+            if west < -180.0:
+                west += 360.0
+            if east > 180.0:
+                east -= 360.0
+        with self._lock:
+            result = []
+            for num in self._candidatesLocked(south, west, north, east):
+                d = distance(lat, lon, *self._positions[num])
+                if d <= meters:
+                    result.append((d, num))
+        result.sort()
+        return result
+
+    def nearest(self, lat: float, lon: float, k: int = 1, maxDistance: Optional[float] = None) -> List[Tuple[float, int]]:
+        """(distance, node num) of the k nodes nearest (lat, lon), nearest first,
+        only counting those within maxDistance meters if given"""
+        if k <= 0 or not self._positions:
+            return []
+        limit = math.pi * EARTH_RADIUS if maxDistance is None else maxDistance
+        radius = min(limit, math.radians(self.cellSize) * EARTH_RADIUS)
+        while True:
+            found = self.withinRadius(lat, lon, radius)
+            if len(found) >= k or radius >= limit:
+                return found[:k]
+            radius = min(limit, radius * 4)
@@ -1,5 +1,6 @@
 """Stream Interface base class
 """
+import codecs
 import contextlib
 import io
 import logging
@@ -7,20 +8,99 @@ import threading
 import time
 import traceback
 
-from typing import Optional, cast
+from typing import Callable, List, Optional
 
 import serial # type: ignore[import-untyped]
 
-from meshtastic.mesh_interface import MeshInterface
+from meshtastic.dispatcher import Dispatcher
+from meshtastic.mesh_interface import Cancellable, MeshInterface
+from meshtastic.node_cache import NodeCache
+from meshtastic.outbox import Outbox
+from meshtastic.protobuf import mesh_pb2
+from meshtastic.reactor import Reactor, ReactorTxScheduler
 from meshtastic.util import is_windows11, stripnl
 
 START1 = 0x94
 START2 = 0xC3
 HEADER_LEN = 4
 MAX_TO_FROM_RADIO_SIZE = 512
+READ_CHUNK_SIZE = 4096
+# Gap between writes for radios that don't send QueueStatus flow control (older firmware)
+DEFAULT_INTER_FRAME_GAP = 0.1
+WINDOWS11_INTER_FRAME_GAP = 1.0
 logger = logging.getLogger(__name__)
 
 
+class StreamFramer:
+    """Splits a raw byte stream into FromRadio frames.
+
+    Bytes are accumulated in one reusable bytearray and every complete frame is
+    handed to onFrame as a memoryview into that buffer, so no per-frame copy is
+    made. The view is only valid for the duration of the callback (it is
+    released right after), so callers that want to keep the payload must copy it.
+    Bytes that are not part of a frame are device log output and go to onNoise.
+    """
+
+    def __init__(
+        self,
+        onFrame: Callable[[memoryview], None],
+        onNoise: Callable[[bytes], None],
+    ) -> None:
+        self.onFrame = onFrame
+        self.onNoise = onNoise
+        self._buf = bytearray()
+
+    def __len__(self) -> int:
+        """Number of bytes buffered while waiting for the rest of a frame"""
+        return len(self._buf)
+
+    def reset(self) -> None:
+        """Forget any partially received frame"""
+        self._buf.clear()
+
+    def feed(self, data: bytes) -> None:
+        """Add newly read bytes and dispatch every frame they complete"""
+        buf = self._buf
+        buf += data
+        n = len(buf)
+        pos = 0
+        view = memoryview(buf)
+        try:
+            while pos < n:
+                if buf[pos] != START1:
+                    # everything up to the next START1 must be a log message from the device
+                    end = buf.find(START1, pos)
+                    if end < 0:
+                        end = n
+                    self.onNoise(bytes(view[pos:end]))
+                    pos = end
+                    continue
+                if pos + 1 >= n:
+                    break  # wait for START2
+                if buf[pos + 1] != START2:
+                    pos += 1  # failed to find start2, resync on the next byte
+                    continue
+                if pos + HEADER_LEN > n:
+                    break  # wait for the rest of the header
+                # big endian length follows header
+                packetlen = (buf[pos + 2] << 8) + buf[pos + 3]
+                if packetlen > MAX_TO_FROM_RADIO_SIZE:
+                    pos += HEADER_LEN  # length was out of bounds, restart
+                    continue
+                end = pos + HEADER_LEN + packetlen
+                if end > n:
+                    break  # wait for the rest of the payload
+                frame = view[pos + HEADER_LEN:end]
+                pos = end
+                try:
+                    self.onFrame(frame)
+                finally:
+                    frame.release()
+        finally:
+            view.release()
+            del buf[:pos]
+
+
 class StreamInterface(MeshInterface):
     """Interface class for meshtastic devices over a stream link (serial, TCP, etc)"""
 
@@ -30,7 +110,12 @@ class StreamInterface(MeshInterface):
         noProto: bool = False,
         connectNow: bool = True,
         noNodes: bool = False,
-        timeout: int = 300
+        timeout: int = 300,
+        *,
+        reactor: Optional[Reactor] = None,
+        dispatcher: Optional[Dispatcher] = None,
+        outbox: Optional[Outbox] = None,
+        nodeCache: Optional[NodeCache] = None,
     ) -> None:
         """Constructor, opens a connection to self.stream
 
@@ -38,6 +123,11 @@ class StreamInterface(MeshInterface):
             debugOut {stream} -- If a stream is provided, any debug serial output from the
                                  device will be emitted to that stream. (default: {None})
             timeout -- How long to wait for replies (default: 300 seconds)
+            reactor -- A Reactor shared with other interfaces, which does our reading and
+                       writing instead of threads of our own (default: {None})
+            dispatcher -- Delivers our pubsub messages, see meshtastic.dispatcher (default: {None})
+            outbox -- Keeps queued packets on disk across restarts, see meshtastic.outbox (default: {None})
+            nodeCache -- Keeps the node DB on disk between connections, see meshtastic.node_cache (default: {None})
 
         Raises:
             RuntimeError: Raised if StreamInterface is instantiated when noProto is false.
@@ -48,16 +138,30 @@ class StreamInterface(MeshInterface):
                 "StreamInterface is now abstract (to update existing code create SerialInterface instead)"
             )
         self.stream: Optional[serial.Serial] = None  # only serial uses this, TCPInterface overrides the relevant methods instead
-        self._rxBuf = bytes()  # empty
+        self._framer = StreamFramer(self._handleFrame, self._handleLogBytes)
         self._wantExit = False
+        self.reactor: Optional[Reactor] = reactor
+        self._readerExited = threading.Event()
 
         self.is_windows11 = is_windows11()
         self.cur_log_line = ""
+        # Without QueueStatus feedback we space out writes to give the device
+        # (e.g. a TBeam) a chance to work, win11 might need a bit more time, too
+        self.interFrameGap: float = (
+            WINDOWS11_INTER_FRAME_GAP if self.is_windows11 else DEFAULT_INTER_FRAME_GAP
+        )
+        self._nextWriteTime: float = 0.0
+        self._logDecoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
 
         # FIXME, figure out why daemon=True causes reader thread to exit too early
         self._rxThread = threading.Thread(target=self.__reader, args=(), daemon=True, name="stream reader")
 
-        MeshInterface.__init__(self, debugOut=debugOut, noProto=noProto, noNodes=noNodes, timeout=timeout)
+        MeshInterface.__init__(
+            self, debugOut=debugOut, noProto=noProto, noNodes=noNodes, timeout=timeout, dispatcher=dispatcher,
+            outbox=outbox, nodeCache=nodeCache,
+        )
+        if reactor is not None:
+            self.txScheduler = ReactorTxScheduler(self, reactor)
 
         # Start the reader thread after superclass constructor completes init
         if connectNow:
@@ -88,7 +192,10 @@ class StreamInterface(MeshInterface):
         self._writeBytes(p)
         time.sleep(0.1)  # wait 100ms to give device time to start running
 
-        self._rxThread.start()
+        if self.reactor is None:
+            self._rxThread.start()
+        else:
+            self.reactor.register(self)
 
         self._startConfig()
 
@@ -110,14 +217,29 @@ class StreamInterface(MeshInterface):
     def _writeBytes(self, b: bytes) -> None:
         """Write an array of bytes to our stream and flush"""
         if self.stream:  # ignore writes when stream is closed
+            self._paceWrite()
             self.stream.write(b)
             self.stream.flush()
-            # win11 might need a bit more time, too
-            if self.is_windows11:
-                time.sleep(1.0)
-            else:
-                # we sleep here to give the TBeam a chance to work
-                time.sleep(0.1)
+
+    def _writeDelay(self) -> float:
+        """Seconds until the previous write is interFrameGap old"""
+        return max(0.0, self._nextWriteTime - time.monotonic())
+
+    def _paceWrite(self) -> None:
+        """Wait until the previous write is interFrameGap old
+
+        Once the radio reports QueueStatus the TX scheduler only writes packets
+        it has room for, so there is no need to space out writes at all.
+
+        With a reactor we never sleep here, as that would stall every interface
+        it serves: its TX scheduler waits out _writeDelay() on a timer instead.
+        """
+        now = time.monotonic()
+        if now < self._nextWriteTime and self.reactor is None:
+            time.sleep(self._nextWriteTime - now)
+            now = self._nextWriteTime
+        gap = 0.0 if self.queueStatus is not None else self.interFrameGap
+        self._nextWriteTime = now + gap
 
     def _readBytes(self, length) -> Optional[bytes]:
         """Read an array of bytes from our stream"""
@@ -126,15 +248,34 @@ class StreamInterface(MeshInterface):
         else:
             return None
 
-    def _sendToRadioImpl(self, toRadio) -> None:
-        """Send a ToRadio protobuf to the device"""
+    def _readChunkSize(self) -> int:
+        """How many bytes the reader should ask for next
+
+        Whatever the port already has waiting, or a single byte so the read
+        blocks (up to the port timeout) until something arrives.
+        """
+        waiting = getattr(self.stream, "in_waiting", 0)
+        if isinstance(waiting, int) and waiting > 0:
+            return min(waiting, READ_CHUNK_SIZE)
+        return 1
+
+    def _frameToRadio(self, toRadio) -> bytes:
+        """Serialize a ToRadio protobuf and add the stream header"""
         logger.debug(f"Sending: {stripnl(toRadio)}")
         b: bytes = toRadio.SerializeToString()
         bufLen: int = len(b)
         # We convert into a string, because the TCP code doesn't work with byte arrays
         header: bytes = bytes([START1, START2, (bufLen >> 8) & 0xFF, bufLen & 0xFF])
         logger.debug(f"sending header:{header!r} b:{b!r}")
-        self._writeBytes(header + b)
+        return header + b
+
+    def _sendToRadioImpl(self, toRadio) -> None:
+        """Send a ToRadio protobuf to the device"""
+        self._writeBytes(self._frameToRadio(toRadio))
+
+    def _sendManyToRadioImpl(self, toRadios: List[mesh_pb2.ToRadio]) -> None:
+        """Coalesce several ToRadio frames into a single write"""
+        self._writeBytes(b"".join(self._frameToRadio(toRadio) for toRadio in toRadios))
 
     def close(self) -> None:
         """Close a connection to the device"""
@@ -143,7 +284,9 @@ class StreamInterface(MeshInterface):
         # pyserial cancel_read doesn't seem to work, therefore we ask the
         # reader thread to close things for us
         self._wantExit = True
-        if self._rxThread != threading.current_thread():
+        if self.reactor is not None:
+            self._stopReading()
+        elif self._rxThread != threading.current_thread():
             try:
                 self._rxThread.join()  # wait for it to exit
             except RuntimeError:
@@ -155,77 +298,68 @@ class StreamInterface(MeshInterface):
                         self.stream.close()
                     self.stream = None
 
-    def _handleLogByte(self, b):
-        """Handle a byte that is part of a log message from the device."""
+    def _callLater(self, delay: float, callback: Callable[[], None]) -> Cancellable:
+        """Use the reactor's timer thread rather than a thread per timer"""
+        if self.reactor is None:
+            return MeshInterface._callLater(self, delay, callback)
+        return self.reactor.callLater(delay, callback)
+
+    def _selectable(self):
+        """The file object the reactor waits on for our incoming bytes"""
+        return self.stream
 
-        utf = "?"  # assume we might fail
+    def _onReadable(self) -> None:
+        """Called by the reactor's I/O thread when bytes are waiting, reads them without blocking"""
         try:
-            utf = b.decode("utf-8")
-        except:
-            pass
-
-        if utf == "\r":
-            pass    # ignore
-        elif utf == "\n":
-            self._handleLogLine(self.cur_log_line)
-            self.cur_log_line = ""
-        else:
-            self.cur_log_line += utf
+            b: Optional[bytes] = self._readBytes(self._readChunkSize())
+            if b is not None and len(b) > 0:
+                self._framer.feed(b)
+            if b is None or self._wantExit:
+                self._stopReading()
+        except (serial.SerialException, OSError) as ex:
+            if not self._wantExit:
+                logger.warning(f"Meshtastic connection lost, disconnecting... {ex}")
+            self._stopReading()
+        except Exception as ex:
+            logger.error(f"Unexpected exception, stopping meshtastic reader... {ex}")
+            self._stopReading()
+
+    def _onWritable(self) -> None:
+        """Called by the reactor's I/O thread when our connection can take more bytes, if we asked to be"""
+
+    def _stopReading(self) -> None:
+        """The reactor equivalent of the reader thread exiting"""
+        if self.reactor is not None:
+            self.reactor.unregister(self)
+        if not self._readerExited.is_set():
+            self._readerExited.set()
+            logger.debug("reader is exiting")
+            self._disconnected()
+
+    def _handleLogBytes(self, b: bytes) -> None:
+        """Handle a run of bytes that are part of log messages from the device."""
+        text = self._logDecoder.decode(b).replace("\r", "")
+        *lines, self.cur_log_line = (self.cur_log_line + text).split("\n")
+        for line in lines:
+            self._handleLogLine(line)
+
+    def _handleFrame(self, frame: memoryview) -> None:
+        """Handle one complete FromRadio frame found by the framer"""
+        try:
+            self._handleFromRadio(frame)
+        except Exception as ex:
+            logger.error(f"Error while handling message from radio {ex}")
+            traceback.print_exc()
 
     def __reader(self) -> None:
         """The reader thread that reads bytes from our stream"""
         logger.debug("in __reader()")
-        empty = bytes()
 
         try:
             while not self._wantExit:
-                # logger.debug("reading character")
-                b: Optional[bytes] = self._readBytes(1)
-                # logger.debug("In reader loop")
-                # logger.debug(f"read returned {b}")
-                if b is not None and len(cast(bytes, b)) > 0:
-                    c: int = b[0]
-                    # logger.debug(f'c:{c}')
-                    ptr: int = len(self._rxBuf)
-
-                    # Assume we want to append this byte, fixme use bytearray instead
-                    self._rxBuf = self._rxBuf + b
-
-                    if ptr == 0:  # looking for START1
-                        if c != START1:
-                            self._rxBuf = empty  # failed to find start
-                            # This must be a log message from the device
-
-                            self._handleLogByte(b)
-
-                    elif ptr == 1:  # looking for START2
-                        if c != START2:
-                            self._rxBuf = empty  # failed to find start2
-                    elif ptr >= HEADER_LEN - 1:  # we've at least got a header
-                        # logger.debug('at least we received a header')
-                        # big endian length follows header
-                        packetlen = (self._rxBuf[2] << 8) + self._rxBuf[3]
-
-                        if (
-                            ptr == HEADER_LEN - 1
-                        ):  # we _just_ finished reading the header, validate length
-                            if packetlen > MAX_TO_FROM_RADIO_SIZE:
-                                self._rxBuf = (
-                                    empty  # length was out out bounds, restart
-                                )
-
-                        if len(self._rxBuf) != 0 and ptr + 1 >= packetlen + HEADER_LEN:
-                            try:
-                                self._handleFromRadio(self._rxBuf[HEADER_LEN:])
-                            except Exception as ex:
-                                logger.error(
-                                    f"Error while handling message from radio {ex}"
-                                )
-                                traceback.print_exc()
-                            self._rxBuf = empty
-                else:
-                    # logger.debug(f"timeout")
-                    pass
+                b: Optional[bytes] = self._readBytes(self._readChunkSize())
+                if b is not None and len(b) > 0:
+                    self._framer.feed(b)
         except serial.SerialException as ex:
             if (
                 not self._wantExit
@@ -246,4 +380,5 @@ class StreamInterface(MeshInterface):
             )
         finally:
             logger.debug("reader is exiting")
+            self._readerExited.set()
             self._disconnected()
@@ -8,7 +8,11 @@ import threading
 import time
 from typing import Optional
 
-from meshtastic.stream_interface import StreamInterface
+from meshtastic.dispatcher import Dispatcher
+from meshtastic.node_cache import NodeCache
+from meshtastic.outbox import Outbox
+from meshtastic.reactor import Reactor, TimerHandle
+from meshtastic.stream_interface import READ_CHUNK_SIZE, StreamInterface
 
 DEFAULT_TCP_PORT = 4403
 
@@ -16,13 +20,23 @@ DEFAULT_TCP_PORT = 4403
 # the connection down. See close() for why this exists.
 GRACEFUL_CLOSE_TIMEOUT = 0.25
 
+# Seconds between attempts to reconnect a reactor driven interface, doubling up to the max
+RECONNECT_RETRY_DELAY = 1.0
+RECONNECT_MAX_DELAY = 60.0
+
+# With a reactor, writes the kernel can't take yet are buffered. A connection is
+# dropped (and reconnected) when its peer leaves more than this many bytes
+# unread, or reads nothing of them for this many seconds.
+MAX_SEND_BUFFER = 256 * 1024
+SEND_STALL_TIMEOUT = 30.0
+
 logger = logging.getLogger(__name__)
 
 
 class TCPInterface(StreamInterface):
     """Interface class for meshtastic devices over a TCP link"""
 
-    def __init__(
+    def __init__(  # pylint: disable=R0913
         self,
         hostname: str,
         debugOut=None,
@@ -31,18 +45,33 @@ class TCPInterface(StreamInterface):
         portNumber: int = DEFAULT_TCP_PORT,
         noNodes: bool = False,
         timeout: int = 300,
+        *,
+        reactor: Optional[Reactor] = None,
+        dispatcher: Optional[Dispatcher] = None,
+        outbox: Optional[Outbox] = None,
+        nodeCache: Optional[NodeCache] = None,
     ):
         """Constructor, opens a connection to a specified IP address/hostname
 
         Keyword Arguments:
             hostname {string} -- Hostname/IP address of the device to connect to
             timeout -- How long to wait for replies (default: 300 seconds)
+            reactor -- A Reactor to share with other interfaces, instead of our own threads (default: {None})
+            dispatcher -- Delivers our pubsub messages, see meshtastic.dispatcher (default: {None})
+            outbox -- Keeps queued packets on disk across restarts, see meshtastic.outbox (default: {None})
+            nodeCache -- Keeps the node DB on disk between connections, see meshtastic.node_cache (default: {None})
         """
         self.hostname: str = hostname
         self.portNumber: int = portNumber
 
         self.socket: Optional[socket.socket] = None
         self.reconnectLock = threading.Lock()
+        # What a reactor driven socket hasn't taken yet, see _bufferWrite()
+        self._sendCond = threading.Condition()
+        self._sendBuffer = bytearray()
+        self._sendProgress = 0.0  # when the peer last took some of _sendBuffer
+        self._sendWatched = False  # whether the reactor tells us when the socket is writable
+        self._stallTimer: Optional[TimerHandle] = None
 
         super().__init__(
             debugOut=debugOut,
@@ -50,6 +79,10 @@ class TCPInterface(StreamInterface):
             connectNow=connectNow,
             noNodes=noNodes,
             timeout=timeout,
+            reactor=reactor,
+            dispatcher=dispatcher,
+            outbox=outbox,
+            nodeCache=nodeCache,
         )
 
     def __repr__(self):
@@ -84,6 +117,9 @@ class TCPInterface(StreamInterface):
         logger.debug(f"Connecting to {self.hostname}")  # type: ignore[str-bytes-safe]
         server_address = (self.hostname, self.portNumber)
         self.socket = socket.create_connection(server_address)
+        if getattr(self, "reactor", None) is not None:
+            # the reactor's I/O thread writes too, and must never wait on one peer
+            self.socket.setblocking(False)
 
     def _wait_for_reader_exit(self, timeout: float) -> None:
         """Wait briefly for the reader thread to drain and exit after a half-close.
@@ -91,6 +127,9 @@ class TCPInterface(StreamInterface):
         Returns as soon as it exits, or after timeout: the device is not obliged
         to close just because we did.
         """
+        if getattr(self, "reactor", None) is not None:
+            self._readerExited.wait(timeout)
+            return
         rx = getattr(self, "_rxThread", None)
         if rx is None or rx is threading.current_thread():
             return
@@ -103,6 +142,12 @@ class TCPInterface(StreamInterface):
         # Sometimes the socket read might be blocked in the reader thread.
         # Therefore force a shutdown first to unblock reader thread reads.
         self._wantExit = True
+        reactor = getattr(self, "reactor", None)
+        if self.socket is not None and reactor is not None and not reactor.inReactorThread():
+            with self._sendCond:  # let the I/O thread finish what we have buffered
+                self._sendCond.wait_for(lambda: not self._sendBuffer, GRACEFUL_CLOSE_TIMEOUT)
+        with self._sendCond:
+            self._resetSendBufferLocked()
         if self.socket is not None:
             # Half-close first. shutdown(SHUT_WR) sends FIN, which tells the
             # device we are done writing and lets it consume what we last wrote
@@ -130,35 +175,152 @@ class TCPInterface(StreamInterface):
 
     def _writeBytes(self, b: bytes) -> None:
         """Write an array of bytes to our stream"""
-        if self.socket is not None:
+        if self.socket is not None and self.reactor is not None:
+            self._bufferWrite(b)
+        elif self.socket is not None:
             try:
                 self.socket.sendall(b)
             except OSError as e:
                 logger.error(f"Socket send error, reconnecting: {e}")
                 if not self._wantExit:
-                    self._reconnect()
+                    self._reconnectSoon()
                 raise
 
+    def _bufferWrite(self, b: bytes) -> None:
+        """Queue b to be written without blocking, and write what the socket will take now"""
+        with self._sendCond:
+            if not self._sendBuffer:
+                self._sendProgress = time.monotonic()
+            self._sendBuffer += b
+        error = self._flushSendBuffer()
+        if error is not None:
+            raise error
+        with self._sendCond:
+            unread = len(self._sendBuffer)
+        if unread > MAX_SEND_BUFFER:
+            self._sendFailed(f"{unread} bytes unread")
+            raise OSError(f"Send buffer full, dropped the connection to {self.hostname}")
+
+    def _flushSendBuffer(self) -> Optional[OSError]:
+        """Write as much of the send buffer as the socket takes without blocking
+
+        Returns the error if the connection failed, after arranging to reconnect.
+        """
+        error = None
+        with self._sendCond:
+            sock = self.socket
+            if sock is None or self.reactor is None or not self._sendBuffer:
+                return None
+            try:
+                sent = sock.send(self._sendBuffer)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError as ex:
+                sent = 0
+                error = ex
+            if sent:
+                del self._sendBuffer[:sent]
+                self._sendProgress = time.monotonic()
+            if not self._sendBuffer:
+                self._sendCond.notify_all()
+            pending = bool(self._sendBuffer) and error is None
+            watch = pending != self._sendWatched
+            self._sendWatched = pending
+            if pending and self._stallTimer is None:
+                self._stallTimer = self.reactor.callLater(SEND_STALL_TIMEOUT, self._checkSendStall)
+        if error is not None:
+            self._sendFailed(str(error))
+        elif watch and self.reactor is not None:
+            self.reactor.watchWrites(self, pending)
+        return error
+
+    def _onWritable(self) -> None:
+        self._flushSendBuffer()
+
+    def _checkSendStall(self) -> None:
+        """Drop the connection if its peer hasn't read any of what we buffered for SEND_STALL_TIMEOUT"""
+        with self._sendCond:
+            self._stallTimer = None
+            if not self._sendBuffer or self.reactor is None:
+                return
+            idle = time.monotonic() - self._sendProgress
+            if idle < SEND_STALL_TIMEOUT:
+                self._stallTimer = self.reactor.callLater(SEND_STALL_TIMEOUT - idle, self._checkSendStall)
+                return
+        self._sendFailed(f"nothing read for {idle:.0f}s")
+
+    def _sendFailed(self, reason: str) -> None:
+        """Give up on the connection, its peer isn't taking what we write"""
+        logger.error(f"Socket send error, reconnecting: {reason}")
+        with self._sendCond:
+            self._resetSendBufferLocked()
+        if not self._wantExit:
+            self._reconnectSoon()
+
+    def _resetSendBufferLocked(self) -> None:
+        """Forget what we had buffered, the connection it was for is going away"""
+        self._sendBuffer.clear()
+        self._sendWatched = False
+        if self._stallTimer is not None:
+            self._stallTimer.cancel()
+            self._stallTimer = None
+        self._sendCond.notify_all()
+
     def _readBytes(self, length) -> Optional[bytes]:
         """Read an array of bytes from our stream"""
         if self.socket is not None:
-            data = self.socket.recv(length)
+            try:
+                data = self.socket.recv(length)
+            except (BlockingIOError, InterruptedError):
+                return b""  # a non-blocking socket with nothing after all
             # empty byte indicates a disconnected socket,
             # we need to handle it to avoid an infinite loop reading from null socket
             if data == b"":
                 logger.debug("Closed socket, re-connecting")
                 if not self._wantExit:
-                    self._reconnect()
+                    self._reconnectSoon()
             return data
 
         # no socket, break reader thread
         self._wantExit = True
         return None
 
+    def _readChunkSize(self) -> int:
+        """recv() returns whatever is ready, so always offer a full chunk"""
+        return READ_CHUNK_SIZE
+
+    def _selectable(self):
+        return self.socket
+
+    def _reconnectSoon(self) -> None:
+        """Reconnect; with a reactor, on a thread of our own so none of the reactor's threads block"""
+        if self.reactor is None:
+            self._reconnect()
+        else:
+            self.reactor.unregister(self)
+            threading.Thread(
+                target=self._reconnectUntilConnected, args=(self.socket,), name="tcp reconnect", daemon=True
+            ).start()
+
+    def _reconnectUntilConnected(self, sock) -> None:
+        """Reconnect, retrying with a growing delay until it works or we are closed"""
+        delay = RECONNECT_RETRY_DELAY
+        while not self._wantExit:
+            try:
+                self._reconnectFrom(sock)
+                return
+            except OSError as ex:
+                logger.warning(f"Reconnecting to {self.hostname} failed, retrying in {delay:.0f}s: {ex}")
+            sock = None  # the failed attempt dropped the old socket
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
     def _reconnect(self) -> None:
         """Reconnect to the socket"""
-        # Save the socket reference before attempting to acquire the lock.
-        sock = self.socket
+        self._reconnectFrom(self.socket)
+
+    def _reconnectFrom(self, sock) -> None:
+        """Replace sock with a new connection, unless someone already replaced it"""
         start_config = False
         with self.reconnectLock:
             if self._wantExit:
@@ -172,8 +334,12 @@ class TCPInterface(StreamInterface):
             if self.socket is not None:
                 self.socket.close()
             self.socket = None
+            with self._sendCond:
+                self._resetSendBufferLocked()  # half written frames would garble the next connection
             time.sleep(1)
             self.myConnect()
+            if self.reactor is not None:
+                self.reactor.register(self)
             start_config = True
 
         if start_config and not self._wantExit and self.socket is not None:
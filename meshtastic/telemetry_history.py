@@ -0,0 +1,229 @@
+"""Recent telemetry of every node, as time series
+
+A node's entry in the node DB only has its latest deviceMetrics,
+environmentMetrics and so on. Given a history, the interface also appends each
+telemetry packet to it::
+
+    iface.telemetryHistory = TelemetryHistory()
+
+It is off by default, as it costs memory per node on a big mesh. The history
+keeps the last `capacity` samples per node and kind of metrics, in compact
+arrays (a float64 timestamp and a float64 per field, rather than a dict per
+sample; float32 would round counters such as uptimeSeconds and numPacketsRx
+once they pass 2**24)::
+
+    series = iface.telemetryHistory.series(num, "deviceMetrics")
+    series.rolling("batteryLevel", 3600)  # count, mean, min, max, last over the last hour
+    series.downsample("voltage", 900)  # 15 minute means
+    arrays = series.toNumpy()  # {"time": ..., "batteryLevel": ..., ...}
+
+toNumpy() (which needs numpy) and toArrow() (which needs pyarrow) don't copy
+the samples: they return views of the series' own buffers, which are only
+valid until the next sample arrives. After that a view may hold newer
+samples in place of older ones, and out of order once the series has wrapped
+around, so copy it to keep it.
+"""
+import math
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+try:
+    import numpy as np  # type: ignore[import-not-found]
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa  # type: ignore[import-not-found]
+except ImportError:
+    pa = None
+
+DEFAULT_CAPACITY = 128
+
+AGGREGATES = ("mean", "min", "max", "last", "count")
+
+
+class TelemetrySeries:
+    """The last capacity samples of one kind of metrics from one node"""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        """Constructor
+
+        Keyword Arguments:
+            capacity -- how many samples to keep
+        """
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        # Preallocated so the buffers never move, and views of them stay valid
+        self._time = array("d", bytes(8 * capacity))
+        self._columns: Dict[str, array] = {}
+        self._next = 0  # where the next sample goes
+        self._count = 0
+        self._start = 0  # where the oldest sample is
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def fields(self) -> List[str]:
+        """The metrics we have seen in this series"""
+        return list(self._columns)
+
+    def append(self, timestamp: float, metrics: Mapping[str, Any]) -> None:
+        """Add a sample, dropping the oldest one if we are full. Non numeric metrics are ignored."""
+        with self._lock:
+            i = self._next
+            self._time[i] = timestamp
+            seen = set()
+            for name, value in metrics.items():
+                if isinstance(value, (int, float)):
+                    column = self._columns.get(name)
+                    if column is None:
+                        column = self._columns[name] = array("d", [math.nan]) * self.capacity
+                    column[i] = value
+                    seen.add(name)
+            for name, column in self._columns.items():
+                if name not in seen:
+                    column[i] = math.nan
+            self._next = (i + 1) % self.capacity
+            if self._count < self.capacity:
+                self._count += 1
+            else:
+                self._start = self._next
+
+    def _linearizeLocked(self) -> None:
+        """Rotate the buffers so the oldest sample is first"""
+        s = self._start
+        if s == 0:
+            return
+        for buffer in [self._time, *self._columns.values()]:
+            buffer[:] = buffer[s:] + buffer[:s]  # same size, so allowed while views exist
+        self._start = 0
+        self._next = self._count % self.capacity
+
+    def samples(self, name: str) -> List[Tuple[float, float]]:
+        """(timestamp, value) of every sample that has metric name, oldest first"""
+        with self._lock:
+            column = self._columns.get(name)
+            if column is None:
+                return []
+            result = []
+            for k in range(self._count):
+                i = (self._start + k) % self.capacity
+                if not math.isnan(column[i]):
+                    result.append((self._time[i], column[i]))
+            return result
+
+    def rolling(self, name: str, window: float, now: Optional[float] = None) -> Dict[str, Any]:
+        """count, mean, min, max and last of metric name over the last window seconds (up to now),
+        all but count None if there are no samples"""
+        if now is None:
+            now = time.time()
+        values = [value for t, value in self.samples(name) if now - window <= t <= now]
+        if not values:
+            return {"count": 0, "mean": None, "min": None, "max": None, "last": None}
+        return {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "min": min(values),
+            "max": max(values),
+            "last": values[-1],
+        }
+
+    def downsample(self, name: str, bucket: float, how: str = "mean") -> List[Tuple[float, float]]:
+        """(bucket start, aggregate) of metric name per bucket seconds, for buckets that have samples
+
+        how is one of AGGREGATES.
+        """
+        if how not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate {how}, expected one of {', '.join(AGGREGATES)}")
+        buckets: Dict[float, List[float]] = {}
+        for t, value in self.samples(name):
+            buckets.setdefault(math.floor(t / bucket) * bucket, []).append(value)
+        result = []
+        for start in sorted(buckets):
+            values = buckets[start]
+            if how == "mean":
+                result.append((start, sum(values) / len(values)))
+            elif how == "min":
+                result.append((start, min(values)))
+            elif how == "max":
+                result.append((start, max(values)))
+            elif how == "last":
+                result.append((start, values[-1]))
+            else:
+                result.append((start, float(len(values))))
+        return result
+
+    def views(self) -> Dict[str, memoryview]:
+        """"time" and each metric as memoryviews of our buffers, oldest sample first (NaN where a
+        sample lacks a metric). No copies are made, so the views are only valid until the next
+        append(), which may overwrite their oldest sample: copy them to keep them for longer."""
+        with self._lock:
+            self._linearizeLocked()
+            n = self._count
+            result = {"time": memoryview(self._time)[:n]}
+            for name, column in self._columns.items():
+                result[name] = memoryview(column)[:n]
+            return result
+
+    def toNumpy(self) -> Dict[str, Any]:
+        """views() as float64 numpy arrays, without copying (so only valid until the next append())"""
+        if np is None:
+            raise ImportError("toNumpy() needs numpy, pip install numpy")
+        return {name: np.frombuffer(view, dtype=np.float64) for name, view in self.views().items()}
+
+    def toArrow(self) -> Any:
+        """views() as a pyarrow Table, without copying (so only valid until the next append())"""
+        if pa is None:
+            raise ImportError("toArrow() needs pyarrow, pip install pyarrow")
+        columns = {}
+        for name, view in self.views().items():
+            columns[name] = pa.Array.from_buffers(pa.float64(), len(view), [None, pa.py_buffer(view)])
+        return pa.table(columns)
+
+
+class TelemetryHistory:
+    """A TelemetrySeries per node and kind of metrics ("deviceMetrics", "environmentMetrics", ...)"""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        """Constructor
+
+        Keyword Arguments:
+            capacity -- how many samples to keep per node and kind of metrics
+        """
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[int, str], TelemetrySeries] = {}
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+    def record(self, num: int, kind: str, metrics: Mapping[str, Any], timestamp: Optional[float] = None) -> None:
+        """Add a sample of metrics kind from node num, taken at timestamp (default now)"""
+        with self._lock:
+            series = self._series.get((num, kind))
+            if series is None:
+                series = self._series[(num, kind)] = TelemetrySeries(self.capacity)
+        series.append(timestamp if timestamp is not None else time.time(), metrics)
+
+    def series(self, num: int, kind: str) -> Optional[TelemetrySeries]:
+        """The samples of metrics kind from node num, None if we have none"""
+        return self._series.get((num, kind))
+
+    def kinds(self, num: int) -> List[str]:
+        """The kinds of metrics we have samples of from node num"""
+        with self._lock:
+            return [kind for n, kind in self._series if n == num]
+
+    def remove(self, num: int) -> None:
+        """Forget a node's history"""
+        with self._lock:
+            for key in [key for key in self._series if key[0] == num]:
+                del self._series[key]
+
+    def clear(self) -> None:
+        """Forget everything"""
+        with self._lock:
+            self._series.clear()
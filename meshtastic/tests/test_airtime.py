@@ -0,0 +1,110 @@
+"""Meshtastic unit tests for airtime.py"""
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from ..airtime import AirtimeLimiter, LoRaParams, loraParams, packetLength, timeOnAir
+from ..protobuf import config_pb2, mesh_pb2
+
+LoRaConfig = config_pb2.Config.LoRaConfig
+
+
+def _meshPacket(size: int) -> mesh_pb2.MeshPacket:
+    p = mesh_pb2.MeshPacket()
+    p.decoded.payload = b"x" * size
+    return p
+
+
+def _iface(region=LoRaConfig.EU_868, preset=LoRaConfig.LONG_FAST, metrics=None) -> MagicMock:
+    iface = MagicMock()
+    lora = iface.localNode.localConfig.lora = LoRaConfig()
+    lora.use_preset = True
+    lora.modem_preset = preset
+    lora.region = region
+    iface.getMyNodeInfo.return_value = {"deviceMetrics": metrics or {}}
+    return iface
+
+
+class FakeClock:
+    """A monotonic clock the test moves by hand"""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.mark.unit
+def test_timeOnAir():
+    """Matches the Semtech formula, including low data rate optimization for long symbols"""
+    assert timeOnAir(10, LoRaParams(250, 11, 5)) == pytest.approx(0.313344)
+    # SF12 at 125 kHz has 32.8 ms symbols, so low data rate optimization is on
+    assert timeOnAir(10, LoRaParams(125, 12, 8)) == pytest.approx((16 + 4.25 + 8 + 2 * 8) * 0.032768)
+    assert timeOnAir(200) > timeOnAir(20)
+
+
+@pytest.mark.unit
+def test_loraParams_preset_and_custom():
+    """Presets come from the table, custom settings are used as given"""
+    lora = LoRaConfig()
+    lora.use_preset = True
+    lora.modem_preset = LoRaConfig.SHORT_FAST
+    assert loraParams(lora) == LoRaParams(250, 7, 5)
+    lora.use_preset = False
+    lora.bandwidth = 62
+    lora.spread_factor = 10
+    lora.coding_rate = 7
+    assert loraParams(lora) == LoRaParams(62.5, 10, 7)
+
+
+@pytest.mark.unit
+def test_packetLength_counts_header_and_pki():
+    """On air size is the header plus the payload, PKI adds its tag"""
+    p = _meshPacket(10)
+    assert packetLength(p) == 16 + p.decoded.ByteSize()
+    p.pki_encrypted = True
+    assert packetLength(p) == 16 + p.decoded.ByteSize() + 12
+
+
+@pytest.mark.unit
+def test_AirtimeLimiter_enforces_region_duty_cycle():
+    """EU_868 allows 10%, so after spending the burst we wait ten times a packet's airtime"""
+    clock = FakeClock()
+    limiter = AirtimeLimiter(_iface(), window=10, clock=clock)
+    assert limiter.allowedDutyCycle() == 10.0
+    p = _meshPacket(100)
+    cost = limiter.timeOnAir(p)
+    sent = 0
+    while limiter.timeUntilSend(p) == 0:
+        limiter.consume(p)
+        sent += 1
+    assert sent == int(1.0 / cost) + 1
+    wait = limiter.timeUntilSend(p)
+    assert 0 < wait <= cost * 10
+    clock.now += wait + 1e-6
+    assert limiter.timeUntilSend(p) == 0
+
+
+@pytest.mark.unit
+def test_AirtimeLimiter_backs_off_on_busy_channel():
+    """Channel utilization eats into the budget, down to a floor"""
+    iface = _iface(region=LoRaConfig.US, metrics={"channelUtilization": 20.0})
+    limiter = AirtimeLimiter(iface)
+    assert limiter.allowedDutyCycle() == pytest.approx(5.0)
+    iface.getMyNodeInfo.return_value = {"deviceMetrics": {"channelUtilization": 60.0}}
+    assert limiter.allowedDutyCycle() == 1.0
+    assert AirtimeLimiter(_iface(metrics={"airUtilTx": 12.0})).allowedDutyCycle() == 1.0
+
+
+@pytest.mark.unit
+def test_AirtimeLimiter_oversize_packet_goes_when_full():
+    """A packet costing more than the whole bucket is not held forever"""
+    clock = FakeClock()
+    limiter = AirtimeLimiter(dutyCycle=1.0, window=10, clock=clock)
+    p = _meshPacket(200)
+    assert limiter.timeOnAir(p) > 0.1
+    assert limiter.timeUntilSend(p) == 0
+    limiter.consume(p)
+    assert limiter.timeUntilSend(p) > 0
@@ -0,0 +1,276 @@
+"""Meshtastic unit tests for asyncio_interface.py"""
+
+import asyncio
+import threading
+from typing import List
+from unittest.mock import patch
+
+import pytest
+
+from ..asyncio_interface import AsyncTCPInterface, PacketFuture
+from ..dispatcher import InlineDispatcher
+from ..mesh_interface import MeshInterface
+from ..node_cache import NodeCache
+from ..protobuf import admin_pb2, channel_pb2, mesh_pb2, portnums_pb2
+from ..stream_interface import START1, START2, StreamFramer
+
+MY_NODE_NUM = 0x1234
+REMOTE_NODE_NUM = 0x5678
+
+
+class FakeDevice:
+    """A minimal device on a local TCP port: answers want_config, acks packets and, for the remote node, channel requests"""
+
+    def __init__(self, ackPackets: bool = True):
+        self.ackPackets = ackPackets
+        self.received: List[mesh_pb2.ToRadio] = []
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        """Start listening on an ephemeral port"""
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop listening"""
+        self.server.close()
+        await self.server.wait_closed()
+
+    @staticmethod
+    def _send(writer, fromRadio):
+        b = fromRadio.SerializeToString()
+        writer.write(bytes([START1, START2, len(b) >> 8, len(b) & 0xFF]) + b)
+
+    async def _serve(self, reader, writer):
+        def onFrame(frame):
+            toRadio = mesh_pb2.ToRadio()
+            toRadio.ParseFromString(frame)
+            self.received.append(toRadio)
+            if toRadio.want_config_id:
+                f = mesh_pb2.FromRadio()
+                f.my_info.my_node_num = MY_NODE_NUM
+                self._send(writer, f)
+                f = mesh_pb2.FromRadio()
+                f.node_info.num = REMOTE_NODE_NUM
+                f.node_info.user.id = f"!{REMOTE_NODE_NUM:08x}"
+                f.node_info.user.long_name = "Remote"
+                f.node_info.user.short_name = "RMT"
+                self._send(writer, f)
+                f = mesh_pb2.FromRadio()
+                f.config_complete_id = toRadio.want_config_id
+                self._send(writer, f)
+            elif toRadio.packet.decoded.portnum == portnums_pb2.PortNum.ADMIN_APP:
+                request = admin_pb2.AdminMessage()
+                request.ParseFromString(toRadio.packet.decoded.payload)
+                response = admin_pb2.AdminMessage()
+                response.get_channel_response.index = request.get_channel_request - 1
+                response.get_channel_response.role = channel_pb2.Channel.Role.SECONDARY
+                f = mesh_pb2.FromRadio()
+                setattr(f.packet, "from", toRadio.packet.to)
+                f.packet.to = MY_NODE_NUM
+                f.packet.decoded.portnum = portnums_pb2.PortNum.ADMIN_APP
+                f.packet.decoded.request_id = toRadio.packet.id
+                f.packet.decoded.payload = response.SerializeToString()
+                self._send(writer, f)
+            elif toRadio.HasField("packet") and toRadio.packet.want_ack and self.ackPackets:
+                f = mesh_pb2.FromRadio()
+                setattr(f.packet, "from", REMOTE_NODE_NUM)
+                f.packet.to = MY_NODE_NUM
+                f.packet.decoded.portnum = portnums_pb2.PortNum.ROUTING_APP
+                f.packet.decoded.request_id = toRadio.packet.id
+                f.packet.decoded.payload = mesh_pb2.Routing().SerializeToString()
+                self._send(writer, f)
+
+        framer = StreamFramer(onFrame, lambda b: None)
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                break
+            framer.feed(data)
+        writer.close()
+
+
+def _run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+@pytest.mark.unit
+def test_AsyncTCPInterface_config_handshake():
+    """connect() resolves once the device has sent its config"""
+
+    async def main():
+        device = FakeDevice()
+        await device.start()
+        async with AsyncTCPInterface("127.0.0.1", portNumber=device.port) as iface:
+            assert iface.isConnected.is_set()
+            assert iface.myInfo.my_node_num == MY_NODE_NUM
+            assert iface.localNode.nodeNum == MY_NODE_NUM
+        await device.stop()
+        return device.received
+
+    received = _run(main())
+    assert received[0].want_config_id != 0
+    assert received[-1].disconnect
+
+
+@pytest.mark.unit
+def test_AsyncTCPInterface_sendText_resolves_on_ack():
+    """The future returned by sendText resolves to the routing ACK"""
+
+    async def main():
+        device = FakeDevice()
+        await device.start()
+        async with AsyncTCPInterface("127.0.0.1", portNumber=device.port) as iface:
+            future = iface.sendText("hello", REMOTE_NODE_NUM, wantAck=True)
+            assert isinstance(future, PacketFuture)
+            ack = await future
+            assert ack["decoded"]["requestId"] == future.packet.id
+            assert ack["decoded"]["portnum"] == "ROUTING_APP"
+            assert future.packet.id not in iface.responseHandlers
+        await device.stop()
+        return device.received
+
+    received = _run(main())
+    texts = [r.packet for r in received if r.HasField("packet")]
+    assert [p.decoded.payload for p in texts] == [b"hello"]
+
+
+@pytest.mark.unit
+def test_AsyncTCPInterface_sendData_without_reply_resolves_immediately():
+    """Packets that don't ask for an ack resolve to None, and still reach the device"""
+
+    async def main():
+        device = FakeDevice()
+        await device.start()
+        async with AsyncTCPInterface("127.0.0.1", portNumber=device.port) as iface:
+            assert await iface.sendData(b"\x01\x02") is None
+        await device.stop()
+        return device.received
+
+    received = _run(main())
+    assert any(r.HasField("packet") and r.packet.decoded.payload == b"\x01\x02" for r in received)
+
+
+@pytest.mark.unit
+def test_AsyncTCPInterface_cancelled_wait_forgets_handler():
+    """Giving up on a response removes its response handler"""
+
+    async def main():
+        device = FakeDevice(ackPackets=False)
+        await device.start()
+        async with AsyncTCPInterface("127.0.0.1", portNumber=device.port) as iface:
+            future = iface.sendTraceRoute(REMOTE_NODE_NUM, hopLimit=3)
+            assert future.packet.id in iface.responseHandlers
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(future, 0.2)
+            assert future.packet.id not in iface.responseHandlers
+        await device.stop()
+
+    _run(main())
+
+
+@pytest.mark.unit
+def test_AsyncTCPInterface_expired_reply_raises_timeout():
+    """An unanswered request fails with TimeoutError, expired by the loop rather than a timer thread"""
+
+    async def main():
+        device = FakeDevice(ackPackets=False)
+        await device.start()
+        expired = []
+        async with AsyncTCPInterface("127.0.0.1", portNumber=device.port) as iface:
+            with patch("meshtastic.mesh_interface.RESPONSE_SWEEP_INTERVAL", 0.05), \
+                    patch("threading.Timer", side_effect=AssertionError("no timer threads")):
+                future = iface.sendData(
+                    b"ping",
+                    REMOTE_NODE_NUM,
+                    wantAck=True,
+                    responseTimeout=0.05,
+                    onResponseExpired=lambda: expired.append(threading.current_thread()),
+                )
+                with pytest.raises(TimeoutError):
+                    await future
+            assert future.packet.id not in iface.responseHandlers
+        await device.stop()
+        return expired
+
+    assert _run(main()) == [threading.main_thread()]
+
+
+@pytest.mark.unit
+def test_AsyncTCPInterface_getNode_by_name():
+    """getNode resolves names like the blocking interfaces, and awaits each channel as it arrives"""
+
+    async def main():
+        device = FakeDevice()
+        await device.start()
+        async with AsyncTCPInterface("127.0.0.1", portNumber=device.port) as iface:
+            with patch("asyncio.sleep", side_effect=AssertionError("no polling")):
+                node = await iface.getNode("RMT", timeout=5)
+        await device.stop()
+        return node
+
+    node = _run(main())
+    assert node.nodeNum == REMOTE_NODE_NUM
+    assert [c.index for c in node.channels] == list(range(8))
+
+
+@pytest.mark.unit
+def test_AsyncTCPInterface_close_stops_background_work():
+    """close() tears down what MeshInterface.close does: timers, transfers and the node cache"""
+
+    async def main():
+        device = FakeDevice(ackPackets=False)
+        await device.start()
+        iface = AsyncTCPInterface("127.0.0.1", portNumber=device.port)
+        await iface.connect()
+        iface.sendData(b"ping", REMOTE_NODE_NUM, wantAck=True)
+        assert iface._responseSweepTimer is not None
+        with patch.object(iface.transfers, "close") as closeTransfers, patch.object(iface, "_saveNodeCache") as save:
+            await iface.close()
+        assert iface._responseSweepTimer is None and iface.heartbeatTimer is None
+        closeTransfers.assert_called_once()
+        save.assert_called()
+        await device.stop()
+
+    _run(main())
+
+
+@pytest.mark.unit
+def test_AsyncTCPInterface_send_before_connect_raises():
+    """Sending before the config download is an error rather than blocking the loop"""
+
+    async def main():
+        iface = AsyncTCPInterface("127.0.0.1", portNumber=1)
+        iface.myInfo = mesh_pb2.MyNodeInfo(my_node_num=MY_NODE_NUM)
+        with pytest.raises(MeshInterface.MeshInterfaceError):
+            iface.sendText("too early", REMOTE_NODE_NUM)
+
+    _run(main())
+
+
+@pytest.mark.unit
+def test_AsyncTCPInterface_takes_dispatcher_and_node_cache(tmp_path):
+    """The asyncio interfaces take the same keyword-only extras as the blocking ones"""
+
+    async def main():
+        device = FakeDevice()
+        await device.start()
+        dispatcher = InlineDispatcher()
+        cache = NodeCache(str(tmp_path / "nodes.json"))
+        async with AsyncTCPInterface("127.0.0.1", portNumber=device.port, dispatcher=dispatcher, nodeCache=cache) as iface:
+            assert iface.dispatcher is dispatcher and iface.nodeCache is cache
+        await device.stop()
+        return dispatcher.stats().delivered
+
+    assert _run(main()) > 0  # connection.established at least
+    assert REMOTE_NODE_NUM in [node["num"] for node in NodeCache(str(tmp_path / "nodes.json")).load(MY_NODE_NUM)]
+
+
+@pytest.mark.unit
+def test_AsyncTCPInterface_requires_async_with():
+    """The blocking context manager protocol is refused"""
+    iface = AsyncTCPInterface("127.0.0.1", noProto=True)
+    with pytest.raises(TypeError):
+        with iface:
+            pass
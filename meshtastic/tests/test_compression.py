@@ -0,0 +1,75 @@
+"""Meshtastic unit tests for compression.py"""
+
+from unittest.mock import patch
+
+import pytest
+
+from ..compression import COMPRESSED_PORTNUM, CompressionError, PayloadCodec, benchmark, decompress
+from ..dispatcher import InlineDispatcher
+from ..mesh_interface import MeshInterface
+from ..protobuf import mesh_pb2, portnums_pb2
+
+TEXT = portnums_pb2.PortNum.TEXT_MESSAGE_APP
+
+
+@pytest.mark.unit
+def test_PayloadCodec_round_trip():
+    """Compressed payloads come back as they went in, with their portnum"""
+    codec = PayloadCodec()
+    text = "on my way, I'll be there in 10 minutes".encode("utf-8")
+    compressed = codec.compress(TEXT, text)
+    assert compressed is not None and len(compressed) < len(text)
+    assert decompress(compressed) == (TEXT, text)
+
+
+@pytest.mark.unit
+def test_PayloadCodec_only_when_it_helps():
+    """Other ports, and payloads compression would make longer, are left alone"""
+    codec = PayloadCodec()
+    assert codec.compress(portnums_pb2.PortNum.POSITION_APP, b"x" * 100) is None
+    assert codec.compress(TEXT, b"ok") is None
+    assert codec.compress(TEXT, bytes(range(200))) is None
+
+
+@pytest.mark.unit
+def test_decompress_rejects_bad_payloads():
+    """Garbage, unknown dictionaries and decompression bombs raise CompressionError"""
+    for payload in (b"\xff\xff", mesh_pb2.Compressed(portnum=TEXT, data=b"\x09abc").SerializeToString()):
+        with pytest.raises(CompressionError):
+            decompress(payload)
+    bomb = PayloadCodec(ports=[TEXT], dictionary=0).compress(TEXT, b"\0" * 100000)
+    with pytest.raises(CompressionError):
+        decompress(bomb)
+
+
+@pytest.mark.unit
+def test_benchmark_reports_every_message():
+    """The benchmark gives sizes and timings for each sample"""
+    rows = benchmark(["Good morning everyone!", "ok"], rounds=2)
+    assert [r["length"] for r in rows] == [22, 2]
+    assert rows[0]["withDictionary"] < rows[0]["withoutDictionary"] <= 22
+    assert rows[1]["withDictionary"] == 2
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_compressed_text_sent_and_received():
+    """sendText compresses with iface.compression set, and received packets are handed on decompressed"""
+    iface = MeshInterface(noProto=True)
+    iface.nodes = {}
+    iface.nodesByNum = {}
+    iface.compression = PayloadCodec()
+    sent = iface.sendText("copy that, meet at the north station tomorrow morning")
+    assert sent.decoded.portnum == COMPRESSED_PORTNUM
+
+    received = mesh_pb2.MeshPacket()
+    received.CopyFrom(sent)
+    setattr(received, "from", 0x1234)
+    iface.dispatcher = InlineDispatcher()
+    with patch("meshtastic.mesh_interface.pub") as mockPub:
+        iface._handlePacketFromRadio(received)
+    published = {call.args[0]: call.kwargs for call in mockPub.sendMessage.call_args_list}
+    packet = published["meshtastic.receive.text"]["packet"]
+    assert packet["decoded"]["text"] == "copy that, meet at the north station tomorrow morning"
+    assert packet["decoded"]["portnum"] == "TEXT_MESSAGE_APP"
+    iface.close()
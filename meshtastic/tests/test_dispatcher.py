@@ -0,0 +1,192 @@
+"""Meshtastic unit tests for dispatcher.py"""
+
+import threading
+
+import pytest
+from pubsub import pub
+
+from ..dispatcher import (
+    ORDER_BY_SENDER,
+    OVERFLOW_DROP_OLDEST,
+    OVERFLOW_DROP_PRIORITY,
+    InlineDispatcher,
+    PoolDispatcher,
+    ThreadDispatcher,
+)
+from ..mesh_interface import MeshInterface
+
+
+@pytest.mark.unit
+def test_InlineDispatcher_runs_immediately():
+    """Inline delivery happens before queueWork returns, and survives errors"""
+    ran = []
+    d = InlineDispatcher()
+    d.queueWork(lambda: 1 / 0)
+    d.queueWork(lambda: ran.append(threading.current_thread()))
+    assert ran == [threading.current_thread()]
+
+
+@pytest.mark.unit
+def test_ThreadDispatcher_keeps_order():
+    """Work runs in order on the dispatcher's thread, flush waits for it"""
+    ran = []
+    d = ThreadDispatcher("test")
+    for i in range(100):
+        d.queueWork(lambda i=i: ran.append(i))
+    d.queueWork(lambda: 1 / 0)  # an error doesn't stop the thread
+    d.queueWork(lambda: ran.append(threading.current_thread()))
+    assert d.flush(1)
+    assert ran == list(range(100)) + [d.thread]
+    d.close()
+    assert not d.thread.is_alive()
+
+
+@pytest.mark.unit
+def test_ThreadDispatcher_drops_work_after_close():
+    """Nothing would ever run work queued once closed, so it's counted as dropped"""
+    ran = []
+    d = ThreadDispatcher("test")
+    d.close()
+    d.queueWork(lambda: ran.append(1), "meshtastic.receive")
+    stats = d.stats()
+    assert stats.enqueued == 0 and stats.dropped == 1 and stats.depth == 0
+    assert not ran
+
+
+def _stalled(d):
+    """Block d's thread until the returned event is set"""
+    release = threading.Event()
+    started = threading.Event()
+    d.queueWork(lambda: (started.set(), release.wait()))
+    assert started.wait(1)
+    return release
+
+
+@pytest.mark.unit
+def test_ThreadDispatcher_drop_oldest():
+    """A full queue discards its oldest work"""
+    ran = []
+    d = ThreadDispatcher("test", maxDepth=3, overflow=OVERFLOW_DROP_OLDEST)
+    release = _stalled(d)
+    for i in range(5):
+        d.queueWork(lambda i=i: ran.append(i))
+    stats = d.stats()
+    assert (stats.enqueued, stats.dropped, stats.depth) == (6, 2, 3)
+    release.set()
+    assert d.flush(1)
+    assert ran == [2, 3, 4]
+    assert d.stats().delivered == 4
+    d.close()
+
+
+@pytest.mark.unit
+def test_ThreadDispatcher_drop_priority():
+    """A full queue discards the oldest work with the lowest topic priority"""
+    ran = []
+    d = ThreadDispatcher("test", maxDepth=2, overflow=OVERFLOW_DROP_PRIORITY)
+    release = _stalled(d)
+    d.queueWork(lambda: ran.append("position"), topic="meshtastic.receive.position")
+    d.queueWork(lambda: ran.append("text"), topic="meshtastic.receive.text")
+    d.queueWork(lambda: ran.append("lost"), topic="meshtastic.connection.lost")
+    # now everything queued outranks another position report, so that is what goes
+    d.queueWork(lambda: ran.append("position 2"), topic="meshtastic.receive.position")
+    assert d.stats().dropped == 2
+    release.set()
+    assert d.flush(1)
+    assert ran == ["text", "lost"]
+    d.close()
+
+
+@pytest.mark.unit
+def test_ThreadDispatcher_block_and_age():
+    """By default a full queue makes the publisher wait, and the wait shows up as age"""
+    d = ThreadDispatcher("test", maxDepth=1)
+    release = _stalled(d)
+    d.queueWork(lambda: None)
+    queued = threading.Event()
+    threading.Thread(target=lambda: (d.queueWork(lambda: None), queued.set()), daemon=True).start()
+    assert not queued.wait(0.2)
+    assert d.stats().age >= 0.2
+    release.set()
+    assert queued.wait(1)
+    assert d.flush(1)
+    stats = d.stats()
+    assert (stats.dropped, stats.depth, stats.age) == (0, 0, 0.0)
+    assert stats.maxAge >= 0.2
+    d.close()
+
+
+@pytest.mark.unit
+def test_PoolDispatcher_keeps_interfaces_independent():
+    """A stalled subscriber only delays the interface it belongs to"""
+    d = PoolDispatcher(workers=2)
+    ifaces = [object() for _ in range(8)]
+    slow = ifaces[0]
+    fast = next(i for i in ifaces if d._workerFor(None, i, None) is not d._workerFor(None, slow, None))
+    release = threading.Event()
+    delivered = threading.Event()
+    d.queueWork(release.wait, interface=slow)
+    d.queueWork(delivered.set, interface=fast)
+    assert delivered.wait(1)
+    release.set()
+    assert d.flush(1)
+    d.close()
+
+
+@pytest.mark.unit
+def test_PoolDispatcher_orders_per_sender():
+    """Work for one sender always runs in order, on the same worker"""
+    d = PoolDispatcher(workers=3, orderBy=ORDER_BY_SENDER)
+    ran = {sender: [] for sender in range(5)}
+    for i in range(50):
+        for sender, seen in ran.items():
+            d.queueWork(lambda seen=seen, i=i: seen.append((i, threading.current_thread())), sender=sender)
+    assert d.flush(1)
+    d.close()
+    for seen in ran.values():
+        assert [i for i, _ in seen] == list(range(50))
+        assert len({thread for _, thread in seen}) == 1
+
+
+@pytest.mark.unit
+def test_PoolDispatcher_drop_priority():
+    """Each worker's overflow policy sees the topics, so it drops low priority work first"""
+    ran = []
+    d = PoolDispatcher(workers=1, maxDepth=2, overflow=OVERFLOW_DROP_PRIORITY)
+    release = _stalled(d.workers[0])
+    d.queueWork(lambda: ran.append("text"), topic="meshtastic.receive.text")
+    d.queueWork(lambda: ran.append("position"), topic="meshtastic.receive.position")
+    d.queueWork(lambda: ran.append("lost"), topic="meshtastic.connection.lost")
+    d.queueWork(lambda: ran.append("telemetry"), topic="meshtastic.receive.telemetry")
+    assert d.stats().dropped == 2
+    release.set()
+    assert d.flush(1)
+    assert ran == ["text", "lost"]
+    d.close()
+
+
+@pytest.mark.unit
+def test_PoolDispatcher_rejects_bad_arguments():
+    """Nonsense configurations fail early"""
+    with pytest.raises(ValueError):
+        PoolDispatcher(workers=0)
+    with pytest.raises(ValueError):
+        PoolDispatcher(orderBy="random")
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_MeshInterface_publishes_through_its_dispatcher():
+    """An interface given a dispatcher publishes through it"""
+    received = []
+
+    def onLost(interface):
+        received.append(interface)
+
+    pub.subscribe(onLost, "meshtastic.connection.lost")
+    try:
+        iface = MeshInterface(noProto=True, dispatcher=InlineDispatcher())
+        iface._disconnected()
+        assert received == [iface]
+    finally:
+        pub.unsubscribe(onLost, "meshtastic.connection.lost")
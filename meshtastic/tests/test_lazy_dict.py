@@ -0,0 +1,133 @@
+"""Meshtastic unit tests for lazy_dict.py"""
+
+import copy
+import json
+import pickle
+import threading
+from unittest.mock import patch
+
+import pytest
+from google.protobuf.json_format import MessageToDict
+
+from .. import lazy_dict
+from ..lazy_dict import LazyMessageDict
+from ..protobuf import mesh_pb2, portnums_pb2, telemetry_pb2
+
+
+def _meshPacket() -> mesh_pb2.MeshPacket:
+    p = mesh_pb2.MeshPacket()
+    setattr(p, "from", 0xDEADBEEF)
+    p.to = 0xFFFFFFFF
+    p.id = 42
+    p.rx_time = 1700000000
+    p.rx_snr = -7.25
+    p.hop_limit = 3
+    p.priority = mesh_pb2.MeshPacket.Priority.RELIABLE
+    p.decoded.portnum = portnums_pb2.PortNum.TEXT_MESSAGE_APP
+    p.decoded.payload = b"hello"
+    return p
+
+
+def _nodeInfo() -> mesh_pb2.NodeInfo:
+    n = mesh_pb2.NodeInfo(num=1234)
+    n.user.id = "!000004d2"
+    n.user.long_name = "Node"
+    n.user.public_key = b"\x01" * 32
+    n.position.latitude_i = -123456789
+    n.position.time = 5
+    n.device_metrics.voltage = 3.3
+    return n
+
+
+def _telemetry() -> telemetry_pb2.Telemetry:
+    t = telemetry_pb2.Telemetry(time=7)
+    t.device_metrics.channel_utilization = 12.345
+    t.device_metrics.battery_level = 90
+    return t
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "message",
+    [_meshPacket(), _nodeInfo(), _telemetry(), mesh_pb2.RouteDiscovery(route=[1, 2], snr_towards=[3, -4, 5])],
+)
+def test_LazyMessageDict_matches_MessageToDict(message):
+    """Keys, values, ordering and the JSON form are all what MessageToDict gives"""
+    expected = MessageToDict(message)
+    assert LazyMessageDict(message) == expected
+    assert expected == LazyMessageDict(message)
+    assert list(LazyMessageDict(message)) == list(expected)
+    assert repr(LazyMessageDict(message)) == repr(expected)
+    assert json.dumps(LazyMessageDict(message)) == json.dumps(expected)
+    assert dict(LazyMessageDict(message)) == expected
+    assert {**LazyMessageDict(message)} == expected
+
+
+@pytest.mark.unit
+def test_LazyMessageDict_converts_on_first_access():
+    """Only the fields that are read get converted"""
+    d = LazyMessageDict(_meshPacket())
+    assert "decoded" in d and len(d) == len(MessageToDict(_meshPacket()))
+    assert not isinstance(dict.__getitem__(d, "decoded"), dict)
+    assert d["decoded"]["portnum"] == "TEXT_MESSAGE_APP"
+    decoded = dict.__getitem__(d, "decoded")
+    assert isinstance(decoded, LazyMessageDict)
+    assert decoded["portnum"] == "TEXT_MESSAGE_APP"
+    assert not isinstance(dict.__getitem__(decoded, "payload"), str)
+    assert d.get("fromId") is None
+    assert d.get("from") == 0xDEADBEEF
+
+
+@pytest.mark.unit
+def test_LazyMessageDict_is_mutable():
+    """Subscribers and receive handlers can add, replace and remove keys"""
+    d = LazyMessageDict(_meshPacket())
+    d["decoded"]["payload"] = b"hello"
+    d["decoded"]["text"] = "hello"
+    d["fromId"] = "!deadbeef"
+    assert d["decoded"] == {"portnum": "TEXT_MESSAGE_APP", "payload": b"hello", "text": "hello"}
+    assert d.pop("hopLimit") == 3
+    del d["rxSnr"]
+    assert d.setdefault("priority", "x") == "RELIABLE"
+    assert "hopLimit" not in d and "rxSnr" not in d
+    assert list(d)[-1] == "fromId"
+
+
+@pytest.mark.unit
+def test_LazyMessageDict_copies_are_plain_dicts():
+    """copy, deepcopy and pickle give fully converted plain dicts"""
+    expected = MessageToDict(_nodeInfo())
+    for c in (
+        LazyMessageDict(_nodeInfo()).copy(),
+        copy.copy(LazyMessageDict(_nodeInfo())),
+        copy.deepcopy(LazyMessageDict(_nodeInfo())),
+        pickle.loads(pickle.dumps(LazyMessageDict(_nodeInfo()))),
+    ):
+        assert type(c) is dict  # pylint: disable=C0123
+        assert c == expected
+
+
+@pytest.mark.unit
+def test_LazyMessageDict_concurrent_reads_share_one_conversion():
+    """Threads reading the same unconverted field at once all get the same object"""
+    d = LazyMessageDict(_meshPacket())
+    barrier = threading.Barrier(4)
+    seen = []
+    convertField = lazy_dict._convertField
+
+    def slowConvert(field, value):
+        barrier.wait(1)  # every thread converts before any stores its result
+        return convertField(field, value)
+
+    def read():
+        seen.append(d["decoded"])
+
+    with patch.object(lazy_dict, "_convertField", side_effect=slowConvert):
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert len(seen) == 4 and all(s is dict.__getitem__(d, "decoded") for s in seen)
+    seen[0]["text"] = "hello"
+    assert d["decoded"]["text"] == "hello"
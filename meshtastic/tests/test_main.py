@@ -526,8 +526,8 @@ def test_main_nodes(capsys):
 
     iface = MagicMock(autospec=SerialInterface)
 
-    def mock_showNodes(includeSelf, showFields):
-        print(f"inside mocked showNodes: {includeSelf} {showFields}")
+    def mock_showNodes(includeSelf, showFields, outputFormat, pageSize):
+        print(f"inside mocked showNodes: {includeSelf} {showFields} {outputFormat} {pageSize}")
 
     iface.showNodes.side_effect = mock_showNodes
     with patch("meshtastic.serial_interface.SerialInterface", return_value=iface) as mo:
@@ -539,6 +539,38 @@ def test_main_nodes(capsys):
         mo.assert_called()
 
 
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_main_nodes_format(capsys):
+    """Test --nodes --nodes-format csv --nodes-page-size 50"""
+    sys.argv = ["", "--nodes", "--nodes-format", "csv", "--nodes-page-size", "50"]
+    mt_config.args = sys.argv
+
+    iface = MagicMock(autospec=SerialInterface)
+    with patch("meshtastic.serial_interface.SerialInterface", return_value=iface) as mo:
+        main()
+        out, err = capsys.readouterr()
+        assert re.search(r"Connected to radio", out, re.MULTILINE)
+        iface.showNodes.assert_called_once_with(True, None, "csv", 50)
+        assert err == ""
+        mo.assert_called()
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+@pytest.mark.parametrize("size", ["0", "-5", "ten"])
+def test_main_nodes_page_size_must_be_positive(capsys, size):
+    """Test --nodes-page-size rejects sizes that can't page"""
+    sys.argv = ["", "--nodes", "--nodes-page-size", size]
+    mt_config.args = sys.argv
+
+    with pytest.raises(SystemExit) as pytest_wrapped_e:
+        main()
+    assert pytest_wrapped_e.value.code == 2
+    _, err = capsys.readouterr()
+    assert re.search(r"--nodes-page-size: must be a whole number of at least 1", err)
+
+
 @pytest.mark.unit
 @pytest.mark.usefixtures("reset_mt_config")
 def test_main_set_owner_to_bob(capsys):
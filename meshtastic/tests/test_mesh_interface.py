@@ -2,15 +2,18 @@
 
 import logging
 import re
+import time
 from unittest.mock import MagicMock, patch
 
 import pytest
 from hypothesis import given, strategies as st
 
-from ..protobuf import mesh_pb2, config_pb2
+from ..protobuf import mesh_pb2, config_pb2, portnums_pb2
 from .. import BROADCAST_ADDR, LOCAL_ADDR
+from ..dispatcher import InlineDispatcher
 from ..mesh_interface import MeshInterface, _timeago
 from ..node import Node
+from ..timer_wheel import TimerWheel
 try:
     # Depends upon the powermon group, not installed by default
     from ..slog import LogSet
@@ -142,6 +145,105 @@ def test_handlePacketFromRadio_no_portnum(caplog):
     assert re.search(r"Not populating fromId", caplog.text, re.MULTILINE)
 
 
+def _published(iface, meshPacket):
+    """Handle meshPacket and return the pubsub messages it published, by topic"""
+    iface.dispatcher = InlineDispatcher()
+    with patch("meshtastic.mesh_interface.pub") as mockPub:
+        iface._handlePacketFromRadio(meshPacket)
+    return {call.args[0]: call.kwargs for call in mockPub.sendMessage.call_args_list}
+
+
+def _positionPacket():
+    meshPacket = mesh_pb2.MeshPacket()
+    setattr(meshPacket, "from", 0x1234)
+    meshPacket.decoded.portnum = portnums_pb2.PortNum.POSITION_APP
+    meshPacket.decoded.payload = mesh_pb2.Position(latitude_i=10).SerializeToString()
+    return meshPacket
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_response_handler_expires():
+    """A handler nobody answers is given a TIMEOUT NAK and forgotten"""
+    iface = MeshInterface(noProto=True)
+    iface._responseDeadlines = TimerWheel(tick=0.01)
+    got = []
+    packet = iface.sendData(b"hi", wantResponse=True, onResponse=got.append, responseTimeout=0.02)
+    assert iface.responseHandlers[packet.id].deadline is not None
+    iface._sweepResponseHandlers()
+    assert not got
+    time.sleep(0.05)
+    iface._sweepResponseHandlers()
+    iface.close()
+    assert got[0]["decoded"]["requestId"] == packet.id
+    assert got[0]["decoded"]["routing"]["errorReason"] == "TIMEOUT"
+    assert not iface.responseHandlers and not iface._responseDeadlines
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_sendDataFuture():
+    """The future resolves to the reply, fails with TimeoutError without one, and forgets the request if cancelled"""
+    iface = MeshInterface(noProto=True)
+    iface.nodes = {}
+    iface.nodesByNum = {}
+    iface._responseDeadlines = TimerWheel(tick=0.01)
+    answered = iface.sendDataFuture(b"hi", wantAck=True)
+    ack = mesh_pb2.MeshPacket()
+    setattr(ack, "from", 0x1234)
+    ack.decoded.portnum = portnums_pb2.PortNum.ROUTING_APP
+    ack.decoded.request_id = answered.packet.id
+    ack.decoded.payload = mesh_pb2.Routing(error_reason=mesh_pb2.Routing.Error.NONE).SerializeToString()
+    iface._handlePacketFromRadio(ack)
+    assert answered.result(0)["decoded"]["routing"]["errorReason"] == "NONE"
+
+    ignored = iface.sendDataFuture(b"hi", wantResponse=True, responseTimeout=0.02)
+    time.sleep(0.05)
+    iface._sweepResponseHandlers()
+    with pytest.raises(TimeoutError):
+        ignored.result(0)
+
+    assert iface.sendDataFuture(b"hi", wantAck=True).cancel()
+    assert iface.sendDataFuture(b"hi").result(0) is None
+    iface.close()
+    assert not iface.responseHandlers and not iface._responseDeadlines
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_handlePacketFromRadio_publishRaw():
+    """With publishRaw set, packets are also published as protobufs"""
+    iface = MeshInterface(noProto=True)
+    iface.nodes = {}
+    iface.nodesByNum = {}
+    iface.publishRaw = True
+    meshPacket = _positionPacket()
+    published = _published(iface, meshPacket)
+    raw = published["meshtastic.raw.receive.position"]
+    assert raw["packet"] is meshPacket
+    assert raw["decoded"] == mesh_pb2.Position(latitude_i=10)
+    assert published["meshtastic.receive.position"]["packet"]["decoded"]["position"]["latitudeI"] == 10
+
+    meshPacket.decoded.portnum = portnums_pb2.PortNum.PRIVATE_APP
+    published = _published(iface, meshPacket)
+    assert published["meshtastic.raw.receive.data.PRIVATE_APP"]["decoded"] is None
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_handlePacketFromRadio_without_dicts():
+    """Clearing publishDicts skips the dictionary events, but still updates the node DB"""
+    iface = MeshInterface(noProto=True)
+    iface.nodes = {}
+    iface.nodesByNum = {}
+    iface.publishRaw = True
+    iface.publishDicts = False
+    published = _published(iface, _positionPacket())
+    assert [topic for topic in published if ".receive" in topic] == ["meshtastic.raw.receive.position"]
+    assert "meshtastic.node.changed" in published  # node DB events are not receive dictionaries
+    assert iface.nodesByNum[0x1234]["position"]["latitudeI"] == 10
+
+
 @pytest.mark.unit
 @pytest.mark.usefixtures("reset_mt_config")
 def test_getNode_with_local():
@@ -263,6 +365,26 @@ def test_handleFromRadio_with_my_info(caplog):
     assert re.search(r"my_node_num: 682584012", caplog.text, re.MULTILINE)
 
 
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_handleFromRadio_with_config_sections():
+    """Every config and module config section lands in the local node, unstorable ones are ignored"""
+    iface = MeshInterface(noProto=True)
+    fromRadio = mesh_pb2.FromRadio()
+    fromRadio.config.lora.hop_limit = 5
+    iface._handleFromRadio(fromRadio.SerializeToString())
+    fromRadio = mesh_pb2.FromRadio()
+    fromRadio.moduleConfig.traffic_management.enabled = True
+    iface._handleFromRadio(fromRadio.SerializeToString())
+    fromRadio = mesh_pb2.FromRadio()
+    fromRadio.config.sessionkey.SetInParent()
+    iface._handleFromRadio(fromRadio.SerializeToString())
+    iface.close()
+    assert iface.localNode.localConfig.lora.hop_limit == 5
+    assert iface.localNode.moduleConfig.traffic_management.enabled
+    assert [field.name for field, _ in iface.localNode.localConfig.ListFields()] == ["lora"]
+
+
 @pytest.mark.unit
 @pytest.mark.usefixtures("reset_mt_config")
 def test_handleFromRadio_with_node_info(caplog, capsys):
@@ -511,6 +633,36 @@ def test_sendPacket_with_destination_is_blank_without_nodes(caplog, iface_with_n
     assert re.search(r"Warning: There were no self.nodes.", caplog.text, re.MULTILINE)
 
 
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_resolveDestination_only_parses_node_ids(capsys):
+    """Names are looked up, only strings that look like node ids are parsed as hex"""
+    iface = MeshInterface(noProto=True)
+    node = {"num": 0x11223344, "user": {"id": "!11223344", "longName": "Base camp", "shortName": "abcd"}}
+    iface.nodes = {"!11223344": node}
+    iface.nodeIndex.update(node)
+    assert iface._resolveDestination("abcd") == 0x11223344
+    assert iface._resolveDestination("base camp") == 0x11223344
+    assert iface._resolveDestination("!1234abcd") == 0x1234ABCD
+    assert iface._resolveDestination("0x10") == 0x10
+    assert iface._resolveDestination("deadbeef") == 0xDEADBEEF
+    with pytest.raises(SystemExit):
+        iface._resolveDestination("Longname1")  # used to be taken as the hex "ongname1"
+    out, _ = capsys.readouterr()
+    assert "NodeId Longname1 not found in DB" in out
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_getNode_by_name():
+    """getNode hands the Node the number a name stands for"""
+    iface = MeshInterface(noProto=True)
+    iface.nodeIndex.update({"num": 0x11223344, "user": {"id": "!11223344", "shortName": "BOB"}})
+    with patch("meshtastic.node.Node") as node:
+        iface.getNode("bob", requestChannels=False)
+    node.assert_called_once_with(iface, 0x11223344, timeout=300)
+
+
 @pytest.mark.unit
 @pytest.mark.usefixtures("reset_mt_config")
 def test_getMyNodeInfo():
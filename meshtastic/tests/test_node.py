@@ -1815,6 +1815,23 @@ def test_set_favorite(favorite):
     iface.sendData.assert_called_once()
 
 
+@pytest.mark.unit
+def test_set_favorite_by_name():
+    """A node's name is looked up in the interface's node DB rather than parsed"""
+    iface = MagicMock(autospec=SerialInterface)
+    iface._lookupNodeNum.return_value = 502009325
+    node = Node(iface, 12345678)
+    amesg = admin_pb2.AdminMessage()
+    with patch("meshtastic.admin_pb2.AdminMessage", return_value=amesg):
+        node.setFavorite("abcd")
+    iface._lookupNodeNum.assert_called_once_with("abcd")
+    assert amesg.set_favorite_node == 502009325
+
+    iface._lookupNodeNum.return_value = None
+    with pytest.raises(SystemExit):
+        node.setFavorite("nobody")
+
+
 @pytest.mark.unit
 @pytest.mark.parametrize("favorite", ["!1dec0ded", 502009325])
 def test_remove_favorite(favorite):
@@ -0,0 +1,140 @@
+"""Meshtastic unit tests for node_cache.py"""
+
+from typing import List
+from unittest.mock import patch
+
+import pytest
+
+from .. import NODELESS_WANT_CONFIG_ID
+from ..mesh_interface import MeshInterface
+from ..node_cache import NodeCache
+from ..protobuf import mesh_pb2, portnums_pb2
+
+LOCAL = 0x11111111
+OTHER = 0x22222222
+GONE = 0x33333333
+
+
+def _nodeInfo(num: int, longName: str) -> bytes:
+    fromRadio = mesh_pb2.FromRadio()
+    fromRadio.node_info.num = num
+    fromRadio.node_info.user.id = f"!{num:08x}"
+    fromRadio.node_info.user.long_name = longName
+    return fromRadio.SerializeToString()
+
+
+def _connect(iface: MeshInterface, nodeInfos) -> int:
+    """Run a config exchange, returns the want_config_id we asked for"""
+    written: List[mesh_pb2.ToRadio] = []
+    with patch.object(iface, "_sendToRadioImpl", written.append):
+        iface._startConfig()
+        configId = written[-1].want_config_id
+        fromRadio = mesh_pb2.FromRadio()
+        fromRadio.my_info.my_node_num = LOCAL
+        iface._handleFromRadio(fromRadio.SerializeToString())
+        for nodeInfo in nodeInfos:
+            iface._handleFromRadio(nodeInfo)
+        fromRadio = mesh_pb2.FromRadio()
+        fromRadio.config_complete_id = configId
+        iface._handleFromRadio(fromRadio.SerializeToString())
+    return configId
+
+
+def _iface(cache: NodeCache) -> MeshInterface:
+    iface = MeshInterface(noProto=True, nodeCache=cache)
+    iface.noProto = False
+    return iface
+
+
+@pytest.mark.unit
+def test_NodeCache_round_trip(tmp_path):
+    """Saved nodes come back per radio, without the keys we don't cache"""
+    path = str(tmp_path / "nodes.db")
+    cache = NodeCache(path)
+    cache.save(LOCAL, [{"num": 1, "user": {"id": "!00000001"}, "lastReceived": {"raw": object()}}], downloaded=True)
+    cache.save(OTHER, [{"num": 2}])
+    cache.close()
+
+    cache = NodeCache(path, maxAge=60)
+    assert cache.load(LOCAL) == [{"num": 1, "user": {"id": "!00000001"}}]
+    assert cache.lastLocalNum() == OTHER
+    assert cache.isFresh(LOCAL) and not cache.isFresh(OTHER)
+    cache.maxAge = 0
+    assert not cache.isFresh(LOCAL)
+    cache.close()
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_cached_nodes_merged_with_download(tmp_path):
+    """Cached nodes are known before the radio sends them, and those it no longer has are dropped"""
+    cache = NodeCache(str(tmp_path / "nodes.db"), saveInterval=None)
+    iface = _iface(cache)
+    _connect(iface, [_nodeInfo(LOCAL, "Me"), _nodeInfo(OTHER, "Other"), _nodeInfo(GONE, "Gone")])
+    iface.close()
+
+    iface = _iface(cache)
+    with patch.object(iface, "_sendToRadioImpl"):
+        iface._startConfig()
+    assert iface.nodesByNum[OTHER]["user"]["longName"] == "Other"
+    assert iface.nodes["!33333333"]["num"] == GONE
+    assert iface.nodeIndex.lookup("other") == [OTHER]
+
+    _connect(iface, [_nodeInfo(LOCAL, "Me"), _nodeInfo(OTHER, "Renamed")])
+    assert iface.nodesByNum[OTHER]["user"]["longName"] == "Renamed"
+    assert GONE not in iface.nodesByNum and "!33333333" not in iface.nodes
+    assert not iface.nodeIndex.lookup("gone")
+    assert sorted(node["num"] for node in cache.load(LOCAL)) == [LOCAL, OTHER]
+    iface.close()
+    cache.close()
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_nodes_heard_on_the_mesh_are_cached(tmp_path):
+    """Nodes updated by NodeInfo and Position packets are saved without their protobufs"""
+    cache = NodeCache(str(tmp_path / "nodes.db"), saveInterval=None)
+    iface = _iface(cache)
+    _connect(iface, [_nodeInfo(LOCAL, "Me")])
+
+    user = mesh_pb2.User(id="!00000002", long_name="Two", short_name="TWO")
+    packet = mesh_pb2.MeshPacket(to=LOCAL, id=1, rx_time=100)
+    setattr(packet, "from", 2)
+    packet.decoded.portnum = portnums_pb2.PortNum.NODEINFO_APP
+    packet.decoded.payload = user.SerializeToString()
+    iface._handlePacketFromRadio(packet)
+
+    position = mesh_pb2.Position(latitude_i=515000000, longitude_i=-1000000)
+    packet = mesh_pb2.MeshPacket(to=LOCAL, id=2, rx_time=100)
+    setattr(packet, "from", 3)
+    packet.decoded.portnum = portnums_pb2.PortNum.POSITION_APP
+    packet.decoded.payload = position.SerializeToString()
+    iface._handlePacketFromRadio(packet)
+    iface._saveNodeCache()
+
+    nodes = {node["num"]: node for node in cache.load(LOCAL)}
+    assert nodes[2]["user"]["longName"] == "Two" and "raw" not in nodes[2]["user"]
+    assert nodes[3]["position"]["latitude"] == 51.5 and "raw" not in nodes[3]["position"]
+    iface.close()
+    cache.close()
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_fresh_cache_skips_download(tmp_path):
+    """While the cache is fresh we connect without asking for the node DB"""
+    cache = NodeCache(str(tmp_path / "nodes.db"), skipDownloadWhenFresh=True, saveInterval=None)
+    iface = _iface(cache)
+    assert _connect(iface, [_nodeInfo(LOCAL, "Me"), _nodeInfo(OTHER, "Other")]) != NODELESS_WANT_CONFIG_ID
+    iface.close()
+
+    iface = _iface(cache)
+    assert _connect(iface, [_nodeInfo(LOCAL, "Me")]) == NODELESS_WANT_CONFIG_ID
+    assert iface.nodesByNum[OTHER]["user"]["longName"] == "Other"
+    iface.close()
+
+    cache.maxAge = 0
+    iface = _iface(cache)
+    assert _connect(iface, [_nodeInfo(LOCAL, "Me")]) != NODELESS_WANT_CONFIG_ID
+    iface.close()
+    cache.close()
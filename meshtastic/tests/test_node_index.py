@@ -0,0 +1,68 @@
+"""Meshtastic unit tests for node_index.py"""
+
+import pytest
+
+from .. import _onNodeInfoReceive
+from ..mesh_interface import MeshInterface
+from ..node_index import NodeIndex
+
+
+def _node(num: int, longName: str, shortName: str, publicKey: str = "") -> dict:
+    user = {"id": f"!{num:08x}", "longName": longName, "shortName": shortName}
+    if publicKey:
+        user["publicKey"] = publicKey
+    return {"num": num, "user": user}
+
+
+@pytest.mark.unit
+def test_NodeIndex_lookup_by_every_key():
+    """Nodes are found by id, public key and (case insensitive) names"""
+    index = NodeIndex()
+    index.update(_node(0x1234ABCD, "Base Camp", "BC", publicKey="a2V5"))
+    for name in ("!1234abcd", "a2V5", "base camp", "BASE CAMP", "bc"):
+        assert index.lookup(name) == [0x1234ABCD]
+    assert not index.lookup("nobody")
+    assert index.byLow16(0xABCD) == [0x1234ABCD]
+
+
+@pytest.mark.unit
+def test_NodeIndex_update_replaces_old_keys():
+    """A renamed node is no longer found by its old name, and a forgotten one not at all"""
+    index = NodeIndex()
+    index.update(_node(1, "Old Name", "OLD"))
+    index.update(_node(1, "New Name", "NEW"))
+    assert not index.lookup("Old Name")
+    assert index.lookup("new name") == [1]
+    assert len(index) == 1
+    index.remove(1)
+    assert not index.lookup("!00000001")
+    assert not index.byLow16(1)
+
+
+@pytest.mark.unit
+def test_NodeIndex_ids_beat_names():
+    """Duplicate names return every match, but an id wins over another node's name"""
+    index = NodeIndex()
+    index.update(_node(1, "Relay", "RLY"))
+    index.update(_node(2, "Relay", "RL2"))
+    index.update(_node(3, "!00000001", "X"))
+    assert index.lookup("relay") == [1, 2]
+    assert index.lookup("!00000001") == [1]
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_sendData_to_a_name():
+    """Packets can be addressed by a name from NodeInfo, but not an ambiguous one"""
+    iface = MeshInterface(noProto=True)
+    iface.nodes = {}
+    iface.nodesByNum = {}
+    packet = {"from": 0x1234ABCD, "decoded": {"user": {"id": "!1234abcd", "longName": "Base Camp", "shortName": "BC"}}}
+    _onNodeInfoReceive(iface, packet)
+    assert iface.sendText("hi", destinationId="base camp").to == 0x1234ABCD
+
+    iface._getOrCreateByNum(0x5678ABCD)["user"] = {"shortName": "BC"}
+    iface.nodeIndex.update(iface.nodesByNum[0x5678ABCD])
+    with pytest.raises(SystemExit):
+        iface.sendText("hi", destinationId="BC")
+    iface.close()
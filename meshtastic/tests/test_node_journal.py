@@ -0,0 +1,67 @@
+"""Meshtastic unit tests for node_journal.py"""
+
+from unittest.mock import patch
+
+import pytest
+
+from .. import _onPositionReceive, _onTelemetryReceive
+from ..dispatcher import InlineDispatcher
+from ..mesh_interface import MeshInterface
+from ..node_journal import NodeJournal
+
+
+@pytest.mark.unit
+def test_NodeJournal_changes_since():
+    """Changes after a sequence number come back merged per node"""
+    journal = NodeJournal()
+    journal.record(1, {"num": 1, "snr": 1.0})
+    seq = journal.seq
+    journal.record(1, {"snr": 2.0})
+    journal.record(2, {"num": 2})
+    journal.record(1, {"lastHeard": 5})
+    journal.record(2, None)
+    assert journal.changesSince(seq) == {1: {"snr": 2.0, "lastHeard": 5}, 2: None}
+    assert [e.seq for e in journal.entriesSince(seq)] == [2, 3, 4, 5]
+    assert not journal.entriesSince(journal.seq)
+
+
+@pytest.mark.unit
+def test_NodeJournal_history_lost():
+    """Asking for changes the journal no longer has raises JournalError"""
+    journal = NodeJournal(maxEntries=2)
+    for i in range(3):
+        journal.record(i, {"num": i})
+    assert [e.num for e in journal.entriesSince(1)] == [1, 2]
+    with pytest.raises(NodeJournal.JournalError):
+        journal.entriesSince(0)
+    journal.reset()
+    with pytest.raises(NodeJournal.JournalError):
+        journal.entriesSince(2)
+    assert not journal.entriesSince(3)
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_received_packets_journaled():
+    """Positions and telemetry from the mesh are journaled and published, unchanged values are not"""
+    iface = MeshInterface(noProto=True)
+    iface.nodes = {}
+    iface.nodesByNum = {}
+    iface.dispatcher = InlineDispatcher()
+    with patch("meshtastic.mesh_interface.pub") as mockPub:
+        iface._getOrCreateByNum(7)
+        seq = iface.nodeJournal.seq
+        packet = {"from": 7, "decoded": {"position": {"latitudeI": 10000000, "longitudeI": 20000000}}}
+        _onPositionReceive(iface, packet)
+        _onPositionReceive(iface, packet)
+        _onTelemetryReceive(iface, {"from": 7, "decoded": {"telemetry": {"deviceMetrics": {"batteryLevel": 50}}}})
+    assert iface.nodeJournal.changesSince(seq) == {
+        7: {
+            "position": {"latitudeI": 10000000, "longitudeI": 20000000, "latitude": 1.0, "longitude": 2.0},
+            "deviceMetrics": {"batteryLevel": 50},
+        }
+    }
+    published = [call.kwargs for call in mockPub.sendMessage.call_args_list if call.args[0] == "meshtastic.node.changed"]
+    assert [p["seq"] for p in published] == [1, 2, 3]
+    assert published[2]["changes"] == {"deviceMetrics": {"batteryLevel": 50}}
+    iface.close()
@@ -0,0 +1,95 @@
+"""Meshtastic unit tests for node_record.py"""
+
+import copy
+import json
+import pickle
+import sys
+
+import pytest
+
+from .. import _receiveInfoUpdate
+from ..mesh_interface import MeshInterface
+from ..node_record import RETAIN_NONE, RETAIN_SUMMARY, NodeRecord, deepSizeOf, retainPacket
+
+NODE = {
+    "num": 2475227164,
+    "user": {"id": "!9388f81c", "longName": "Unknown f81c", "shortName": "?1C", "hwModel": "TBEAM"},
+    "position": {"latitude": 1.5, "longitude": 2.5},
+    "snr": 6.25,
+    "lastHeard": 1640206266,
+    "deviceMetrics": {"batteryLevel": 80},
+    "hopsAway": 1,
+    "isFavorite": False,
+    "hopLimit": 3,
+    "channel": 0,
+    "viaMqtt": True,
+    "somethingNew": "kept too",
+}
+
+
+@pytest.mark.unit
+def test_NodeRecord_behaves_like_its_dict():
+    """Reading, writing, comparing, copying and serializing match the plain dict"""
+    record = NodeRecord(NODE)
+    assert record == NODE and dict(record) == NODE and {**record} == NODE
+    assert isinstance(record, dict) and len(record) == len(NODE)
+    assert record["user"]["id"] == "!9388f81c" and record.get("localStats") is None
+    assert json.loads(json.dumps(record)) == NODE
+    assert json.loads(json.dumps(record, indent=2)) == NODE
+    assert copy.deepcopy(record) == NODE and pickle.loads(pickle.dumps(record)) == NODE
+
+    record.update(snr=1.0, other=2)
+    assert record["snr"] == 1.0 and record.pop("other") == 2
+    del record["position"]
+    assert "position" not in record
+    with pytest.raises(KeyError):
+        record["position"]  # pylint: disable=W0104
+    assert record.setdefault("position", {}) == {}
+
+
+@pytest.mark.unit
+def test_NodeRecord_is_smaller():
+    """A well populated node takes less memory than as a dict"""
+    assert sys.getsizeof(NodeRecord(NODE)) < sys.getsizeof(dict(NODE))
+    assert deepSizeOf(NodeRecord(NODE)) < deepSizeOf(dict(NODE))
+
+
+@pytest.mark.unit
+def test_retainPacket():
+    """Summaries drop the payload and protobufs, and "none" keeps nothing"""
+    packet = {"from": 1, "rxTime": 5, "raw": object(), "decoded": {"portnum": "TEXT_MESSAGE_APP", "payload": b"hi"}}
+    assert retainPacket(packet, RETAIN_SUMMARY) == {"from": 1, "rxTime": 5, "decoded": {"portnum": "TEXT_MESSAGE_APP"}}
+    assert retainPacket(packet, RETAIN_NONE) is None
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_lastReceived_summary_is_opt_in():
+    """A node's last packet is kept whole by default, just its summary if asked to save memory"""
+    iface = MeshInterface(noProto=True)
+    iface.nodes = {}
+    iface.nodesByNum = {}
+    packet = {"from": 7, "rxTime": 5, "raw": object(), "decoded": {"portnum": "TEXT_MESSAGE_APP", "payload": b"x" * 200}}
+    _receiveInfoUpdate(iface, packet)
+    assert iface.nodesByNum[7]["lastReceived"] == packet
+    iface.lastReceivedRetention = RETAIN_SUMMARY
+    _receiveInfoUpdate(iface, packet)
+    assert iface.nodesByNum[7]["lastReceived"] == {"from": 7, "rxTime": 5, "decoded": {"portnum": "TEXT_MESSAGE_APP"}}
+    iface.close()
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_node_db_uses_records():
+    """New nodes are NodeRecords, lastReceived follows the retention setting and memory can be measured"""
+    iface = MeshInterface(noProto=True)
+    iface.nodes = {}
+    iface.nodesByNum = {}
+    iface.lastReceivedRetention = RETAIN_SUMMARY
+    _receiveInfoUpdate(iface, {"from": 7, "rxTime": 5, "raw": object(), "decoded": {"portnum": "TEXT_MESSAGE_APP"}})
+    node = iface.nodesByNum[7]
+    assert isinstance(node, NodeRecord)
+    assert node["lastReceived"] == {"from": 7, "rxTime": 5, "decoded": {"portnum": "TEXT_MESSAGE_APP"}}
+    assert node["lastHeard"] == 5 and node["user"]["id"] == "!00000007"
+    assert iface.nodeDbMemory() > sys.getsizeof(iface.nodesByNum)
+    iface.close()
@@ -0,0 +1,121 @@
+"""Meshtastic unit tests for node_table.py"""
+
+import csv
+import json
+import re
+import time
+
+import pytest
+
+from ..mesh_interface import MeshInterface
+from ..node_table import DEFAULT_FIELDS, compileColumns, nodeRows, renderNodes, syntheticNodes
+
+NOW = 1700000000
+
+NODES = [
+    {
+        "num": 0x11223344,
+        "user": {"id": "!11223344", "longName": "Old", "shortName": "OLD", "hwModel": "TBEAM"},
+        "deviceMetrics": {"batteryLevel": 101, "channelUtilization": 12.345},
+        "position": {"latitude": 1.23456789, "altitude": 0},
+        "lastHeard": NOW - 7200,
+        "channel": 2,
+    },
+    {
+        "num": 0xAABBCCDD,
+        "deviceMetrics": {"batteryLevel": 57},
+        "snr": -3.4,
+        "lastHeard": NOW - 30,
+        "isFavorite": True,
+    },
+    {"num": 0x00000042, "user": "not a dict"},
+]
+
+
+@pytest.mark.unit
+def test_columns_format_like_showNodes():
+    """Each field is formatted as showNodes always has, "N" always comes first"""
+    columns = compileColumns(["user.shortName", "N", "since"], now=NOW)
+    assert [column.field for column in columns] == ["N", "user.shortName", "since"]
+    assert [column.header for column in columns] == ["N", "AKA", "Since"]
+
+    headers = [column.header for column in compileColumns(DEFAULT_FIELDS)]
+    new, old, bare = (dict(zip(headers, row)) for row in nodeRows(NODES, compileColumns(DEFAULT_FIELDS, now=NOW)))
+
+    assert old["Battery"] == "Powered" and new["Battery"] == "57%"
+    assert old["Channel util."] == "12.35%" and new["Channel util."] is None
+    assert old["Latitude"] == "1.2346°" and old["Altitude"] is None  # zero shows as missing
+    assert new["SNR"] == "-3 dB"
+    assert old["Channel"] == 2 and new["Channel"] == "0"
+    assert old["Fav"] == "" and new["Fav"] == "*"
+    assert old["AKA"] == "OLD" and new["AKA"] == "Meshtastic ccdd"
+    assert new["ID"] == "!aabbccdd" and bare["ID"] == "!00000042" and bare["User"] is None
+    assert old["LastHeard"] == time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(NOW - 7200))
+    assert old["Since"] == "2 hours ago" and new["Since"] == "30 secs ago" and bare["Since"] == "N/A"
+    assert bare["LastHeard"] is None
+
+
+@pytest.mark.unit
+def test_rows_sort_on_raw_lastHeard():
+    """Most recently heard first, never heard last, numbered from 1, whatever the columns"""
+    columns = compileColumns(["user.id", "position.nested.deeper"], now=NOW)
+    rows = list(nodeRows(NODES, columns))
+    assert rows == [[1, "!aabbccdd", None], [2, "!11223344", None], [3, "!00000042", None]]
+
+
+@pytest.mark.unit
+def test_render_csv_and_json():
+    """csv and json come a line at a time, parse back to the same rows, and hold raw values"""
+    chunks = list(renderNodes(NODES, ["user.longName", "snr"], fmt="csv", now=NOW))
+    assert len(chunks) == 4
+    assert list(csv.reader(chunks)) == [["N", "User", "SNR"], ["1", "", "-3.4"], ["2", "Old", ""], ["3", "", ""]]
+
+    fields = ["user.longName", "user.id", "hopsAway", "lastHeard", "since", "deviceMetrics.batteryLevel", "isFavorite"]
+    chunks = list(renderNodes(NODES, fields, fmt="json", now=NOW))
+    assert len(chunks) == 5
+    rows = json.loads("\n".join(chunks))
+    assert rows[0] == {
+        "N": 1,
+        "user.longName": None,
+        "user.id": None,
+        "hopsAway": None,
+        "lastHeard": NOW - 30,
+        "since": 30,
+        "deviceMetrics.batteryLevel": 57,
+        "isFavorite": True,
+    }
+    assert rows[1]["user.longName"] == "Old" and rows[1]["deviceMetrics.batteryLevel"] == 101
+    assert rows[2]["N"] == 3 and rows[2]["lastHeard"] is None and rows[2]["since"] is None
+    assert json.loads("\n".join(renderNodes([], fmt="json"))) == []
+
+    with pytest.raises(ValueError):
+        list(renderNodes(NODES, fmt="xml"))
+    with pytest.raises(ValueError):
+        list(renderNodes(NODES, fmt="table", pageSize=0))
+
+
+@pytest.mark.unit
+def test_render_table_pages():
+    """Tables come a page at a time with pageSize, all at once without"""
+    nodes = list(syntheticNodes(25).values())
+    whole = list(renderNodes(nodes, fmt="plain", now=NOW))
+    assert len(whole) == 1
+    pages = list(renderNodes(nodes, fmt="table", pageSize=10, now=NOW))
+    assert len(pages) == 3
+    assert all(page.startswith("╒") and " N │" in page for page in pages)
+    assert re.search(r"│\s+21 │", pages[2]) and not re.search(r"│\s+20 │", pages[2])
+    assert list(renderNodes([], fmt="table")) == [""]
+    assert not list(renderNodes([], fmt="table", pageSize=10))
+
+
+@pytest.mark.unit
+def test_showNodes_formats(capsys):
+    """showNodes prints each chunk as it's made and returns them all"""
+    iface = MeshInterface(noProto=True)
+    iface.nodesByNum = {node["num"]: node for node in NODES}
+    iface.localNode.nodeNum = 0xAABBCCDD
+    result = iface.showNodes(False, ["user.longName"], outputFormat="csv")
+    out, _ = capsys.readouterr()
+    assert result == "N,User\n1,Old\n2,"
+    assert out == result + "\n"
+    iface.close()
@@ -0,0 +1,148 @@
+"""Meshtastic unit tests for outbox.py"""
+
+import threading
+
+import pytest
+
+from ..mesh_interface import MeshInterface
+from ..outbox import Outbox
+from ..protobuf import mesh_pb2
+
+
+def _packet(packetId: int) -> mesh_pb2.ToRadio:
+    toRadio = mesh_pb2.ToRadio()
+    toRadio.packet.id = packetId
+    toRadio.packet.decoded.payload = b"hello"
+    return toRadio
+
+
+def _queueStatus(free: int, packetId: int = 0, res: int = 0) -> mesh_pb2.QueueStatus:
+    qs = mesh_pb2.QueueStatus()
+    qs.free = free
+    qs.maxlen = 16
+    qs.mesh_packet_id = packetId
+    qs.res = res
+    return qs
+
+
+@pytest.mark.unit
+def test_Outbox_persists_until_removed(tmp_path):
+    """Packets survive reopening the database, in order, until removed"""
+    path = str(tmp_path / "outbox.db")
+    outbox = Outbox(path, compactInterval=None)
+    for i in (3, 1, 2):
+        outbox.add(_packet(i))
+    outbox.remove([1])
+    outbox.close()
+
+    outbox = Outbox(path, compactInterval=None)
+    assert [(packetId, p.packet.decoded.payload) for packetId, p in outbox.pending()] == [(3, b"hello"), (2, b"hello")]
+    outbox.compact()
+    assert len(outbox) == 2
+    outbox.close()
+
+
+@pytest.mark.unit
+def test_Outbox_drops_after_max_attempts(tmp_path):
+    """A packet written maxAttempts times is not resent again"""
+    outbox = Outbox(str(tmp_path / "outbox.db"), maxAttempts=2, compactInterval=None)
+    outbox.add(_packet(1))
+    outbox.add(_packet(2))
+    outbox.attempted([1])
+    outbox.attempted([1])
+    outbox.attempted([2])
+    assert [packetId for packetId, _ in outbox.pending()] == [2]
+    assert len(outbox) == 1
+    outbox.close()
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_outbox_resends_after_restart(tmp_path):
+    """Packets the radio never confirmed are sent by the next interface using the outbox"""
+    path = str(tmp_path / "outbox.db")
+    iface = MeshInterface(noProto=True, outbox=Outbox(path, compactInterval=None))
+    iface.noProto = False
+    written = []
+    iface._sendToRadioImpl = written.append
+    iface._handleQueueStatusFromRadio(_queueStatus(free=8))
+    iface._sendToRadio(_packet(1))
+    iface._sendToRadio(_packet(2))
+    iface._handleQueueStatusFromRadio(_queueStatus(free=8, packetId=1))
+    assert [p.packet.id for p in written] == [1, 2]
+    iface.txScheduler.close()
+    iface.outbox.close()  # the process goes away before the radio confirms packet 2
+
+    iface = MeshInterface(noProto=True, outbox=Outbox(path, compactInterval=None))
+    iface.noProto = False
+    written = []
+    iface._sendToRadioImpl = written.append
+    iface._startConfig()
+    assert iface.txScheduler.flush(timeout=1)
+    assert not [p for p in written if p.HasField("packet")]  # not until we know which radio this is
+    iface._handleConfigComplete()
+    assert iface.txScheduler.flush(timeout=1)
+    assert [p.packet.id for p in written if p.HasField("packet")] == [2]
+    # old firmware never sends QueueStatus, so writing it is as good as it gets
+    assert len(iface.outbox) == 0
+    iface.txScheduler.close()
+    iface.outbox.close()
+
+
+class _UnlockedOutbox(Outbox):
+    """An Outbox that records whether the scheduler's condition was held by anyone when it was used"""
+
+    def __init__(self, path, cond):
+        super().__init__(path, compactInterval=None)
+        self.cond = cond
+        self.calls = []
+
+    def _free(self):
+        result = []
+
+        def probe():
+            # the condition's lock is reentrant, so it has to be tried from another thread
+            result.append(self.cond.acquire(timeout=0))
+            if result[0]:
+                self.cond.release()
+
+        thread = threading.Thread(target=probe)
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def add(self, toRadio):
+        self.calls.append(("add", self._free()))
+        super().add(toRadio)
+
+    def attempted(self, packetIds):
+        self.calls.append(("attempted", self._free()))
+        super().attempted(packetIds)
+
+    def remove(self, packetIds):
+        self.calls.append(("remove", self._free()))
+        super().remove(packetIds)
+
+    def pending(self):
+        self.calls.append(("pending", self._free()))
+        return super().pending()
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_outbox_is_written_without_the_scheduler_lock(tmp_path):
+    """Disk I/O never holds up threads queueing packets or handling QueueStatus"""
+    iface = MeshInterface(noProto=True)
+    iface.outbox = outbox = _UnlockedOutbox(str(tmp_path / "outbox.db"), iface.txScheduler._cond)
+    iface.noProto = False
+    iface._sendToRadioImpl = lambda toRadio: None
+    iface._handleQueueStatusFromRadio(_queueStatus(free=8))
+    iface._sendToRadio(_packet(1))
+    assert iface.txScheduler.flush(timeout=1)
+    iface._handleQueueStatusFromRadio(_queueStatus(free=8, packetId=1))
+    iface.txScheduler.restore()
+    assert [name for name, _ in outbox.calls] == ["add", "attempted", "remove", "pending"]
+    assert all(free for _, free in outbox.calls)
+    assert len(outbox) == 0
+    iface.txScheduler.close()
+    outbox.close()
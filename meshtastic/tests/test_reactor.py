@@ -0,0 +1,267 @@
+"""Meshtastic unit tests for reactor.py"""
+
+import socket
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from ..protobuf import channel_pb2, mesh_pb2
+from ..reactor import Reactor
+from ..stream_interface import START1, START2, StreamFramer, StreamInterface
+from ..tcp_interface import TCPInterface
+
+MY_NODE_NUM = 0x1234
+
+
+class FakeDevice:
+    """A minimal device on a local TCP port, answering want_config, one thread per connection"""
+
+    def __init__(self):
+        self.received = []
+        self.connections = []
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        """Stop listening and drop every connection"""
+        self.listener.close()
+        for conn in self.connections:
+            conn.close()
+
+    def dropConnections(self):
+        """Hang up on every client, as a rebooting radio would"""
+        for conn in self.connections:
+            conn.shutdown(socket.SHUT_RDWR)
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            self.connections.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    @staticmethod
+    def _send(conn, fromRadio):
+        b = fromRadio.SerializeToString()
+        conn.sendall(bytes([START1, START2, len(b) >> 8, len(b) & 0xFF]) + b)
+
+    def _serve(self, conn):
+        def onFrame(frame):
+            toRadio = mesh_pb2.ToRadio()
+            toRadio.ParseFromString(frame)
+            self.received.append(toRadio)
+            if toRadio.want_config_id:
+                f = mesh_pb2.FromRadio()
+                f.my_info.my_node_num = MY_NODE_NUM
+                self._send(conn, f)
+                f = mesh_pb2.FromRadio()
+                f.node_info.num = MY_NODE_NUM
+                self._send(conn, f)
+                f = mesh_pb2.FromRadio()
+                f.channel.role = channel_pb2.Channel.Role.PRIMARY
+                self._send(conn, f)
+                f = mesh_pb2.FromRadio()
+                f.config_complete_id = toRadio.want_config_id
+                self._send(conn, f)
+
+        framer = StreamFramer(onFrame, lambda b: None)
+        while True:
+            try:
+                data = conn.recv(4096)
+            except OSError:
+                return
+            if not data:
+                break
+            framer.feed(data)
+        conn.close()
+
+
+@pytest.fixture(name="device")
+def fixture_device():
+    """A FakeDevice, closed after the test"""
+    d = FakeDevice()
+    yield d
+    d.close()
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_reactor_serves_many_interfaces_without_threads_of_their_own(device):
+    """Several TCPInterfaces share the reactor's two threads"""
+    with Reactor() as reactor:
+        before = threading.active_count()
+        ifaces = [TCPInterface("127.0.0.1", portNumber=device.port, reactor=reactor) for _ in range(5)]
+        try:
+            assert len(reactor) == 5
+            for iface in ifaces:
+                assert iface.isConnected.is_set()
+                assert iface.myInfo.my_node_num == MY_NODE_NUM
+                assert not iface._rxThread.is_alive()
+                iface.sendData(b"hi")
+            # only the fake device's own per connection threads were added
+            assert threading.active_count() == before + len(ifaces)
+        finally:
+            for iface in ifaces:
+                iface.close()
+        assert len(reactor) == 0
+    payloads = [r.packet.decoded.payload for r in device.received if r.HasField("packet")]
+    assert payloads == [b"hi"] * 5
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_reactor_reconnects_dropped_connection(device):
+    """When the device hangs up the interface reconnects and downloads the config again"""
+    with Reactor() as reactor:
+        with TCPInterface("127.0.0.1", portNumber=device.port, reactor=reactor) as iface:
+            reconnected = threading.Event()
+            original = iface._startConfig
+
+            def startConfig():
+                original()
+                reconnected.set()
+
+            iface._startConfig = startConfig
+            device.dropConnections()
+            assert reconnected.wait(5)
+            iface.waitForConfig()
+            assert len(reactor) == 1
+    assert len([r for r in device.received if r.want_config_id]) == 2
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_reactor_reconnect_retries_off_reactor_threads(device):
+    """A failed reconnect is retried, on a thread of its own rather than the reactor's"""
+    with Reactor() as reactor:
+        with TCPInterface("127.0.0.1", portNumber=device.port, reactor=reactor) as iface:
+            reconnected = threading.Event()
+            attempts = []
+            originalConnect, originalStartConfig = iface.myConnect, iface._startConfig
+
+            def myConnect():
+                attempts.append(threading.current_thread().name)
+                if len(attempts) == 1:
+                    raise ConnectionRefusedError("radio still rebooting")
+                originalConnect()
+
+            def startConfig():
+                originalStartConfig()
+                reconnected.set()
+
+            iface.myConnect, iface._startConfig = myConnect, startConfig
+            with patch("meshtastic.tcp_interface.RECONNECT_RETRY_DELAY", 0.05):
+                device.dropConnections()
+                assert reconnected.wait(5)
+            iface.waitForConfig()
+            assert attempts == ["tcp reconnect", "tcp reconnect"]
+            assert len(reactor) == 1
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_reactor_paces_writes_without_sleeping():
+    """Without QueueStatus packets are still spaced by interFrameGap, but the I/O thread never sleeps"""
+    realSleep = time.sleep
+    sleepers = []
+    writes = []
+
+    def sleep(secs):
+        sleepers.append(threading.current_thread().name)
+        realSleep(secs)
+
+    with Reactor(name="paced") as reactor:
+        iface = StreamInterface(noProto=True, connectNow=False, reactor=reactor)
+        iface.noProto = False
+        iface.stream = MagicMock()
+        iface.stream.write.side_effect = lambda b: writes.append((time.monotonic(), threading.current_thread().name))
+        iface.interFrameGap = 0.1
+        with patch("time.sleep", side_effect=sleep):
+            for i in (1, 2, 3):
+                toRadio = mesh_pb2.ToRadio()
+                toRadio.packet.id = i
+                iface.txScheduler.enqueue(toRadio)
+            assert iface.txScheduler.flush(timeout=5)
+        iface.stream = None
+        iface.close()
+    assert [name for _, name in writes] == ["paced io"] * 3
+    assert all(b[0] - a[0] >= 0.09 for a, b in zip(writes, writes[1:]))
+    assert "paced io" not in sleepers
+
+
+def _silentPeer():
+    """A listening socket whose connections are accepted but never read, with a tiny receive window"""
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    accepted = []
+    threading.Thread(target=lambda: accepted.append(listener.accept()[0]), daemon=True).start()
+    return listener, accepted
+
+
+def _fillKernelBuffers(iface):
+    """Write until the kernel won't take more and the interface has to buffer"""
+    for _ in range(10000):
+        iface._writeBytes(b"x" * 4096)
+        if iface._sendBuffer:
+            return
+    raise AssertionError("The socket never filled up")
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_reactor_peer_that_never_reads(device, monkeypatch):
+    """A peer that stops reading holds up nothing but its own connection, which is then dropped"""
+    listener, accepted = _silentPeer()
+    with Reactor() as reactor:
+        healthy = TCPInterface("127.0.0.1", portNumber=device.port, reactor=reactor)
+        stuck = TCPInterface("127.0.0.1", portNumber=listener.getsockname()[1], noProto=True, connectNow=False, reactor=reactor)
+        stuck.myConnect()
+        reactor.register(stuck)
+        dropped = threading.Event()
+        with patch.object(stuck, "_reconnectSoon", side_effect=dropped.set):
+            start = time.monotonic()
+            _fillKernelBuffers(stuck)
+            healthy.sendData(b"still here")
+            assert healthy.txScheduler.flush(timeout=2)
+            deadline = time.monotonic() + 2
+            while b"still here" not in [r.packet.decoded.payload for r in device.received] and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert b"still here" in [r.packet.decoded.payload for r in device.received]
+
+            # more than it may buffer drops the connection at once
+            with pytest.raises(OSError):
+                for _ in range(1000):
+                    stuck._writeBytes(b"x" * 65536)
+            assert dropped.is_set() and not stuck._sendBuffer
+            assert time.monotonic() - start < 5  # nothing ever blocked
+
+            # and so does reading nothing for too long
+            dropped.clear()
+            monkeypatch.setattr("meshtastic.tcp_interface.SEND_STALL_TIMEOUT", 0.2)
+            _fillKernelBuffers(stuck)
+            assert dropped.wait(2) and not stuck._sendBuffer
+        stuck.close()
+        healthy.close()
+    listener.close()
+    for conn in accepted:
+        conn.close()
+
+
+@pytest.mark.unit
+def test_reactor_callLater():
+    """Timers run in deadline order on the timer thread, and can be cancelled"""
+    ran = []
+    done = threading.Event()
+    with Reactor() as reactor:
+        reactor.callLater(0.05, lambda: (ran.append(2), done.set()))
+        reactor.callLater(0.01, lambda: ran.append(1))
+        reactor.callLater(0.02, lambda: ran.append("cancelled")).cancel()
+        assert done.wait(1)
+    assert ran == [1, 2]
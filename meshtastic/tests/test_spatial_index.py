@@ -0,0 +1,61 @@
+"""Meshtastic unit tests for spatial_index.py"""
+
+import random
+
+import pytest
+
+from .. import _onPositionReceive
+from ..mesh_interface import MeshInterface
+from ..protobuf import mesh_pb2
+from ..spatial_index import SpatialIndex, bearing, distance
+
+
+@pytest.mark.unit
+def test_distance_and_bearing():
+    """One degree of latitude is about 111 km, due north"""
+    assert distance(0, 0, 1, 0) == pytest.approx(111195, rel=1e-3)
+    assert bearing(0, 0, 1, 0) == pytest.approx(0)
+    assert bearing(0, 0, 0, 1) == pytest.approx(90)
+    assert distance(0, 179.5, 0, -179.5) == pytest.approx(111195, rel=1e-3)
+
+
+@pytest.mark.unit
+def test_SpatialIndex_matches_brute_force():
+    """Nearest, radius and box queries agree with checking every node, poles and antimeridian included"""
+    rng = random.Random(4)
+    index = SpatialIndex(cellSize=1.0)
+    positions = {}
+    for num in range(2000):
+        positions[num] = (rng.uniform(-90, 90), rng.uniform(-180, 180))
+        index.update(num, *positions[num])
+    index.update(0, 10.0, 10.0)  # moving a node
+    positions[0] = (10.0, 10.0)
+    index.remove(1)
+    del positions[1]
+    assert len(index) == 1999
+
+    for lat, lon in ((10.0, 10.0), (0.0, 179.9), (89.7, 45.0), (-60.0, -179.0)):
+        byDistance = sorted((distance(lat, lon, *p), num) for num, p in positions.items())
+        assert index.nearest(lat, lon, k=5) == byDistance[:5]
+        assert index.withinRadius(lat, lon, 800000) == [x for x in byDistance if x[0] <= 800000]
+        assert index.nearest(lat, lon, k=5, maxDistance=1) == [x for x in byDistance[:5] if x[0] <= 1]
+
+    inBox = sorted(num for num, (lat, lon) in positions.items() if -20 <= lat <= 20 and (lon >= 160 or lon <= -170))
+    assert sorted(index.withinBox(-20, 160, 20, -170)) == inBox
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_positions_indexed():
+    """Received positions are indexed, and distance and bearing from our node follow"""
+    iface = MeshInterface(noProto=True)
+    iface.nodes = {}
+    iface.nodesByNum = {}
+    iface.myInfo = mesh_pb2.MyNodeInfo(my_node_num=1)
+    _onPositionReceive(iface, {"from": 1, "decoded": {"position": {"latitudeI": 0, "longitudeI": 0}}})
+    _onPositionReceive(iface, {"from": 2, "decoded": {"position": {"latitudeI": 10000000, "longitudeI": 0}}})
+    assert iface.spatialIndex.nearest(0.9, 0.0) == [(pytest.approx(11119.5, rel=1e-3), 2)]
+    meters, degrees = iface.distanceAndBearing("!00000002")
+    assert meters == pytest.approx(111195, rel=1e-3) and degrees == pytest.approx(0)
+    assert iface.distanceAndBearing(3) is None
+    iface.close()
@@ -1,15 +1,37 @@
 """Meshtastic unit tests for stream_interface.py"""
 
 import logging
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 import pytest
 
-from ..stream_interface import StreamInterface
+from ..protobuf import mesh_pb2
+from ..stream_interface import (
+    HEADER_LEN,
+    MAX_TO_FROM_RADIO_SIZE,
+    READ_CHUNK_SIZE,
+    START1,
+    START2,
+    StreamFramer,
+    StreamInterface,
+)
 
 # import re
 
 
+def _frame(payload: bytes) -> bytes:
+    """Add the stream header to a payload"""
+    return bytes([START1, START2, (len(payload) >> 8) & 0xFF, len(payload) & 0xFF]) + payload
+
+
+def _collecting_framer():
+    """A StreamFramer that records the frames and noise it emits"""
+    frames = []
+    noise = []
+    framer = StreamFramer(lambda f: frames.append(bytes(f)), noise.append)
+    return framer, frames, noise
+
+
 @pytest.mark.unit
 def test_StreamInterface():
     """Test that we cannot instantiate a StreamInterface based on noProto"""
@@ -126,6 +148,92 @@ def test_StreamInterface_init_cleanup_does_not_shadow_original_exception():
         CleanupRaisesStream()
 
 
+@pytest.mark.unit
+def test_StreamFramer_multiple_frames_in_one_chunk():
+    """All complete frames in a single read are dispatched in order"""
+    framer, frames, noise = _collecting_framer()
+    framer.feed(_frame(b"one") + _frame(b"") + _frame(b"three"))
+    assert frames == [b"one", b"", b"three"]
+    assert not noise
+    assert len(framer) == 0
+
+
+@pytest.mark.unit
+def test_StreamFramer_frame_split_across_reads():
+    """A frame is only dispatched once its last byte has arrived"""
+    framer, frames, _ = _collecting_framer()
+    data = _frame(b"hello world")
+    for i in range(len(data) - 1):
+        framer.feed(data[i:i + 1])
+        assert not frames
+    framer.feed(data[-1:])
+    assert frames == [b"hello world"]
+    assert len(framer) == 0
+
+
+@pytest.mark.unit
+def test_StreamFramer_log_output_between_frames():
+    """Bytes outside of a frame are reported as noise"""
+    framer, frames, noise = _collecting_framer()
+    framer.feed(b"DEBUG boot\n" + _frame(b"pkt") + b"INFO done\n")
+    assert frames == [b"pkt"]
+    assert b"".join(noise) == b"DEBUG boot\nINFO done\n"
+
+
+@pytest.mark.unit
+def test_StreamFramer_resyncs_after_bad_header():
+    """A START1 without START2, or an impossible length, does not lose the next frame"""
+    framer, frames, _ = _collecting_framer()
+    toolong = MAX_TO_FROM_RADIO_SIZE + 1
+    bad = bytes([START1, 0x00]) + bytes([START1, START2, toolong >> 8, toolong & 0xFF])
+    framer.feed(bad + _frame(b"ok"))
+    assert frames == [b"ok"]
+
+
+@pytest.mark.unit
+def test_StreamFramer_frame_view_is_released():
+    """The view handed to onFrame can not outlive the callback"""
+    views = []
+    framer = StreamFramer(views.append, lambda b: None)
+    framer.feed(_frame(b"abc") + bytes([START1, START2]))
+    assert len(views) == 1
+    with pytest.raises(ValueError):
+        bytes(views[0])
+    # the partial header is kept, and the buffer can still be resized
+    assert len(framer) == HEADER_LEN - 2
+    framer.feed(bytes([0, 1]) + b"x")
+    assert len(framer) == 0
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_StreamInterface_handleLogBytes():
+    """Log output is split into lines even when a read ends mid-line"""
+    iface = StreamInterface(noProto=True, connectNow=False)
+    lines = []
+    iface._handleLogLine = lines.append
+    iface._handleLogBytes(b"first\r\nsec")
+    iface._handleLogBytes(b"ond \xe2\x9c")
+    iface._handleLogBytes(b"\x93\n")
+    assert lines == ["first", "second \u2713"]
+    assert iface.cur_log_line == ""
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_StreamInterface_readChunkSize():
+    """The reader asks for whatever is waiting, capped, or blocks for a single byte"""
+    iface = StreamInterface(noProto=True, connectNow=False)
+    assert iface._readChunkSize() == 1
+    iface.stream = MagicMock()
+    iface.stream.in_waiting = 0
+    assert iface._readChunkSize() == 1
+    iface.stream.in_waiting = 37
+    assert iface._readChunkSize() == 37
+    iface.stream.in_waiting = 1 << 20
+    assert iface._readChunkSize() == READ_CHUNK_SIZE
+
+
 # Note: This takes a bit, so moving from unit to slow
 @pytest.mark.unitslow
 @pytest.mark.usefixtures("reset_mt_config")
@@ -190,3 +298,47 @@ def test_StreamInterface_with_noProto(caplog):
 #        assert re.search(r'Sending: ', caplog.text, re.MULTILINE)
 #        assert re.search(r'reading character', caplog.text, re.MULTILINE)
 #        assert re.search(r'In reader loop', caplog.text, re.MULTILINE)
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_StreamInterface_sendManyToRadioImpl_coalesces():
+    """Several ToRadio frames are written with a single stream write"""
+    iface = StreamInterface(noProto=True, connectNow=False)
+    iface.stream = MagicMock()
+    iface.queueStatus = mesh_pb2.QueueStatus()
+    packets = []
+    for i in (1, 2, 3):
+        toRadio = mesh_pb2.ToRadio()
+        toRadio.packet.id = i
+        packets.append(toRadio)
+    iface._sendManyToRadioImpl(packets)
+    iface.stream.write.assert_called_once_with(
+        b"".join(_frame(p.SerializeToString()) for p in packets)
+    )
+    iface.stream = None
+    iface.close()
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_StreamInterface_writes_paced_without_queueStatus():
+    """Without QueueStatus feedback writes are spaced by interFrameGap, with it they are not"""
+    iface = StreamInterface(noProto=True, connectNow=False)
+    iface.stream = MagicMock()
+    iface.interFrameGap = 5.0
+    with patch("time.sleep") as mock_sleep:
+        iface._writeBytes(b"a")
+        mock_sleep.assert_not_called()  # nothing written recently
+        iface._writeBytes(b"b")
+        mock_sleep.assert_called_once()
+        assert mock_sleep.call_args[0][0] == pytest.approx(5.0, abs=0.5)
+
+    iface._nextWriteTime = 0.0
+    iface.queueStatus = mesh_pb2.QueueStatus()
+    with patch("time.sleep") as mock_sleep:
+        iface._writeBytes(b"c")
+        iface._writeBytes(b"d")
+        mock_sleep.assert_not_called()
+    iface.stream = None
+    iface.close()
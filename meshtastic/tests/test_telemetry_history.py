@@ -0,0 +1,108 @@
+"""Meshtastic unit tests for telemetry_history.py"""
+
+import math
+
+import pytest
+
+from .. import _onTelemetryReceive
+from ..mesh_interface import MeshInterface
+from ..telemetry_history import TelemetryHistory, TelemetrySeries
+
+
+@pytest.mark.unit
+def test_TelemetrySeries_keeps_the_latest():
+    """Only the last capacity samples are kept, oldest first, with NaN for missing metrics"""
+    series = TelemetrySeries(capacity=4)
+    for t in range(6):
+        metrics = {"batteryLevel": 100 - t, "note": "ignored"}
+        if t % 2:
+            metrics["voltage"] = 4.0
+        series.append(1000 + t, metrics)
+    assert len(series) == 4 and series.fields == ["batteryLevel", "voltage"]
+    assert series.samples("batteryLevel") == [(1002, 98), (1003, 97), (1004, 96), (1005, 95)]
+    assert series.samples("voltage") == [(1003, 4.0), (1005, 4.0)]
+
+    views = series.views()
+    assert views["time"].tolist() == [1002, 1003, 1004, 1005]
+    assert math.isnan(views["voltage"][0])
+    series.append(1006, {"batteryLevel": 94})
+    assert series.samples("batteryLevel")[-1] == (1006, 94)
+    assert views["batteryLevel"].tolist() == [94, 97, 96, 95]  # views see our buffers, not a copy
+
+
+@pytest.mark.unit
+def test_TelemetrySeries_keeps_counters_exact():
+    """Counters past float32's 2**24 come back as they went in"""
+    series = TelemetrySeries(capacity=2)
+    series.append(1, {"uptimeSeconds": 123456789, "numPacketsRx": 16777217})
+    assert series.samples("uptimeSeconds") == [(1, 123456789)]
+    assert series.samples("numPacketsRx") == [(1, 16777217)]
+
+
+@pytest.mark.unit
+def test_TelemetrySeries_aggregates():
+    """Rolling stats cover the window, downsampling one value per bucket"""
+    series = TelemetrySeries()
+    for t, value in ((0, 1.0), (10, 3.0), (20, 5.0), (30, 7.0)):
+        series.append(t, {"voltage": value})
+    assert series.rolling("voltage", 15, now=30) == {"count": 2, "mean": 6.0, "min": 5.0, "max": 7.0, "last": 7.0}
+    assert series.rolling("voltage", 15, now=100)["count"] == 0
+    assert series.downsample("voltage", 20) == [(0, 2.0), (20, 6.0)]
+    assert series.downsample("voltage", 20, how="max") == [(0, 3.0), (20, 7.0)]
+    with pytest.raises(ValueError):
+        series.downsample("voltage", 20, how="median")
+
+
+@pytest.mark.unit
+def test_TelemetrySeries_numpy():
+    """toNumpy() wraps our buffers"""
+    np = pytest.importorskip("numpy")
+    series = TelemetrySeries(capacity=2)
+    series.append(1, {"voltage": 3.5})
+    arrays = series.toNumpy()
+    assert arrays["time"].dtype == np.float64 and arrays["voltage"].tolist() == [3.5]
+    assert arrays["voltage"].dtype == np.float64
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_received_telemetry_recorded():
+    """Telemetry packets are kept per node and kind, once there is a history to keep them in"""
+    iface = MeshInterface(noProto=True)
+    iface.nodes = {}
+    iface.nodesByNum = {}
+    assert iface.telemetryHistory is None
+    iface.telemetryHistory = TelemetryHistory()
+    for t, level in ((100, 90), (200, 80)):
+        packet = {"from": 7, "rxTime": t, "decoded": {"telemetry": {"deviceMetrics": {"batteryLevel": level}}}}
+        _onTelemetryReceive(iface, packet)
+    assert iface.telemetryHistory.kinds(7) == ["deviceMetrics"]
+    assert iface.telemetryHistory.series(7, "deviceMetrics").samples("batteryLevel") == [(100, 90), (200, 80)]
+    assert iface.nodesByNum[7]["deviceMetrics"] == {"batteryLevel": 80}
+    iface.close()
+
+
+@pytest.mark.unit
+def test_TelemetryHistory_remove():
+    """Forgetting a node drops all of its series"""
+    history = TelemetryHistory()
+    history.record(1, "deviceMetrics", {"voltage": 4.0}, 1)
+    history.record(1, "environmentMetrics", {"temperature": 20.0}, 1)
+    history.record(2, "deviceMetrics", {"voltage": 4.0}, 1)
+    history.remove(1)
+    assert history.series(1, "deviceMetrics") is None and len(history) == 1
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_history_can_be_turned_off():
+    """With telemetryHistory None, telemetry still updates the node and nodes can still be dropped"""
+    iface = MeshInterface(noProto=True)
+    iface.nodes = {}
+    iface.nodesByNum = {}
+    _onTelemetryReceive(iface, {"from": 7, "rxTime": 1, "decoded": {"telemetry": {"deviceMetrics": {"voltage": 4.0}}}})
+    assert iface.nodesByNum[7]["deviceMetrics"] == {"voltage": 4.0}
+    iface._nodeCacheUnconfirmed = {7}
+    iface._dropUnconfirmedNodes()
+    assert 7 not in iface.nodesByNum
+    iface.close()
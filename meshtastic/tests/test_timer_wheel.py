@@ -0,0 +1,47 @@
+"""Meshtastic unit tests for timer_wheel.py"""
+
+import pytest
+
+from ..timer_wheel import TimerWheel
+
+
+@pytest.mark.unit
+def test_TimerWheel_expires_due_keys():
+    """Keys come out once their deadline has passed, not before, and only once"""
+    w = TimerWheel(tick=1.0, slots=8)
+    now = w._lastTick * 1.0
+    w.add("a", now + 2.5)
+    w.add("b", now + 1.2)
+    w.add("c", now + 100)  # many laps away, shares a slot with nearer ones
+    assert not w.expire(now + 1.5)
+    assert w.expire(now + 2.0) == ["b"]
+    assert w.expire(now + 3.0) == ["a"]
+    assert not w.expire(now + 3.0)
+    assert len(w) == 1 and "c" in w
+    assert w.expire(now + 1000) == ["c"]
+    assert len(w) == 0
+
+
+@pytest.mark.unit
+def test_TimerWheel_cancel_and_replace():
+    """Cancelled keys never expire, adding a key again moves its deadline"""
+    w = TimerWheel(tick=1.0, slots=8)
+    now = w._lastTick * 1.0
+    w.add("a", now + 1)
+    w.add("b", now + 1)
+    assert w.cancel("a")
+    assert not w.cancel("a")
+    w.add("b", now + 5)
+    assert not w.expire(now + 4)
+    assert w.expire(now + 5) == ["b"]
+
+
+@pytest.mark.unit
+def test_TimerWheel_past_deadline():
+    """A deadline already in the past expires on the next sweep"""
+    w = TimerWheel(tick=1.0, slots=8)
+    now = w._lastTick * 1.0
+    w.expire(now + 10)
+    w.add("late", now)
+    assert not w.expire(now + 10)  # the sweep already covered that tick
+    assert w.expire(now + 11) == ["late"]
@@ -0,0 +1,124 @@
+"""Meshtastic unit tests for topology.py"""
+
+import random
+from unittest.mock import patch
+
+import pytest
+
+from ..mesh_interface import MeshInterface
+from ..protobuf import mesh_pb2, portnums_pb2
+from ..topology import PRUNE_EVERY, MeshGraph
+
+
+def _components(links, without=None):
+    """Connected components by brute force, leaving out node without"""
+    nodes = {n for link in links for n in link} - {without}
+    groups = []
+    while nodes:
+        group, stack = set(), [nodes.pop()]
+        while stack:
+            n = stack.pop()
+            group.add(n)
+            for a, b in links:
+                for x, y in ((a, b), (b, a)):
+                    if x == n and y != without and y not in group:
+                        stack.append(y)
+                        nodes.discard(y)
+        groups.append(group)
+    return groups
+
+
+@pytest.mark.unit
+def test_MeshGraph_paths_prefer_strong_links():
+    """Two good hops beat one bad one, and hop limits follow the path"""
+    graph = MeshGraph()
+    graph.addLink(1, 3, snr=-20.0)
+    graph.addRoute([1, 2, 3], [10.0, 8.0])
+    assert graph.shortestPath(1, 3) == [1, 2, 3]
+    assert graph.shortestPath(3, 1) == [3, 2, 1]
+    assert graph.hopLimitFor(1, 3) == 2
+    assert graph.hopLimitFor(1, 2, margin=0) == 0
+    assert graph.shortestPath(1, 99) is None
+    assert graph.neighbors(3) == {1: -20.0, 2: 8.0}
+
+
+@pytest.mark.unit
+def test_MeshGraph_structure_matches_brute_force():
+    """Components and articulation points agree with removing each node in turn"""
+    rng = random.Random(2)
+    graph = MeshGraph()
+    links = set()
+    for _ in range(60):
+        a, b = rng.sample(range(40), 2)
+        links.add((a, b))
+        graph.addLink(a, b, snr=rng.uniform(-15, 10))
+    components = _components(links)
+    assert sorted(map(sorted, graph.components())) == sorted(map(sorted, components))
+    cuts = set()
+    for n in graph.nodes():
+        if len(_components(links, without=n)) > len(components):
+            cuts.add(n)
+    assert graph.articulationPoints() == cuts
+
+
+@pytest.mark.unit
+def test_MeshGraph_forgets_old_links():
+    """Links not seen within maxAge are dropped"""
+    graph = MeshGraph(maxAge=10)
+    with patch("time.monotonic", return_value=100.0):
+        graph.addLink(1, 2)
+    with patch("time.monotonic", return_value=105.0):
+        graph.addLink(2, 3)
+    with patch("time.monotonic", return_value=112.0):
+        assert graph.shortestPath(1, 3) is None and graph.nodes() == {2, 3}
+
+
+@pytest.mark.unit
+def test_MeshGraph_prunes_while_adding():
+    """Old links are dropped as new ones arrive, even if the graph is never queried"""
+    graph = MeshGraph(maxAge=10)
+    with patch("time.monotonic", return_value=100.0):
+        for i in range(PRUNE_EVERY - 1):
+            graph.addLink(1, i + 2)
+    with patch("time.monotonic", return_value=200.0):
+        graph.addLink(5000, 5001)
+    assert graph._links.keys() == {(5000, 5001)}
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_graph_learned_from_packets():
+    """NeighborInfo and traceroute responses add links, which autoHopLimit then uses"""
+    iface = MeshInterface(noProto=True)
+    iface.nodes = {}
+    iface.nodesByNum = {}
+    iface.myInfo = mesh_pb2.MyNodeInfo(my_node_num=1)
+
+    info = mesh_pb2.NeighborInfo(node_id=3)
+    info.neighbors.add(node_id=4, snr=6.5)
+    packet = mesh_pb2.MeshPacket(to=0xFFFFFFFF)
+    setattr(packet, "from", 3)
+    packet.decoded.portnum = portnums_pb2.PortNum.NEIGHBORINFO_APP
+    packet.decoded.payload = info.SerializeToString()
+    iface._handlePacketFromRadio(packet)
+
+    discovery = mesh_pb2.RouteDiscovery(route=[2], snr_towards=[40, 24], route_back=[2], snr_back=[20, 32])
+    packet = mesh_pb2.MeshPacket(to=1, hop_start=3)
+    setattr(packet, "from", 3)
+    packet.decoded.portnum = portnums_pb2.PortNum.TRACEROUTE_APP
+    packet.decoded.request_id = 1234
+    packet.decoded.payload = discovery.SerializeToString()
+    iface._handlePacketFromRadio(packet)
+
+    assert iface.meshGraph.shortestPath(1, 4) == [1, 2, 3, 4]
+    assert iface.meshGraph.neighbors(2) == {1: 10.0, 3: 6.0}
+    assert iface.meshGraph.articulationPoints() == {2, 3}
+
+    iface.localNode.localConfig.lora.hop_limit = 7
+    iface.myInfo = None  # so sending doesn't wait for a connection
+    assert iface.sendData(b"x", destinationId=4).hop_limit == 7
+    iface.myInfo = mesh_pb2.MyNodeInfo(my_node_num=1)
+    iface.autoHopLimit = True
+    with patch.object(iface, "_waitConnected"):
+        assert iface.sendData(b"x", destinationId=4).hop_limit == 3
+    iface.close()
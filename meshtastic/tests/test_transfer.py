@@ -0,0 +1,136 @@
+"""Meshtastic unit tests for transfer.py"""
+
+import concurrent.futures
+from typing import Any, List, Tuple
+
+import pytest
+
+from ..mesh_interface import MeshInterface
+from ..protobuf import mesh_pb2
+from ..transfer import FRAGMENT_SIZE, KIND_FRAGMENT, TRANSFER_PORTNUM, Transfers
+
+
+class FakeLink:
+    """Two Transfers wired to each other, delivering what they send in order (unless dropped) on run()"""
+
+    def __init__(self, **kwargs) -> None:
+        self.a = Transfers(self._Iface(self, 1), **kwargs)
+        self.b = Transfers(self._Iface(self, 2), **kwargs)
+        self.sent: List[Tuple[int, bytes]] = []  # (from, payload)
+        self.drop = lambda sender, payload: False
+        self.received: List[Tuple[str, Any, dict]] = []
+        self.inFlight: List[Tuple[Transfers, mesh_pb2.MeshPacket]] = []  # not yet delivered
+
+    def run(self) -> None:
+        """Deliver everything in flight, including what is sent in reply, until the link is quiet"""
+        while self.inFlight:
+            transfers, p = self.inFlight.pop(0)
+            transfers.onPacket(p)
+
+    class _Iface:
+        def __init__(self, link, num) -> None:
+            self.link = link
+            self.num = num
+
+        def sendData(self, payload, destinationId, *, portNum, channelIndex, priority, wait):  # pylint: disable=W0613
+            """Put payload in flight to the other end, unless the link's drop() says otherwise"""
+            assert portNum == TRANSFER_PORTNUM and not wait
+            self.link.sent.append((self.num, payload))
+            if self.link.drop(self.num, payload):
+                return
+            p = mesh_pb2.MeshPacket()
+            setattr(p, "from", self.num)
+            p.decoded.payload = payload
+            p.decoded.portnum = portNum
+            self.link.inFlight.append((self.link.b if self.num == 1 else self.link.a, p))
+
+        def _callLater(self, delay, callback):  # pylint: disable=W0613
+            return concurrent.futures.Future()  # cancellable, never runs: tests sweep by hand
+
+        def _publish(self, topic, sender=None, **kwargs):
+            self.link.received.append((topic, sender, kwargs))
+
+        def _nodeNumToId(self, num, isDest=True):  # pylint: disable=W0613
+            return f"!{num:08x}"
+
+    def fragmentsSent(self):
+        """The fragments (rather than acks or cancels) the first end sent"""
+        return [p for sender, p in self.sent if sender == 1 and p[0] == KIND_FRAGMENT]
+
+
+@pytest.mark.unit
+def test_transfer_round_trip():
+    """A payload of many fragments arrives whole, and the sender hears about it"""
+    link = FakeLink()
+    data = bytes(range(256)) * 40
+    future = link.a.send(data, 2)
+    link.run()
+    assert future.result(timeout=0) > 0
+    assert link.received == [
+        ("meshtastic.transfer.received", 1, {"data": data, "fromId": "!00000001", "transferId": future.result()})
+    ]
+    assert len(link.fragmentsSent()) == -(-len(data) // FRAGMENT_SIZE)
+    assert not link.a._outgoing and not link.b._incoming
+
+
+@pytest.mark.unit
+def test_transfer_resends_only_lost_fragments():
+    """Fragments reported missing are resent, the ones that arrived are not"""
+    link = FakeLink(window=8, ackEvery=4)
+    lost = {2, 5}
+
+    def drop(sender, payload):
+        if sender == 1 and payload[0] == KIND_FRAGMENT:
+            index = int.from_bytes(payload[5:7], "little")
+            if index in lost:
+                lost.discard(index)
+                return True
+        return False
+
+    link.drop = drop
+    data = b"x" * (FRAGMENT_SIZE * 20)
+    future = link.a.send(data, 2)
+    link.run()
+    assert future.result(timeout=0)
+    assert len(link.fragmentsSent()) == 22
+    assert link.received[0][2]["data"] == data
+
+
+@pytest.mark.unit
+def test_transfer_refused_when_too_big():
+    """The receiver cancels a transfer over its size limit, failing the sender's future"""
+    link = FakeLink()
+    link.b.maxTransferSize = FRAGMENT_SIZE
+    future = link.a.send(b"y" * (FRAGMENT_SIZE * 3), 2)
+    link.run()
+    with pytest.raises(Transfers.TransferError):
+        future.result(timeout=0)
+    assert not link.b._incoming and not link.received
+
+
+@pytest.mark.unit
+def test_transfer_timeouts():
+    """The sender resends, then gives up, and the receiver drops what it had"""
+    link = FakeLink(retransmitTimeout=0, maxRetries=1, reassemblyTimeout=0, ackEvery=100)
+    link.drop = lambda sender, payload: sender == 1 and payload[0] == KIND_FRAGMENT and payload[5] == 1
+    future = link.a.send(b"z" * (FRAGMENT_SIZE * 3), 2)
+    link.run()
+    assert link.b._incoming
+    link.a._sweep()
+    link.run()
+    assert not future.done()
+    link.b._sweep()
+    assert not link.b._incoming
+    link.a._sweep()
+    with pytest.raises(TimeoutError):
+        future.result(timeout=0)
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_sendLargeData_refuses_broadcast():
+    """Nobody would acknowledge a broadcast transfer"""
+    iface = MeshInterface(noProto=True)
+    with pytest.raises(MeshInterface.MeshInterfaceError):
+        iface.sendLargeData(b"x" * 1000, "^all")
+    iface.close()
@@ -0,0 +1,221 @@
+"""Meshtastic unit tests for tx_scheduler.py"""
+
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+from ..airtime import AirtimeLimiter
+from ..mesh_interface import MeshInterface
+from ..protobuf import mesh_pb2
+from ..tx_scheduler import PendingPackets
+
+Priority = mesh_pb2.MeshPacket.Priority
+
+
+def _packet(packetId: int, priority: mesh_pb2.MeshPacket.Priority.ValueType = Priority.UNSET) -> mesh_pb2.ToRadio:
+    toRadio = mesh_pb2.ToRadio()
+    toRadio.packet.id = packetId
+    toRadio.packet.priority = priority
+    return toRadio
+
+
+def _queueStatus(free: int, packetId: int = 0, res: int = 0) -> mesh_pb2.QueueStatus:
+    qs = mesh_pb2.QueueStatus()
+    qs.free = free
+    qs.maxlen = 16
+    qs.mesh_packet_id = packetId
+    qs.res = res
+    return qs
+
+
+@pytest.fixture(name="iface")
+def fixture_iface():
+    """A MeshInterface whose writes are recorded rather than sent"""
+    iface = MeshInterface(noProto=True)
+    iface.noProto = False
+    iface.written = []
+    iface._sendToRadioImpl = iface.written.append
+    yield iface
+    iface.txScheduler.close()
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_sendToRadio_writes_packet_before_returning(iface):
+    """By default _sendToRadio blocks until the packet has been written"""
+    p = _packet(1)
+    iface._sendToRadio(p)
+    assert iface.written == [p]
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_sendToRadio_control_messages_bypass_queue(iface):
+    """Non packet messages go out even when the radio queue is full"""
+    iface._handleQueueStatusFromRadio(_queueStatus(free=0))
+    hb = mesh_pb2.ToRadio()
+    hb.heartbeat.CopyFrom(mesh_pb2.Heartbeat())
+    iface._sendToRadio(hb)
+    assert iface.written == [hb]
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_scheduler_waits_for_free_slot(iface):
+    """Packets queued while the radio is full go out once a QueueStatus frees a slot"""
+    iface._handleQueueStatusFromRadio(_queueStatus(free=0))
+    futures = [iface.txScheduler.enqueue(_packet(i)) for i in (1, 2)]
+    assert not iface.txScheduler.flush(timeout=0.1)
+    assert iface.written == []
+
+    iface._handleQueueStatusFromRadio(_queueStatus(free=1))
+    assert futures[0].result(timeout=1) == 1
+    assert not futures[1].done()  # we claimed the only free slot
+
+    iface._handleQueueStatusFromRadio(_queueStatus(free=1, packetId=1))
+    assert futures[1].result(timeout=1) == 2
+    assert [w.packet.id for w in iface.written] == [1, 2]
+    assert iface.txScheduler.inflight == 1
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_scheduler_resends_rejected_packet(iface):
+    """A QueueStatus with an error result puts the packet back at the head of the queue"""
+    iface._handleQueueStatusFromRadio(_queueStatus(free=4))
+    iface._sendToRadio(_packet(7))
+    iface._handleQueueStatusFromRadio(_queueStatus(free=4, packetId=7, res=1))
+    assert iface.txScheduler.flush(timeout=1)
+    assert [w.packet.id for w in iface.written] == [7, 7]
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_scheduler_reset_resends_unconfirmed(iface):
+    """Restarting the config sends anything the radio never confirmed again"""
+    iface._handleQueueStatusFromRadio(_queueStatus(free=4))
+    iface._sendToRadio(_packet(1))
+    iface._sendToRadio(_packet(2))
+    iface._handleQueueStatusFromRadio(_queueStatus(free=4, packetId=1))
+    iface._startConfig()
+    assert iface.txScheduler.flush(timeout=1)
+    assert [w.packet.id for w in iface.written if w.HasField("packet")] == [1, 2, 2]
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_scheduler_close_fails_pending(iface):
+    """Packets that never reached the radio fail their future when the interface closes"""
+    iface._handleQueueStatusFromRadio(_queueStatus(free=0))
+    future = iface.txScheduler.enqueue(_packet(1))
+    iface.txScheduler.close()
+    with pytest.raises(MeshInterface.MeshInterfaceError):
+        future.result(timeout=1)
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_sendData_without_waiting(iface):
+    """sendData(wait=False) returns while the radio is still full"""
+    iface.myInfo = None
+    iface._handleQueueStatusFromRadio(_queueStatus(free=0))
+    done = threading.Event()
+
+    def send():
+        iface.sendData(b"hi", wait=False)
+        done.set()
+
+    threading.Thread(target=send, daemon=True).start()
+    assert done.wait(1)
+    assert len(iface.txScheduler) == 1
+    assert iface.written == []
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_scheduler_write_error_fails_future(iface):
+    """An exception from the transport is reported through the future"""
+    iface._sendToRadioImpl = MagicMock(side_effect=OSError("gone"))
+    with pytest.raises(OSError, match="gone"):
+        iface._sendToRadio(_packet(3))
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_scheduler_write_error_frees_slot(iface):
+    """A packet that failed to write gives its radio queue slot back"""
+    iface._handleQueueStatusFromRadio(_queueStatus(free=1))
+    iface._sendToRadioImpl = MagicMock(side_effect=OSError("gone"))
+    with pytest.raises(OSError):
+        iface._sendToRadio(_packet(3))
+    assert iface.queueStatus.free == 1
+    iface._sendToRadioImpl = iface.written.append
+    iface._sendToRadio(_packet(4))
+    assert [w.packet.id for w in iface.written] == [4]
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_scheduler_sends_by_priority(iface):
+    """Alerts and ACKs overtake a backlog of background packets"""
+    iface._handleQueueStatusFromRadio(_queueStatus(free=0))
+    for i in range(1, 4):
+        iface.txScheduler.enqueue(_packet(i, Priority.BACKGROUND))
+    iface.txScheduler.enqueue(_packet(10, Priority.ALERT))
+    iface.txScheduler.enqueue(_packet(11))  # unset counts as DEFAULT
+    iface.txScheduler.enqueue(_packet(12, Priority.ACK))
+    iface._handleQueueStatusFromRadio(_queueStatus(free=8))
+    assert iface.txScheduler.flush(timeout=1)
+    assert [w.packet.id for w in iface.written] == [12, 10, 11, 1, 2, 3]
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_scheduler_batches_only_with_queueStatus(iface):
+    """Without QueueStatus every packet is its own write, so the stream can space them out"""
+    batches = []
+    iface._sendManyToRadioImpl = batches.append
+    scheduler = iface.txScheduler
+    for i in (1, 2, 3):
+        scheduler._pending.add(_packet(i), MagicMock())
+    while scheduler.pump():
+        pass
+    assert [[w.packet.id for w in batch] for batch in batches] == [[1], [2], [3]]
+
+    batches.clear()
+    iface.queueStatus = _queueStatus(free=8)
+    for i in (4, 5, 6):
+        scheduler._pending.add(_packet(i), MagicMock())
+    while scheduler.pump():
+        pass
+    assert [[w.packet.id for w in batch] for batch in batches] == [[4, 5, 6]]
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures("reset_mt_config")
+def test_scheduler_holds_packets_for_airtime(iface):
+    """With the airtime budget spent, packets wait until it refills"""
+    iface.airtimeLimiter = AirtimeLimiter(dutyCycle=100.0, window=0.05)
+    iface._sendToRadio(_packet(1))
+    assert iface.timeUntilSend() > 0
+    future = iface.txScheduler.enqueue(_packet(2))
+    assert not future.done()
+    assert iface.txScheduler.timeUntilSend() > 0
+    assert future.result(timeout=2) == 2
+    assert [w.packet.id for w in iface.written] == [1, 2]
+
+
+@pytest.mark.unit
+def test_PendingPackets_starvation_limit():
+    """A class passed over starvationLimit times gets the next turn, in its own order"""
+    pending = PendingPackets(starvationLimit=2)
+    for i in range(10):
+        pending.add(_packet(i, Priority.RELIABLE), None)
+    pending.add(_packet(100, Priority.BACKGROUND), None)
+    pending.add(_packet(101, Priority.BACKGROUND), None)
+    pending.add(_packet(102, Priority.BACKGROUND), None, first=True)
+    order = [pending.popNext()[0] for _ in range(len(pending))]
+    assert order == [0, 1, 102, 2, 3, 100, 4, 5, 101, 6, 7, 8, 9]
+    assert not pending
+    assert dict(pending.depths()) == {"ack": 0, "alert": 0, "reliable": 0, "default": 0, "background": 0}
@@ -3,6 +3,7 @@
 import json
 import logging
 import re
+import threading
 import time
 from types import SimpleNamespace
 from unittest.mock import patch
@@ -346,6 +347,46 @@ def test_Timeout_waitForWaypoint_found():
     assert to.waitForWaypoint(ack) is True
 
 
+@pytest.mark.unit
+def test_Timeout_wakes_when_acknowledged():
+    """A waiter returns as soon as another thread sets the flag, not on a polling tick"""
+    to = Timeout(5)
+    ack = Acknowledgment()
+    threading.Timer(0.05, lambda: setattr(ack, "receivedNak", True)).start()
+    start = time.monotonic()
+    assert to.waitForAckNak(ack) is True
+    assert time.monotonic() - start < 1
+    assert ack.receivedNak is False
+
+
+@pytest.mark.unit
+def test_Timeout_expireTime_ends_wait():
+    """Setting expireTime to now makes a waitForSet give up straight away"""
+    to = Timeout(5)
+    to.sleepInterval = 5
+    threading.Timer(0.05, lambda: setattr(to, "expireTime", time.time())).start()
+    start = time.monotonic()
+    assert to.waitForSet(SimpleNamespace(foo=None), ("foo",)) is False
+    assert time.monotonic() - start < 1
+
+
+@pytest.mark.unit
+def test_Timeout_wake():
+    """wake() makes waitForSet look again without waiting for sleepInterval"""
+    to = Timeout(5)
+    to.sleepInterval = 5
+    target = SimpleNamespace(foo=None)
+
+    def setFoo():
+        target.foo = 1
+        to.wake()
+
+    threading.Timer(0.05, setFoo).start()
+    start = time.monotonic()
+    assert to.waitForSet(target, ("foo",)) is True
+    assert time.monotonic() - start < 1
+
+
 @pytest.mark.unitslow
 def test_hexstr():
     """Test hexstr()"""
@@ -862,6 +903,8 @@ def test_to_node_num(input_val, expected):
     "!!",
     "!0x10",
     "!xyz",
+    "abcd",  # short hex is a name, not a node id
+    "Bob",
 ])
 def test_to_node_num_invalid(input_val):
     """Test to_node_num raises ValueError for invalid inputs"""
@@ -0,0 +1,75 @@
+"""Hashed timer wheel, for expiring many deadlines cheaply
+"""
+import math
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional, Set
+
+
+class TimerWheel:
+    """Tracks deadlines for keys, and tells which have passed
+
+    Deadlines are kept in a ring of slots, one per tick, so adding and
+    cancelling are O(1) and a sweep only looks at the slots for the ticks that
+    went by since the last one (plus anything in them that is still a lap or more
+    away), rather than at every pending deadline. Deadlines are rounded up to
+    the next tick, so a key expires at most one tick late.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 64) -> None:
+        self.tick = tick
+        self._slots: List[Set[Hashable]] = [set() for _ in range(slots)]
+        self._deadlines: Dict[Hashable, int] = {}  # key -> the tick it expires on
+        self._lock = threading.Lock()
+        self._lastTick = math.floor(time.monotonic() / tick)  # the last tick expire() has looked at
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._deadlines)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._deadlines
+
+    def _tickOf(self, when: float) -> int:
+        return math.ceil(when / self.tick)
+
+    def add(self, key: Hashable, deadline: float) -> None:
+        """Expire key at deadline (a time.monotonic() value), replacing any deadline it had"""
+        with self._lock:
+            self._cancelLocked(key)
+            # never put a key into a slot the sweep has already gone past
+            when = max(self._tickOf(deadline), self._lastTick + 1)
+            self._deadlines[key] = when
+            self._slots[when % len(self._slots)].add(key)
+
+    def cancel(self, key: Hashable) -> bool:
+        """Forget key, returns False if it had no deadline"""
+        with self._lock:
+            return self._cancelLocked(key)
+
+    def _cancelLocked(self, key) -> bool:
+        when = self._deadlines.pop(key, None)
+        if when is None:
+            return False
+        self._slots[when % len(self._slots)].discard(key)
+        return True
+
+    def expire(self, now: Optional[float] = None) -> List[Any]:
+        """Remove and return the keys whose deadline has passed"""
+        if now is None:
+            now = time.monotonic()
+        expired: List[Any] = []
+        with self._lock:
+            nowTick = math.floor(now / self.tick)
+            # a whole lap visits every slot, there is no need to go round again
+            first = max(self._lastTick + 1, nowTick - len(self._slots) + 1)
+            for t in range(first, nowTick + 1):
+                slot = self._slots[t % len(self._slots)]
+                due = [key for key in slot if self._deadlines[key] <= nowTick]
+                for key in sorted(due, key=self._deadlines.__getitem__):
+                    slot.discard(key)
+                    del self._deadlines[key]
+                    expired.append(key)
+            self._lastTick = max(self._lastTick, nowTick)
+        return expired
@@ -0,0 +1,223 @@
+"""The mesh's links between nodes, as a graph
+
+Nodes with the NeighborInfo module tell the mesh which nodes they hear and
+how well, and a traceroute response lists every hop of a route with the SNR
+it was received at. The interface feeds both into `iface.meshGraph`, so at
+any time it holds the links recently seen anywhere in the mesh::
+
+    iface.meshGraph.shortestPath(iface.myInfo.my_node_num, num)
+    iface.meshGraph.articulationPoints()  # nodes whose loss would split the mesh
+    iface.meshGraph.components()
+
+A link is treated as usable both ways, and costs more the worse its SNR, so
+paths prefer fewer, stronger hops. Links not seen again within maxAge seconds
+are forgotten.
+
+Set `iface.autoHopLimit` and packets sent without an explicit hopLimit get
+one just big enough for the best known path (plus a margin), instead of the
+radio's configured hop_limit, when the graph knows a path to the destination.
+"""
+import heapq
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+DEFAULT_MAX_AGE = 3 * 60 * 60
+# Stale links are also dropped every this many addLink calls, so a graph nobody queries stays bounded
+PRUNE_EVERY = 256
+# Link cost is 1 for SNR_GOOD dB or better, one more for every SNR_SCALE dB below that
+SNR_GOOD = 5.0
+SNR_SCALE = 10.0
+# What a link of unknown SNR costs
+UNKNOWN_COST = 1.5
+# What RouteDiscovery has for an SNR it doesn't know
+UNKNOWN_SNR = -128
+
+
+def linkCost(snr: Optional[float]) -> float:
+    """The cost of a hop received at snr dB (None if unknown)"""
+    if snr is None:
+        return UNKNOWN_COST
+    return 1.0 + max(0.0, (SNR_GOOD - snr) / SNR_SCALE)
+
+
+class MeshGraph:
+    """Recently seen links between nodes, see the module docstring"""
+
+    def __init__(self, maxAge: float = DEFAULT_MAX_AGE) -> None:
+        """Constructor
+
+        Keyword Arguments:
+            maxAge -- seconds after which a link we haven't seen again is forgotten
+        """
+        self.maxAge = maxAge
+        self._lock = threading.Lock()
+        # (sender, receiver) -> (snr the receiver heard the sender at, or None, when we learned it)
+        self._links: Dict[Tuple[int, int], Tuple[Optional[float], float]] = {}
+        self._addsSincePrune = 0
+
+    def __len__(self) -> int:
+        """How many links we know, in either direction"""
+        with self._lock:
+            self._pruneLocked(time.monotonic())
+            return len(self._links)
+
+    def addLink(self, sender: int, receiver: int, snr: Optional[float] = None) -> None:
+        """Record that receiver heard sender, at snr dB if known"""
+        if sender == receiver:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._links[(sender, receiver)] = (snr, now)
+            self._addsSincePrune += 1
+            if self._addsSincePrune >= PRUNE_EVERY:
+                self._pruneLocked(now)
+
+    def addRoute(self, route: List[int], snrs: Optional[List[Optional[float]]] = None) -> None:
+        """Record the links along a route, snrs[i] being what route[i + 1] heard route[i] at"""
+        for i in range(len(route) - 1):
+            self.addLink(route[i], route[i + 1], snrs[i] if snrs is not None and i < len(snrs) else None)
+
+    def removeNode(self, num: int) -> None:
+        """Forget every link of a node"""
+        with self._lock:
+            for key in [key for key in self._links if num in key]:
+                del self._links[key]
+
+    def clear(self) -> None:
+        """Forget every link"""
+        with self._lock:
+            self._links.clear()
+
+    def _pruneLocked(self, now: float) -> None:
+        self._addsSincePrune = 0
+        stale = [key for key, (_, seen) in self._links.items() if now - seen > self.maxAge]
+        for key in stale:
+            del self._links[key]
+
+    def _adjacency(self) -> Dict[int, Dict[int, float]]:
+        """node -> neighbor -> cost of the cheapest direction of the link"""
+        with self._lock:
+            self._pruneLocked(time.monotonic())
+            links = list(self._links.items())
+        adjacency: Dict[int, Dict[int, float]] = {}
+        for (a, b), (snr, _) in links:
+            cost = linkCost(snr)
+            for x, y in ((a, b), (b, a)):
+                neighbors = adjacency.setdefault(x, {})
+                if cost < neighbors.get(y, float("inf")):
+                    neighbors[y] = cost
+        return adjacency
+
+    def neighbors(self, num: int) -> Dict[int, Optional[float]]:
+        """The nodes num has a link with, and the best SNR seen on it (None if unknown)"""
+        with self._lock:
+            self._pruneLocked(time.monotonic())
+            result: Dict[int, Optional[float]] = {}
+            for (a, b), (snr, _) in self._links.items():
+                if num in (a, b):
+                    other = b if a == num else a
+                    best = result.get(other)
+                    if other not in result or (snr is not None and (best is None or snr > best)):
+                        result[other] = snr
+            return result
+
+    def nodes(self) -> Set[int]:
+        """Every node with a link"""
+        return set(self._adjacency())
+
+    def shortestPath(self, source: int, destination: int) -> Optional[List[int]]:
+        """The cheapest path from source to destination (both included), None if there is none"""
+        if source == destination:
+            return [source]
+        adjacency = self._adjacency()
+        if source not in adjacency or destination not in adjacency:
+            return None
+        best = {source: 0.0}
+        previous: Dict[int, int] = {}
+        queue = [(0.0, source)]
+        while queue:
+            cost, num = heapq.heappop(queue)
+            if num == destination:
+                path = [num]
+                while num != source:
+                    num = previous[num]
+                    path.append(num)
+                return path[::-1]
+            if cost > best[num]:
+                continue
+            for neighbor, linkCostValue in adjacency[num].items():
+                newCost = cost + linkCostValue
+                if newCost < best.get(neighbor, float("inf")):
+                    best[neighbor] = newCost
+                    previous[neighbor] = num
+                    heapq.heappush(queue, (newCost, neighbor))
+        return None
+
+    def hopLimitFor(self, source: int, destination: int, margin: int = 1) -> Optional[int]:
+        """The hop_limit a packet from source needs to reach destination over the cheapest path,
+        plus margin, None if we know no path"""
+        path = self.shortestPath(source, destination)
+        if path is None:
+            return None
+        return max(0, len(path) - 2) + margin  # every node in between is one relay
+
+    def components(self) -> List[Set[int]]:
+        """The groups of nodes connected to each other, biggest first"""
+        adjacency = self._adjacency()
+        seen: Set[int] = set()
+        result = []
+        for start in adjacency:
+            if start in seen:
+                continue
+            component = {start}
+            stack = [start]
+            while stack:
+                for neighbor in adjacency[stack.pop()]:
+                    if neighbor not in component:
+                        component.add(neighbor)
+                        stack.append(neighbor)
+            seen |= component
+            result.append(component)
+        result.sort(key=len, reverse=True)
+        return result
+
+    def articulationPoints(self) -> Set[int]:
+        """The nodes whose loss would split the part of the mesh they are in"""
+        adjacency = self._adjacency()
+        order: Dict[int, int] = {}
+        low: Dict[int, int] = {}
+        result: Set[int] = set()
+        for root, rootNeighbors in adjacency.items():
+            if root in order:
+                continue
+            order[root] = low[root] = len(order)
+            rootChildren = 0
+            # (node, its parent, iterator over its neighbors)
+            stack = [(root, -1, iter(rootNeighbors))]
+            while stack:
+                num, parent, neighbors = stack[-1]
+                advanced = False
+                for neighbor in neighbors:
+                    if neighbor == parent:
+                        continue
+                    if neighbor in order:
+                        low[num] = min(low[num], order[neighbor])
+                    else:
+                        order[neighbor] = low[neighbor] = len(order)
+                        stack.append((neighbor, num, iter(adjacency[neighbor])))
+                        advanced = True
+                        break
+                if advanced:
+                    continue
+                stack.pop()
+                if parent == -1:
+                    continue
+                low[parent] = min(low[parent], low[num])
+                if parent == root:
+                    rootChildren += 1
+                elif low[num] >= order[parent]:
+                    result.add(parent)
+            if rootChildren > 1:
+                result.add(root)
+        return result
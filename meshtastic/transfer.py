@@ -0,0 +1,428 @@
+"""Send payloads bigger than one packet, split into numbered fragments
+
+sendData refuses anything over DATA_PAYLOAD_LEN. A Transfers object (every
+interface has one, as iface.transfers) splits a larger payload into fragments
+and sends them on TRANSFER_PORTNUM, keeping up to `window` of them unacknowledged
+at a time. The receiver acknowledges them in batches, saying which fragments it
+has, so the sender resends only the ones that went missing::
+
+    future = iface.sendLargeData(blob, "!ba4bf9d0")
+    future.result()  # returns once the other node has all of it
+
+Completed transfers are published as
+meshtastic.transfer.received(data, fromId, transferId, interface).
+Incomplete ones are dropped after reassemblyTimeout seconds without a
+fragment, and a node can't make us buffer more than maxTransferSize bytes for
+one transfer or maxBufferedBytes for all of them.
+
+The wire format is our own, fixed size little endian headers:
+
+- fragment: kind (0), transfer id (u32), index (u16), count (u16), then the data
+- ack: kind (1), transfer id, how many fragments it has from the start (u16),
+  then a bitmap of which of the next ACK_BITMAP_BITS it has too
+- cancel: kind (2), transfer id, reason (u8) - the receiver won't take it, or the
+  sender has given up
+"""
+import collections
+import logging
+import random
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+from meshtastic.protobuf import mesh_pb2
+
+logger = logging.getLogger(__name__)
+
+# In the private range (PRIVATE_APP to MAX), and not one the firmware assigns
+TRANSFER_PORTNUM = 300
+
+KIND_FRAGMENT = 0
+KIND_ACK = 1
+KIND_CANCEL = 2
+
+CANCEL_TOO_BIG = 1  # more than maxTransferSize
+CANCEL_NO_ROOM = 2  # would take us over maxBufferedBytes
+CANCEL_ABORTED = 3  # the sender gave up
+
+_FRAGMENT = struct.Struct("<BIHH")
+_ACK = struct.Struct("<BIH")
+_CANCEL = struct.Struct("<BIB")
+ACK_BITMAP_BITS = 64
+
+FRAGMENT_SIZE = mesh_pb2.Constants.DATA_PAYLOAD_LEN - _FRAGMENT.size
+MAX_FRAGMENTS = 0xFFFF
+
+DEFAULT_WINDOW = 8
+DEFAULT_ACK_EVERY = 4  # the receiver acknowledges after this many new fragments...
+DEFAULT_ACK_DELAY = 2.0  # ...or this many seconds after the first one it hasn't acknowledged
+DEFAULT_RETRANSMIT_TIMEOUT = 20.0
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_REASSEMBLY_TIMEOUT = 120.0
+DEFAULT_MAX_TRANSFER_SIZE = 1024 * 1024
+DEFAULT_MAX_BUFFERED_BYTES = 4 * 1024 * 1024
+# How often timers (retransmits, delayed acks, expiry) are checked, while any transfer is active
+SWEEP_INTERVAL = 1.0
+# Transfers we have completed are remembered, so a sender that missed our last ack gets it again
+COMPLETED_MEMORY = 64
+
+
+class _Outgoing:
+    """A transfer we are sending"""
+
+    def __init__(self, transferId: int, destination: Union[int, str], data: bytes, channelIndex: int) -> None:
+        self.transferId = transferId
+        self.destination = destination
+        self.channelIndex = channelIndex
+        self.fragments = [data[i : i + FRAGMENT_SIZE] for i in range(0, len(data), FRAGMENT_SIZE)] or [b""]
+        self.acked: Set[int] = set()
+        self.base = 0  # lowest fragment not yet acknowledged
+        self.next = 0  # next fragment never sent
+        self.sendSeq: Dict[int, int] = {}  # fragment -> sequence number it was last sent with
+        self.seq = 0
+        self.lastProgress = time.monotonic()
+        self.retries = 0
+        self.future: Future = Future()
+
+    @property
+    def count(self) -> int:
+        """How many fragments the data was split into"""
+        return len(self.fragments)
+
+
+class _Incoming:
+    """A transfer we are reassembling"""
+
+    def __init__(self, count: int, channelIndex: int) -> None:
+        self.count = count
+        self.channelIndex = channelIndex
+        self.fragments: Dict[int, bytes] = {}
+        self.size = 0
+        self.prefix = 0  # fragments 0..prefix-1 have all arrived
+        self.unacked = 0  # new fragments since our last ack
+        self.ackDue: Optional[float] = None  # when a delayed ack is owed
+        self.lastHeard = time.monotonic()
+
+    def add(self, index: int, chunk: bytes) -> bool:
+        """Store a fragment, returns False if we already had it"""
+        if index in self.fragments:
+            return False
+        self.fragments[index] = chunk
+        self.size += len(chunk)
+        while self.prefix in self.fragments:
+            self.prefix += 1
+        return True
+
+    def ack(self, transferId: int) -> bytes:
+        """Our acknowledgement of everything that has arrived so far"""
+        self.unacked = 0
+        self.ackDue = None
+        bitmap = 0
+        for bit in range(ACK_BITMAP_BITS):
+            if self.prefix + 1 + bit in self.fragments:
+                bitmap |= 1 << bit
+        return _ACK.pack(KIND_ACK, transferId, self.prefix) + bitmap.to_bytes(ACK_BITMAP_BITS // 8, "little")
+
+
+class Transfers:
+    """Large payload transport for one interface, see the module docstring"""
+
+    class TransferError(Exception):
+        """A transfer could not be completed"""
+
+        def __init__(self, message):
+            self.message = message
+            super().__init__(self.message)
+
+    def __init__(
+        self,
+        iface,
+        *,
+        window: int = DEFAULT_WINDOW,
+        retransmitTimeout: float = DEFAULT_RETRANSMIT_TIMEOUT,
+        maxRetries: int = DEFAULT_MAX_RETRIES,
+        ackEvery: int = DEFAULT_ACK_EVERY,
+        ackDelay: float = DEFAULT_ACK_DELAY,
+        reassemblyTimeout: float = DEFAULT_REASSEMBLY_TIMEOUT,
+        maxTransferSize: int = DEFAULT_MAX_TRANSFER_SIZE,
+        maxBufferedBytes: int = DEFAULT_MAX_BUFFERED_BYTES,
+    ) -> None:
+        """Constructor
+
+        Keyword Arguments:
+            iface -- Interface to send fragments and acks through, and publish completed transfers on
+            window -- Fragments we may have sent but not had acknowledged
+            retransmitTimeout -- Seconds without an ack before unacknowledged fragments are resent
+            maxRetries -- Resends without progress before an outgoing transfer fails
+            ackEvery -- New fragments a receiver takes before acknowledging them
+            ackDelay -- Seconds a receiver waits before acknowledging fewer than ackEvery
+            reassemblyTimeout -- Seconds without a fragment before an incoming transfer is dropped
+            maxTransferSize -- Largest transfer we accept, in bytes
+            maxBufferedBytes -- Bytes of incoming transfers we hold at once
+        """
+        self.iface = iface
+        self.window = window
+        self.retransmitTimeout = retransmitTimeout
+        self.maxRetries = maxRetries
+        self.ackEvery = ackEvery
+        self.ackDelay = ackDelay
+        self.reassemblyTimeout = reassemblyTimeout
+        self.maxTransferSize = maxTransferSize
+        self.maxBufferedBytes = maxBufferedBytes
+        self._lock = threading.Lock()
+        self._outgoing: Dict[int, _Outgoing] = {}
+        self._incoming: Dict[Tuple[int, int], _Incoming] = {}  # (from, transfer id) -> reassembly
+        self._completed: collections.OrderedDict = collections.OrderedDict()  # (from, transfer id) -> final ack
+        self._sweepTimer: Optional[Any] = None
+
+    def send(self, data: bytes, destinationId: Union[int, str], channelIndex: int = 0) -> Future:
+        """Start sending data to destinationId, returns a Future resolving to the transfer id once it has all arrived
+
+        The future fails with TimeoutError if the receiver stops acknowledging,
+        or TransferError if it refuses the transfer. Transfers can't be broadcast,
+        there would be no one to acknowledge them.
+        """
+        if len(data) > FRAGMENT_SIZE * MAX_FRAGMENTS:
+            raise Transfers.TransferError("Data too big for one transfer")
+        with self._lock:
+            transferId = random.randint(1, 0xFFFFFFFF)
+            while transferId in self._outgoing:
+                transferId = random.randint(1, 0xFFFFFFFF)
+            transfer = _Outgoing(transferId, destinationId, bytes(data), channelIndex)
+            self._outgoing[transferId] = transfer
+            toSend = self._fillWindowLocked(transfer)
+        logger.debug(f"Sending transfer {transferId:08x}: {len(data)} bytes in {transfer.count} fragments")
+        self._sendFragments(transfer, toSend)
+        self._scheduleSweep()
+        return transfer.future
+
+    def close(self) -> None:
+        """Give up on everything in progress"""
+        with self._lock:
+            outgoing = list(self._outgoing.values())
+            self._outgoing.clear()
+            self._incoming.clear()
+            if self._sweepTimer is not None:
+                self._sweepTimer.cancel()
+                self._sweepTimer = None
+        for transfer in outgoing:
+            if not transfer.future.done():
+                transfer.future.set_exception(Transfers.TransferError("Interface closed during transfer"))
+
+    def onPacket(self, meshPacket: mesh_pb2.MeshPacket) -> None:
+        """Handle a packet received on TRANSFER_PORTNUM"""
+        payload = meshPacket.decoded.payload
+        sender = getattr(meshPacket, "from")
+        if not payload:
+            return
+        kind = payload[0]
+        try:
+            if kind == KIND_FRAGMENT:
+                self._onFragment(sender, meshPacket.channel, payload)
+            elif kind == KIND_ACK:
+                self._onAck(payload)
+            elif kind == KIND_CANCEL:
+                self._onCancel(sender, payload)
+            else:
+                logger.debug(f"Ignoring transfer message of unknown kind {kind}")
+        except struct.error:
+            logger.warning(f"Malformed transfer message from {sender}")
+
+    # Sending
+
+    def _fillWindowLocked(self, transfer: _Outgoing) -> List[int]:
+        """Claim the fragments the window now has room for"""
+        toSend = []
+        while transfer.next < transfer.count and transfer.next < transfer.base + self.window:
+            toSend.append(transfer.next)
+            transfer.next += 1
+        for index in toSend:
+            self._stampLocked(transfer, index)
+        return toSend
+
+    @staticmethod
+    def _stampLocked(transfer: _Outgoing, index: int) -> None:
+        transfer.seq += 1
+        transfer.sendSeq[index] = transfer.seq
+
+    def _sendFragments(self, transfer: _Outgoing, indexes: List[int]) -> None:
+        for index in indexes:
+            header = _FRAGMENT.pack(KIND_FRAGMENT, transfer.transferId, index, transfer.count)
+            self._sendRaw(header + transfer.fragments[index], transfer.destination, transfer.channelIndex,
+                          mesh_pb2.MeshPacket.Priority.BACKGROUND)
+
+    def _sendRaw(self, payload: bytes, destination: Union[int, str], channelIndex: int, priority) -> None:
+        try:
+            self.iface.sendData(
+                payload,
+                destination,
+                portNum=TRANSFER_PORTNUM,
+                channelIndex=channelIndex,
+                priority=priority,
+                wait=False,
+            )
+        except Exception as ex:
+            logger.error(f"Could not send transfer message: {ex}")
+
+    def _onAck(self, payload: bytes) -> None:
+        _, transferId, prefix = _ACK.unpack_from(payload)
+        bitmap = int.from_bytes(payload[_ACK.size : _ACK.size + ACK_BITMAP_BITS // 8], "little")
+        with self._lock:
+            transfer = self._outgoing.get(transferId)
+            if transfer is None:
+                return
+            received = set(range(min(prefix, transfer.count)))
+            received.update(prefix + 1 + bit for bit in range(ACK_BITMAP_BITS) if bitmap >> bit & 1)
+            received = {i for i in received if i < transfer.next}
+            new = received - transfer.acked
+            if new:
+                transfer.acked |= new
+                transfer.lastProgress = time.monotonic()
+                transfer.retries = 0
+            while transfer.base in transfer.acked:
+                transfer.base += 1
+            if transfer.base >= transfer.count:
+                del self._outgoing[transferId]
+                done = True
+                toSend = []
+            else:
+                done = False
+                # a fragment sent before one that has arrived is lost, not just slow
+                newest = max((transfer.sendSeq[i] for i in received), default=0)
+                toSend = [
+                    i for i in range(transfer.base, transfer.next)
+                    if i not in transfer.acked and transfer.sendSeq[i] < newest
+                ]
+                for index in toSend:
+                    self._stampLocked(transfer, index)
+                toSend += self._fillWindowLocked(transfer)
+        if done:
+            logger.debug(f"Transfer {transferId:08x} complete")
+            if not transfer.future.done():
+                transfer.future.set_result(transferId)
+        else:
+            self._sendFragments(transfer, toSend)
+
+    def _onCancel(self, sender: int, payload: bytes) -> None:
+        _, transferId, reason = _CANCEL.unpack_from(payload)
+        with self._lock:
+            if reason == CANCEL_ABORTED:
+                self._incoming.pop((sender, transferId), None)
+                return
+            transfer = self._outgoing.pop(transferId, None)
+        if transfer is not None and not transfer.future.done():
+            transfer.future.set_exception(Transfers.TransferError(f"Receiver refused the transfer (reason {reason})"))
+
+    # Receiving
+
+    def _onFragment(self, sender: int, channelIndex: int, payload: bytes) -> None:
+        _, transferId, index, count = _FRAGMENT.unpack_from(payload)
+        chunk = payload[_FRAGMENT.size :]
+        key = (sender, transferId)
+        reply: Optional[bytes] = None
+        data: Optional[bytes] = None
+        with self._lock:
+            if key in self._completed:
+                reply = self._completed[key]  # our last ack went missing
+            else:
+                transfer = self._incoming.get(key)
+                if transfer is None:
+                    reason = self._refuseLocked(count)
+                    if reason:
+                        logger.warning(f"Refusing transfer {transferId:08x} of {count} fragments from {sender}")
+                        reply = _CANCEL.pack(KIND_CANCEL, transferId, reason)
+                    else:
+                        transfer = self._incoming[key] = _Incoming(count, channelIndex)
+                if transfer is not None and index < transfer.count:
+                    transfer.lastHeard = time.monotonic()
+                    if not transfer.add(index, chunk):
+                        reply = transfer.ack(transferId)  # a resend, so the sender is missing an ack
+                    elif self._bufferedLocked() > self.maxBufferedBytes:
+                        del self._incoming[key]
+                        reply = _CANCEL.pack(KIND_CANCEL, transferId, CANCEL_NO_ROOM)
+                    elif transfer.prefix == transfer.count:
+                        del self._incoming[key]
+                        reply = transfer.ack(transferId)
+                        self._rememberLocked(key, reply)
+                        data = b"".join(transfer.fragments[i] for i in range(transfer.count))
+                    else:
+                        transfer.unacked += 1
+                        if transfer.unacked >= self.ackEvery:
+                            reply = transfer.ack(transferId)
+                        elif transfer.ackDue is None:
+                            transfer.ackDue = time.monotonic() + self.ackDelay
+        if reply is not None:
+            self._sendRaw(reply, sender, channelIndex, mesh_pb2.MeshPacket.Priority.RELIABLE)
+        if data is not None:
+            logger.debug(f"Received transfer {transferId:08x}: {len(data)} bytes from {sender}")
+            self.iface._publish(
+                "meshtastic.transfer.received",
+                sender=sender,
+                data=data,
+                fromId=self.iface._nodeNumToId(sender, False),
+                transferId=transferId,
+            )
+        self._scheduleSweep()
+
+    def _refuseLocked(self, count: int) -> int:
+        """Why we won't start receiving a transfer of count fragments, or 0 if we will"""
+        if count > MAX_FRAGMENTS or (count - 1) * FRAGMENT_SIZE > self.maxTransferSize:
+            return CANCEL_TOO_BIG
+        return 0
+
+    def _bufferedLocked(self) -> int:
+        return sum(t.size for t in self._incoming.values())
+
+    def _rememberLocked(self, key: Tuple[int, int], ack: bytes) -> None:
+        self._completed[key] = ack
+        while len(self._completed) > COMPLETED_MEMORY:
+            self._completed.popitem(last=False)
+
+    # Timers
+
+    def _scheduleSweep(self) -> None:
+        with self._lock:
+            if self._sweepTimer is None and (self._outgoing or self._incoming):
+                self._sweepTimer = self.iface._callLater(SWEEP_INTERVAL, self._sweep)
+
+    def _sweep(self) -> None:
+        """Resend what has gone unacknowledged, send delayed acks and drop stalled reassemblies"""
+        now = time.monotonic()
+        resend: List[Tuple[_Outgoing, List[int]]] = []
+        failed: List[_Outgoing] = []
+        acks: List[Tuple[bytes, int, int]] = []
+        with self._lock:
+            self._sweepTimer = None
+            for transferId, transfer in list(self._outgoing.items()):
+                if now - transfer.lastProgress < self.retransmitTimeout:
+                    continue
+                if transfer.retries >= self.maxRetries:
+                    del self._outgoing[transferId]
+                    failed.append(transfer)
+                    continue
+                transfer.retries += 1
+                transfer.lastProgress = now
+                indexes = [i for i in range(transfer.base, transfer.next) if i not in transfer.acked]
+                for index in indexes:
+                    self._stampLocked(transfer, index)
+                resend.append((transfer, indexes))
+            for key, incoming in list(self._incoming.items()):
+                if now - incoming.lastHeard >= self.reassemblyTimeout:
+                    logger.debug(f"Dropping incomplete transfer {key[1]:08x} from {key[0]}")
+                    del self._incoming[key]
+                elif incoming.ackDue is not None and now >= incoming.ackDue:
+                    acks.append((incoming.ack(key[1]), key[0], incoming.channelIndex))
+        for transfer in failed:
+            logger.warning(f"Giving up on transfer {transfer.transferId:08x}, no acknowledgement")
+            self._sendRaw(_CANCEL.pack(KIND_CANCEL, transfer.transferId, CANCEL_ABORTED), transfer.destination,
+                          transfer.channelIndex, mesh_pb2.MeshPacket.Priority.RELIABLE)
+            if not transfer.future.done():
+                transfer.future.set_exception(TimeoutError("Receiver stopped acknowledging the transfer"))
+        for transfer, indexes in resend:
+            logger.debug(f"Resending {len(indexes)} fragments of transfer {transfer.transferId:08x}")
+            self._sendFragments(transfer, indexes)
+        for ack, sender, channelIndex in acks:
+            self._sendRaw(ack, sender, channelIndex, mesh_pb2.MeshPacket.Priority.RELIABLE)
+        self._scheduleSweep()
@@ -209,11 +209,10 @@ class Tunnel:
         if ipBits == 0xFFFF:
             return "^all"
 
-        for node in self.iface.nodes.values():
-            nodeNum = node["num"] & 0xFFFF
-            # logger.debug(f"Considering nodenum 0x{nodeNum:x} for ipBits 0x{ipBits:x}")
-            if (nodeNum) == ipBits:
-                return node["user"]["id"]
+        for nodeNum in self.iface.nodeIndex.byLow16(ipBits):
+            nodeId = self.iface._nodeNumToId(nodeNum)
+            if nodeId is not None:
+                return nodeId
         return None
 
     def _nodeNumToIp(self, nodeNum):
@@ -0,0 +1,365 @@
+"""Event driven scheduler that feeds MeshPackets to the radio's TX queue
+"""
+import collections
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from meshtastic.protobuf import mesh_pb2
+
+logger = logging.getLogger(__name__)
+
+# Most packets we will coalesce into a single write to the radio
+MAX_BATCH_SIZE = 8
+
+_Priority = mesh_pb2.MeshPacket.Priority
+# Queues the scheduler keeps, highest first, each with the lowest MeshPacket.priority it takes
+PRIORITY_CLASSES: Tuple[Tuple[str, int], ...] = (
+    ("ack", _Priority.ACK),
+    ("alert", _Priority.HIGH),
+    ("reliable", _Priority.RELIABLE),
+    ("default", _Priority.DEFAULT),
+    ("background", _Priority.UNSET),
+)
+# A waiting class gets a turn after this many packets from the classes above it
+STARVATION_LIMIT = 8
+
+
+class PendingPackets:
+    """Packets waiting to be written, in one FIFO per priority class
+
+    popNext() takes from the highest priority class with anything in it, so a
+    burst of background telemetry can't hold up ACKs or alerts. To keep the
+    lower classes moving on a busy link, a class that has been passed over
+    starvationLimit times in a row is served next regardless.
+    """
+
+    def __init__(self, starvationLimit: int = STARVATION_LIMIT) -> None:
+        self.starvationLimit = starvationLimit
+        # packet id -> (ToRadio, Future), one per entry of PRIORITY_CLASSES
+        self._queues: List[collections.OrderedDict] = [collections.OrderedDict() for _ in PRIORITY_CLASSES]
+        self._skipped = [0] * len(PRIORITY_CLASSES)  # times each class was passed over since it last sent
+        self._classOf: Dict[int, int] = {}  # packet id -> index into _queues
+
+    def __len__(self) -> int:
+        return len(self._classOf)
+
+    def __contains__(self, packetId) -> bool:
+        return packetId in self._classOf
+
+    def depths(self) -> List[Tuple[str, int]]:
+        """(class name, packets waiting) for each class, highest first"""
+        return [(name, len(q)) for (name, _), q in zip(PRIORITY_CLASSES, self._queues)]
+
+    @staticmethod
+    def classFor(priority: int) -> int:
+        """Index of the class a MeshPacket.priority goes in. Unset is treated as DEFAULT, as the radio does."""
+        if priority == _Priority.UNSET:
+            priority = _Priority.DEFAULT
+        for i, (_, lowest) in enumerate(PRIORITY_CLASSES):
+            if priority >= lowest:
+                return i
+        return len(PRIORITY_CLASSES) - 1
+
+    def add(self, toRadio: mesh_pb2.ToRadio, future: Future, first: bool = False) -> None:
+        """Queue toRadio behind the others of its class, or in front of them if first"""
+        packetId = toRadio.packet.id
+        cls = self.classFor(toRadio.packet.priority)
+        queue = self._queues[cls]
+        queue[packetId] = (toRadio, future)
+        if first:
+            queue.move_to_end(packetId, last=False)
+        self._classOf[packetId] = cls
+
+    def _nextClass(self, waiting: List[int]) -> int:
+        if not waiting:
+            raise KeyError("No packets pending")
+        starved = [i for i in waiting if self._skipped[i] >= self.starvationLimit]
+        return starved[0] if starved else waiting[0]
+
+    def peekNext(self) -> mesh_pb2.ToRadio:
+        """The packet popNext() would return, left where it is"""
+        cls = self._nextClass([i for i, q in enumerate(self._queues) if q])
+        return next(iter(self._queues[cls].values()))[0]
+
+    def popNext(self) -> Tuple[int, mesh_pb2.ToRadio, Future]:
+        """Remove and return the packet that should be written next"""
+        waiting = [i for i, q in enumerate(self._queues) if q]
+        cls = self._nextClass(waiting)
+        for i in waiting:
+            if i > cls:
+                self._skipped[i] += 1
+        self._skipped[cls] = 0
+        packetId, (toRadio, future) = self._queues[cls].popitem(last=False)
+        del self._classOf[packetId]
+        return packetId, toRadio, future
+
+    def values(self) -> Iterator[Tuple[mesh_pb2.ToRadio, Future]]:
+        """Everything waiting, highest class first"""
+        for q in self._queues:
+            yield from q.values()
+
+    def clear(self) -> None:
+        """Forget everything waiting"""
+        for q in self._queues:
+            q.clear()
+        self._classOf.clear()
+        self._skipped = [0] * len(PRIORITY_CLASSES)
+
+
+class TxScheduler:
+    """Sends queued MeshPackets as soon as the radio reports a free TX slot
+
+    The radio tells us how much room is left in its queue with QueueStatus
+    messages. Rather than polling that, the scheduler thread sleeps on a
+    condition variable which onQueueStatus() notifies, so a packet goes out as
+    soon as a slot frees up. Packets that have been written but not yet
+    confirmed by a QueueStatus are kept as in flight, and are sent again if the
+    radio rejects them or the connection restarts. When several packets fit in
+    the radio's queue they are handed to the transport as one batch, so stream
+    interfaces can coalesce them into a single write; radios that don't report
+    QueueStatus get one packet per write. If the interface has an
+    outbox, packets are recorded in it until the radio accepts them, and
+    restore() queues whatever it still holds. The outbox is only ever
+    written with the condition released, so a slow disk holds up the thread
+    writing to it and nobody else. Waiting packets are
+    written in MeshPacket.priority order, see PendingPackets. If the interface
+    has an airtimeLimiter, each packet also waits until it fits in the airtime
+    budget.
+    """
+
+    def __init__(self, iface, name: str = "tx scheduler") -> None:
+        self.iface = iface
+        self.name = name
+        self._cond = threading.Condition()
+        # held while writing to the radio, so packets and control messages never interleave on the wire
+        self.writeLock = threading.RLock()
+        self._pending = PendingPackets()
+        self._inflight: collections.OrderedDict = collections.OrderedDict()  # packet id -> ToRadio
+        self._writing = False
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def __len__(self) -> int:
+        """Number of packets waiting to be written"""
+        with self._cond:
+            return len(self._pending)
+
+    @property
+    def inflight(self) -> int:
+        """Number of packets written but not yet confirmed by the radio"""
+        with self._cond:
+            return len(self._inflight)
+
+    def enqueue(self, toRadio: mesh_pb2.ToRadio) -> Future:
+        """Queue a ToRadio carrying a MeshPacket, without blocking
+
+        Returns a Future that resolves to the packet id once it has been
+        written to the radio.
+        """
+        future: Future = Future()
+        if self._closed:
+            future.set_exception(self.iface.MeshInterfaceError("Interface is closed"))
+            return future
+        if self.iface.outbox is not None:
+            # on disk before it can be written, so its removal can't come first
+            self.iface.outbox.add(toRadio)
+        with self._cond:
+            if self._closed:
+                future.set_exception(self.iface.MeshInterfaceError("Interface is closed"))
+                return future
+            self._pending.add(toRadio, future)
+            self._startLocked()
+            self._notifyLocked()
+        return future
+
+    def sendNow(self, toRadio: mesh_pb2.ToRadio) -> None:
+        """Write a control message (heartbeat, want_config, ...) immediately, bypassing the queue"""
+        with self.writeLock:
+            self.iface._sendToRadioImpl(toRadio)
+
+    def onQueueStatus(self, queueStatus: mesh_pb2.QueueStatus) -> None:
+        """Called when the radio reports its TX queue state, wakes the scheduler thread"""
+        packetId = queueStatus.mesh_packet_id
+        with self._cond:
+            toRadio = self._inflight.pop(packetId, None)
+            if queueStatus.res and toRadio is not None:
+                logger.debug(f"Radio rejected packet ID {packetId:08x} (res={queueStatus.res}), requeueing")
+                self._requeueLocked([(packetId, toRadio)])
+            elif toRadio is None and packetId != 0 and packetId not in self._pending:
+                logger.debug(f"Reply for unexpected packet ID {packetId:08x}")
+            self._notifyLocked()
+        if not queueStatus.res and toRadio is not None and self.iface.outbox is not None:
+            self.iface.outbox.remove([packetId])
+
+    def reset(self) -> None:
+        """The radio (re)started its config, so nothing in flight will be confirmed: send it again"""
+        with self._cond:
+            if self._inflight:
+                logger.debug(f"Requeueing {len(self._inflight)} unconfirmed packets")
+                self._requeueLocked(list(self._inflight.items()))
+                self._inflight.clear()
+            self._notifyLocked()
+
+    def restore(self) -> None:
+        """Queue again whatever the outbox still holds that we aren't already sending"""
+        outbox = self.iface.outbox
+        if outbox is None:
+            return
+        with self._cond:
+            # confirmed while we read the outbox, they'd otherwise look like they were never sent
+            sending = set(self._inflight)
+        stored = outbox.pending()
+        restored = 0
+        with self._cond:
+            for packetId, toRadio in stored:
+                if packetId in sending or self._closed:
+                    continue
+                if packetId not in self._pending and packetId not in self._inflight:
+                    self._pending.add(toRadio, Future())
+                    restored += 1
+            if restored:
+                logger.info(f"Resending {restored} packets from the outbox")
+                self._startLocked()
+                self._notifyLocked()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every queued packet has been written. Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: (not self._pending and not self._writing) or self._closed, timeout
+            )
+
+    def close(self) -> None:
+        """Stop the scheduler thread and fail anything that was never written"""
+        with self._cond:
+            self._closed = True
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self._inflight.clear()
+            self._notifyLocked()
+        for _, future in pending:
+            future.set_exception(self.iface.MeshInterfaceError("Interface closed before packet was sent"))
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _requeueLocked(self, items) -> None:
+        """Put already written packets back at the head of their queues"""
+        for packetId, toRadio in reversed(items):
+            if packetId not in self._pending:
+                self._pending.add(toRadio, Future(), first=True)
+
+    def _notifyLocked(self) -> None:
+        """Wake whoever drives the queue, called with the condition held"""
+        self._cond.notify_all()
+
+    def _startLocked(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _airtimeWait(self) -> float:
+        """Seconds until the airtime budget lets the next pending packet go"""
+        limiter = self.iface.airtimeLimiter
+        if limiter is None or not self._pending:
+            return 0.0
+        return limiter.timeUntilSend(self._pending.peekNext().packet)
+
+    def _ready(self) -> bool:
+        return self._closed or (
+            bool(self._pending) and self.iface._queueHasFreeSpace() and self._airtimeWait() <= 0
+        )
+
+    def timeUntilSend(self) -> float:
+        """Seconds until the next pending packet is allowed on the air, 0 if nothing is held back by airtime"""
+        with self._cond:
+            return self._airtimeWait()
+
+    def _takeBatchLocked(self) -> List[Tuple[int, mesh_pb2.ToRadio, Future]]:
+        """Claim radio queue slots for as many pending packets as fit"""
+        batch: List[Tuple[int, mesh_pb2.ToRadio, Future]] = []
+        limiter = self.iface.airtimeLimiter
+        # Without QueueStatus we don't know how much room the radio has, so packets
+        # go one per write and the stream interface spaces the writes out
+        limit = MAX_BATCH_SIZE if self.iface.queueStatus is not None else 1
+        while self._pending and self.iface._queueHasFreeSpace() and len(batch) < limit:
+            if self._airtimeWait() > 0:
+                break
+            packetId, toRadio, future = self._pending.popNext()
+            if limiter is not None:
+                limiter.consume(toRadio.packet)
+            if self.iface.queueStatus is not None:
+                # Only track packets the radio will confirm
+                self._inflight[packetId] = toRadio
+            self.iface._queueClaim()
+            batch.append((packetId, toRadio, future))
+        self._writing = bool(batch)
+        return batch
+
+    def _attempting(self, batch) -> None:
+        """Count a write attempt against each packet of batch in the outbox, called without the condition"""
+        if self.iface.outbox is not None:
+            self.iface.outbox.attempted([packetId for packetId, _, _ in batch])
+
+    def _finishBatch(self, batch, ex: Optional[BaseException] = None) -> None:
+        """Resolve the futures of a batch once it has been written (or failed to)"""
+        written: List[int] = []
+        with self._cond:
+            if ex is None:
+                # without QueueStatus there is no confirmation to wait for, writing it is all we can do
+                written = [packetId for packetId, _, _ in batch if packetId not in self._inflight]
+            for packetId, _, future in batch:
+                if ex is not None:
+                    self._inflight.pop(packetId, None)
+                    self.iface._queueRelease()
+                if not future.done():
+                    if ex is not None:
+                        future.set_exception(ex)
+                    else:
+                        future.set_result(packetId)
+            self._writing = False
+            self._notifyLocked()
+        if written and self.iface.outbox is not None:
+            self.iface.outbox.remove(written)
+
+    def pump(self) -> bool:
+        """Write whatever the radio has room for right now, without waiting
+
+        Returns True if a batch was written (or failed to write).
+        """
+        with self._cond:
+            if self._closed or not self._ready():
+                return False
+            batch = self._takeBatchLocked()
+        self._attempting(batch)
+        try:
+            with self.writeLock:
+                self.iface._sendManyToRadioImpl([toRadio for _, toRadio, _ in batch])
+        except Exception as ex:
+            logger.error(f"Error while sending {len(batch)} packets: {ex}")
+            self._finishBatch(batch, ex)
+        else:
+            self._finishBatch(batch)
+        return True
+
+    def inDriverThread(self) -> bool:
+        """True if called from the thread that writes queued packets, which must never wait on them"""
+        return threading.current_thread() is self._thread
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._ready():
+                    delay = self._airtimeWait()
+                    if delay > 0:
+                        logger.debug(f"Waiting {delay:.2f}s for airtime budget")
+                        self._cond.wait(delay)
+                    else:
+                        if self._pending:
+                            logger.debug("Waiting for free space in TX Queue")
+                        self._cond.wait()
+                if self._closed:
+                    return
+            self.pump()
@@ -9,8 +9,6 @@ import subprocess
 import sys
 import threading
 import time
-import traceback
-from queue import Queue
 from typing import Any, Dict, List, NoReturn, Optional, Set, Tuple, Union
 
 from google.protobuf.json_format import MessageToJson
@@ -21,6 +19,7 @@ import requests
 import serial # type: ignore[import-untyped]
 import serial.tools.list_ports # type: ignore[import-untyped]
 
+from meshtastic.dispatcher import ThreadDispatcher
 from meshtastic.supported_device import supported_devices
 from meshtastic.version import get_active_version
 
@@ -194,83 +193,106 @@ class dotdict(dict):
 
 
 class Timeout:
-    """Timeout class"""
+    """Timeout class
+
+    Waits sleep on a condition variable rather than polling, so they return as
+    soon as what they are waiting for happens. Acknowledgment flags notify
+    waiters themselves; code that sets attributes a waitForSet() may be waiting
+    on should call wake(). Setting expireTime (e.g. to now, to give up early)
+    wakes waiters too.
+    """
 
     def __init__(self, maxSecs: int=20) -> None:
-        self.expireTime: Union[int, float] = 0
+        self._expireTime: Union[int, float] = 0
+        # waitForSet() re-checks this often even without a wake(), in case an attribute was set quietly
         self.sleepInterval: float = 0.1
         self.expireTimeout: int = maxSecs
+        self._cond = threading.Condition()
+        self._waitingOn: Optional[threading.Condition] = None  # the condition a waiter is sleeping on
+
+    @property
+    def expireTime(self) -> Union[int, float]:
+        """time.time() at which the current wait gives up"""
+        return self._expireTime
+
+    @expireTime.setter
+    def expireTime(self, value: Union[int, float]) -> None:
+        self._expireTime = value
+        self.wake()
 
     def reset(self, expireTimeout=None):
         """Restart the waitForSet timer"""
         self.expireTime = time.time() + (self.expireTimeout if expireTimeout is None else expireTimeout)
 
+    def wake(self) -> None:
+        """Make waiters check again whether what they are waiting for has happened"""
+        cond = self._waitingOn or self._cond
+        with cond:
+            cond.notify_all()
+
+    def _waitFor(self, cond: threading.Condition, predicate, pollInterval: Optional[float]=None) -> bool:
+        """Wait on cond until predicate() is true (True) or expireTime passes (False)"""
+        with cond:
+            self._waitingOn = cond
+            try:
+                while not predicate():
+                    remaining = self._expireTime - time.time()
+                    if remaining <= 0:
+                        return False
+                    cond.wait(remaining if pollInterval is None else min(remaining, pollInterval))
+                return True
+            finally:
+                self._waitingOn = None
+
+    def _waitForAcknowledgment(self, acknowledgment, attrs) -> bool:
+        """Wait for any of the acknowledgment attrs, and reset the acknowledgment if one arrives"""
+        with acknowledgment.condition:
+            if not self._waitFor(acknowledgment.condition, lambda: any(getattr(acknowledgment, a, None) for a in attrs)):
+                return False
+            acknowledgment.reset()
+            return True
+
     def waitForSet(self, target, attrs=()) -> bool:
         """Block until the specified attributes are set. Returns True if config has been received."""
         self.reset()
-        while time.time() < self.expireTime:
-            if all(map(lambda a: getattr(target, a, None), attrs)):
-                return True
-            time.sleep(self.sleepInterval)
-        return False
+        return self._waitFor(self._cond, lambda: all(getattr(target, a, None) for a in attrs), self.sleepInterval)
 
     def waitForAckNak(
         self, acknowledgment, attrs=("receivedAck", "receivedNak", "receivedImplAck")
     ) -> bool:
         """Block until an ACK or NAK has been received. Returns True if ACK or NAK has been received."""
         self.reset()
-        while time.time() < self.expireTime:
-            if any(map(lambda a: getattr(acknowledgment, a, None), attrs)):
-                acknowledgment.reset()
-                return True
-            time.sleep(self.sleepInterval)
-        return False
+        return self._waitForAcknowledgment(acknowledgment, attrs)
 
     def waitForTraceRoute(self, waitFactor, acknowledgment, attr="receivedTraceRoute") -> bool:
         """Block until traceroute response is received. Returns True if traceroute response has been received."""
         self.reset(self.expireTimeout * waitFactor)
-        while time.time() < self.expireTime:
-            if getattr(acknowledgment, attr, None):
-                acknowledgment.reset()
-                return True
-            time.sleep(self.sleepInterval)
-        return False
+        return self._waitForAcknowledgment(acknowledgment, (attr,))
 
     def waitForTelemetry(self, acknowledgment) -> bool:
         """Block until telemetry response is received. Returns True if telemetry response has been received."""
         self.reset()
-        while time.time() < self.expireTime:
-            if getattr(acknowledgment, "receivedTelemetry", None):
-                acknowledgment.reset()
-                return True
-            time.sleep(self.sleepInterval)
-        return False
+        return self._waitForAcknowledgment(acknowledgment, ("receivedTelemetry",))
 
     def waitForPosition(self, acknowledgment) -> bool:
         """Block until position response is received. Returns True if position response has been received."""
         self.reset()
-        while time.time() < self.expireTime:
-            if getattr(acknowledgment, "receivedPosition", None):
-                acknowledgment.reset()
-                return True
-            time.sleep(self.sleepInterval)
-        return False
+        return self._waitForAcknowledgment(acknowledgment, ("receivedPosition",))
 
     def waitForWaypoint(self, acknowledgment) -> bool:
         """Block until waypoint response is received. Returns True if waypoint response has been received."""
         self.reset()
-        while time.time() < self.expireTime:
-            if getattr(acknowledgment, "receivedWaypoint", None):
-                acknowledgment.reset()
-                return True
-            time.sleep(self.sleepInterval)
-        return False
+        return self._waitForAcknowledgment(acknowledgment, ("receivedWaypoint",))
 
 class Acknowledgment:
     "A class that records which type of acknowledgment was just received, if any."
 
+    condition: threading.Condition
+
     def __init__(self) -> None:
         """initialize"""
+        # notified whenever a flag changes, so Timeout can wait on it
+        super().__setattr__("condition", threading.Condition())
         self.receivedAck = False
         self.receivedNak = False
         self.receivedImplAck = False
@@ -279,6 +301,11 @@ class Acknowledgment:
         self.receivedPosition = False
         self.receivedWaypoint = False
 
+    def __setattr__(self, name, value) -> None:
+        with self.condition:
+            super().__setattr__(name, value)
+            self.condition.notify_all()
+
     def reset(self) -> None:
         """reset"""
         self.receivedAck = False
@@ -290,30 +317,11 @@ class Acknowledgment:
         self.receivedWaypoint = False
 
 
-class DeferredExecution:
+class DeferredExecution(ThreadDispatcher):
     """A thread that accepts closures to run, and runs them as they are received"""
 
     def __init__(self, name) -> None:
-        self.queue: Queue = Queue()
-        # this thread must be marked as daemon, otherwise it will prevent clients from exiting
-        self.thread = threading.Thread(target=self._run, args=(), name=name, daemon=True)
-        self.thread.daemon = True
-        self.thread.start()
-
-    def queueWork(self, runnable) -> None:
-        """Queue up the work"""
-        self.queue.put(runnable)
-
-    def _run(self) -> None:
-        while True:
-            try:
-                o = self.queue.get()
-                o()
-            except:
-                logger.error(
-                    f"Unexpected error in deferred execution {sys.exc_info()[0]}"
-                )
-                print(traceback.format_exc())
+        super().__init__(name)
 
 
 def our_exit(message, return_value=1) -> NoReturn:
@@ -734,7 +742,21 @@ def to_node_num(node_id: Union[int, str]) -> int:
     try:
         return int(s, 10)
     except ValueError:
-        return int(s, 16)
+        pass
+    # only a full node id is taken for unprefixed hex, anything shorter is more likely a name
+    if not re.fullmatch(r"[0-9a-fA-F]{8}", s):
+        raise ValueError(f"Not a node number or node id: {node_id}")
+    return int(s, 16)
+
+
+def parse_node_id(node_id: str) -> Optional[int]:
+    """
+    The node number of a node id like '!1234abcd', '0x1234abcd' or '1234abcd', None if node_id isn't one.
+    """
+    match = re.fullmatch(r"(?:!|0x)([0-9a-f]{1,8})|([0-9a-f]{8})", node_id.strip(), re.IGNORECASE)
+    if match is None:
+        return None
+    return int(match.group(1) or match.group(2), 16)
 
 def flags_to_list(flag_type, flags: int) -> List[str]:
     """Given a flag_type that's a protobuf EnumTypeWrapper, and a flag int, give a list of flags enabled.